@@ -28,7 +28,8 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..',
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'Config')))
 
 from octreconstructionmanager import OctReconstructionManager 
-from configdatamanager import ConfigDataManager 
+from octdatastreammanager import PrefetchingBScanReader, BackgroundBScanWriter, ResumableVolumeWriter
+from reconparamsmanager import load_recon_params 
 
 
 def display_reconstructed_oct_volume( data_shape: tuple=(5312, 512, 512) ) -> np.array :
@@ -56,8 +57,8 @@ def reconstruct_and_save_volume_2disk(file_path: str, file_name_raw: str, file_n
     else:
         print(f"[WARNING:] You've manually entered a target file name:\n{file_name_recon}\nCheck volume output dimensions (HF and DC cropping!)")
     # ----------- Import classes/objects for recon handling ------------
-    # load recon parms from file into json-object
-    JSON = ConfigDataManager(filename=file_name_json_recon_params).load_json_file()
+    # load recon parms from file (once) into validated ReconParams-object
+    params = load_recon_params(file_name_json_recon_params)
     # recon functions
     REC = OctReconstructionManager()
     # ----------- Pre-Reconstruction steps ------------
@@ -73,11 +74,11 @@ def reconstruct_and_save_volume_2disk(file_path: str, file_name_raw: str, file_n
         return prefix
     # ----------- Save file prefix ------------
     # update cropped A-scan length
-    dims_saving = (dims[0]-int(JSON['dc_crop_samples'])-int(JSON['hf_crop_samples']), dims[1], dims[2]) 
+    dims_saving = (dims[0]-params.dc_crop_samples-params.hf_crop_samples, dims[1], dims[2]) 
     # create file to save to
     full_file_path_recon = os.path.join(file_path, parse_prefixes_file_dims(file_name_recon) + str(dims_saving[0]) + 'x' + str(dims_saving[1]) + 'x' + str(dims_saving[2]) + '.bin')
     # returns tuple with middle B-scan and en face OR just enface, depending on flag "is_return_enface" 
-    recon_data = process_buffer_wise(REC, file_name_json_recon_params, 
+    recon_data = process_buffer_wise(REC, params, 
                                      dims, dims_saving, 
                                      full_file_path_raw, full_file_path_recon, 
                                      is_return_enface=is_return_enface, 
@@ -89,10 +90,11 @@ def reconstruct_and_save_volume_2disk(file_path: str, file_name_raw: str, file_n
 
 def process_buffer_wise(REC, json_file_name, dims, dims_saving, full_file_path_raw, full_file_path_recon, 
                         b_scan_start_idx: int=0, is_save_2disk: bool=False, is_save_brightest_aScan: bool=False,
-                        max_idxs: tuple=None, is_return_enface=True) -> None:
+                        max_idxs: tuple=None, is_return_enface=True, n_prefetch: int=4) -> None:
     """ @param: """
     # pre-loop vars for data and proc.-time measurements 
     t1 = time.perf_counter()
+    params = load_recon_params(json_file_name) # parse JSON only once per job (no-op for ReconParams)
     data_size = 0
     b_scan_raw_in_bytes = dims[0] * dims[1]
     if is_return_enface: # generate and return enface only if necessary
@@ -100,21 +102,26 @@ def process_buffer_wise(REC, json_file_name, dims, dims_saving, full_file_path_r
     print("Starting timer for processing...")
     print(f"[INFO:] Expected dimensions of one buffer/B-scan are {dims} (with {b_scan_raw_in_bytes} bytes)\nReturning a cropped, reconstructed B-scan with dims {dims_saving} (with {dims_saving[0]*dims_saving[1]} bytes)")
     # ----------- Loop through data (B-scan-wise), reconstruct and save to file ------------
-    for c_len in tqdm(range(dims[-1])):
-        # open raw file, move pointer to current B-scan and reconstruct
-        with open(full_file_path_raw, 'rb') as f_raw:
-            count = b_scan_raw_in_bytes # file size in bytes
-            offset = ((c_len + b_scan_start_idx) % dims[-1]) * b_scan_raw_in_bytes # offset in bytes
-            # print('\n', count, offset, offset//(dims[0]*dims[1]))
-            raw_buffer = np.fromfile(full_file_path_raw, count=count, offset=offset, dtype='<u2')
-            raw_buffer = np.reshape(raw_buffer, (dims[1],dims[0]))
+    # B-scans are prefetched and reconstructed B-scans are written to disk by background threads (overlapping I/O and compute)
+    b_scan_indices = [(c_len + b_scan_start_idx) % dims[-1] for c_len in range(dims[-1])]
+    # output file is preallocated and every B-scan is written to its own offset, i.e. re-runs overwrite instead of append
+    # (no resuming here, since the middle B-scan and en face are computed from all B-scans)
+    reader = PrefetchingBScanReader(full_file_path_raw, dims, b_scan_indices, dtype='<u2', n_prefetch=n_prefetch)
+    if is_save_2disk:
+        recon_b_scan_in_bytes = REC.get_reconstruction_plan_from_params(dims[0], params, is_crop=False).l_out * dims[1] # uint8
+        volume_writer = ResumableVolumeWriter(full_file_path_recon, dims[-1], recon_b_scan_in_bytes, is_resume=False)
+        writer = BackgroundBScanWriter(volume_writer)
+    else:
+        writer = None
+    try:
+        for c_len, raw_buffer in enumerate(tqdm(reader)):
+            # current B-scan (already loaded by reader thread) -> reconstruct
             raw_buffer = raw_buffer.swapaxes(0,1)
-            raw_buffer = np.roll(raw_buffer, (dims[1]//2)-1, axis=1)
+            raw_buffer = np.roll(raw_buffer, (dims[1]//2)-1, axis=1) # copy -> reader can safely reuse its buffer
             if c_len % 2 == 0:
                 raw_buffer = np.roll(raw_buffer, raw_buffer.shape[1]//2, axis=1)
             # print(f"{c_len} Size of raw buffer {raw_buffer.size} bytes in {raw_buffer.dtype}")
-            recon_buffer = REC._run_reconstruction_from_json(buffer=raw_buffer,
-                                                             json_config_file_path=json_file_name)
+            recon_buffer = REC._run_reconstruction_from_params(buffer=raw_buffer, params=params)
             # option to save max-index scans to disk - needs max_idxs as tuple with pos. of brightest A-scans
             if is_save_brightest_aScan:
                 assert len(max_idxs) == 2
@@ -130,13 +137,17 @@ def process_buffer_wise(REC, json_file_name, dims, dims_saving, full_file_path_r
                 enface[:,c_len] = np.max(recon_buffer, axis=0)
             # sanity check if processing size matches expected data size
             data_size += raw_buffer.size * raw_buffer.itemsize # counter increment of current recon-buffer size 
-        # option to save current reconstructed buffer to disk (serialized, as one big *-BIN-file)
-        if is_save_2disk:
-            with open(full_file_path_recon, 'a+b') as f: # Save to file in binary append mode
-                recon_buffer.astype(np.uint8).tofile(f)
-            # # sanity check for file size - mostly debug
-            if int(recon_buffer.size) != int(dims_saving[0]*dims_saving[1]):
-                print(f"[WARNING:] Saved {recon_buffer.size} bytes to disk (expected {int(dims_saving[0]*dims_saving[1])} bytes)")
+            # option to save current reconstructed buffer to disk (serialized, as one big *-BIN-file)
+            if is_save_2disk:
+                # # sanity check for file size - mostly debug
+                if int(recon_buffer.size) != int(dims_saving[0]*dims_saving[1]):
+                    print(f"[WARNING:] Reconstructed B-scan has {recon_buffer.size} bytes (expected {int(dims_saving[0]*dims_saving[1])} bytes)")
+                writer.write(recon_buffer.astype(np.uint8), c_len)
+    finally:
+        reader.close()
+        if writer is not None:
+            writer.close() # waits until all reconstructed B-scans are written
+            volume_writer.close()
     # display processing time of entire volume
     print(f"Processing took {time.perf_counter()-t1}s")
     # option to return middle B-scan and en face
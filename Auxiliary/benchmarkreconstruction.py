@@ -0,0 +1,218 @@
+"""
+                                        ******
+        Author: @Philipp Matten - philipp.matten@meduniwien.ac.at / philipp.matten@gmx.de
+
+                                    Copyright 2023
+                                        ******
+
+        >>> Benchmark suite of the OCT reconstruction: times each stage of < OctReconstructionManager > and the
+            end-to-end large-volume paths on synthetic fringes (< octfringesimulator.py >) at production sizes and
+            writes A-scans/s, MB/s and peak RSS to a JSON-file, i.e. to compare commits on the same machine
+
+"""
+
+# global imports
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import threading
+import subprocess
+import numpy as np
+
+# custom imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'BackEnd')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'Config')))
+
+from octreconstructionmanager import OctReconstructionManager
+from octfringesimulator import FringeParams, simulate_bScan, write_synthetic_volume
+from octfftbackend import get_fft_backend
+from octmemoryprofiler import get_rss_bytes
+from reconparamsmanager import load_recon_params
+
+
+# (aLen, bLen) of the benchmarked B-scans
+BENCHMARK_SIZES = ((1024, 512), (6656, 700), (13312, 512))
+
+
+def get_peak_rss_bytes(is_children: bool=False) -> int :
+    """ returns the peak resident set size of this process (or the largest of its terminated child processes)
+    since its start, None if it can not be determined on this platform
+    >>> never decreases -> only reported once per run, the peaks of the stages are sampled (see < RssSampler >) """
+    try :
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN if is_children else resource.RUSAGE_SELF).ru_maxrss
+        return int(peak) if sys.platform == 'darwin' else int(peak) * 1024 # kilobytes on Linux
+    except ImportError : # i.e. Windows
+        pass
+    try :
+        import psutil
+        return None if is_children else int(psutil.Process().memory_info().peak_wset)
+    except (ImportError, AttributeError) :
+        return None
+
+def get_git_revision() -> dict :
+    """ returns the commit hash and the state of the working tree of the repository, if git is available """
+    repo_path = os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..'))
+    try :
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_path, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo_path, capture_output=True, text=True, check=True).stdout
+        return {'commit': commit, 'is_dirty': len(status.strip()) > 0}
+    except (OSError, subprocess.CalledProcessError) :
+        return {'commit': None, 'is_dirty': None}
+
+def get_machine_info() -> dict :
+    """ returns the host, library versions and FFT backend, which the results depend on """
+    import scipy
+    return {'host': platform.node(), 'platform': platform.platform(), 'processor': platform.processor(),
+            'cpu_count': os.cpu_count(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'scipy': scipy.__version__, 'fft_backend': get_fft_backend().get_capabilities()}
+
+class RssSampler() :
+    """
+    >>> Context manager, that samples the resident set size of this process in a background thread and keeps its peak,
+    i.e. the peak RSS of one stage (unlike ru_maxrss, which is the peak since the start of the process)
+    NOTE: peaks shorter than the sampling interval can be missed, worker processes are not included
+    """
+    def __init__(self, interval: float=0.002) -> None :
+        self.interval = interval
+        self.peak_rss_bytes = None
+
+    def __enter__(self) :
+        self.peak_rss_bytes = get_rss_bytes()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None :
+        self._stop_event.set()
+        self._thread.join()
+        self._update_peak()
+
+    def _sample(self) -> None :
+        while not self._stop_event.wait(self.interval) :
+            self._update_peak()
+
+    def _update_peak(self) -> None :
+        rss = get_rss_bytes()
+        if rss is not None :
+            self.peak_rss_bytes = max(self.peak_rss_bytes or 0, rss)
+
+def time_function(fct, n_repeats: int=3) -> tuple :
+    """ returns the (best of n_repeats) runtime of fct() in seconds and the (sampled) peak RSS in bytes while it ran """
+    timings = []
+    with RssSampler() as sampler :
+        for _ in range(n_repeats) :
+            t1 = time.perf_counter()
+            fct()
+            timings.append(time.perf_counter() - t1)
+    return min(timings), sampler.peak_rss_bytes
+
+def _get_result(size: tuple, stage: str, fft_mode: str, timing: tuple, n_aScans: int, n_bytes_raw: int) -> dict :
+    seconds, peak_rss_bytes = timing
+    result = {'size': f"{size[0]}x{size[1]}", 'stage': stage, 'fft_mode': fft_mode, 'seconds': seconds,
+              'aScans_per_s': n_aScans / seconds, 'MB_per_s': n_bytes_raw / seconds / 1e6, 'peak_rss_bytes': peak_rss_bytes}
+    print(f"{result['size']:>12} {stage:<32} {str(fft_mode):>9} {seconds*1e3:10.1f} ms {result['aScans_per_s']:12.0f} A-scans/s "
+          f"{result['MB_per_s']:10.1f} MB/s")
+    return result
+
+def benchmark_bScan_stages(a_len: int, b_len: int, params, fringe_params: FringeParams=FringeParams(), n_repeats: int=3) -> list :
+    """ times the (legacy) step-wise stages, the fused stages of the reconstruction plan and the high-level
+    reconstruction methods on one simulated B-scan """
+    REC = OctReconstructionManager()
+    raw = simulate_bScan(a_len, b_len, fringe_params)
+    size, n_bytes = (a_len, b_len), raw.nbytes
+    plan = REC.get_reconstruction_plan_from_params(a_len, params, fft_mode='auto')
+    background = plan.get_background(raw)
+    pre_fft = REC.perform_pre_fft_functions(raw, params.dispersion_coefficients, params.windowing_key, is_sub_bg=True)
+    fft = REC.perform_fft(pre_fft, l_pad=params.zeros_to_pad)
+    plan_fft = plan.run_fft(raw, background)
+    # stage name -> (FFT-mode, fct), the mode is kept apart from the name, so that stages can be compared between runs
+    stages = {
+        'perform_pre_fft_functions': (None, lambda : REC.perform_pre_fft_functions(raw, params.dispersion_coefficients, params.windowing_key, is_sub_bg=True)),
+        'perform_fft': ('full', lambda : REC.perform_fft(pre_fft, l_pad=params.zeros_to_pad)),
+        'perform_post_fft_functions': (None, lambda : REC.perform_post_fft_functions(fft, params.disp_scale_factor, params.black_lvl_for_dis,
+                                                                                      params.is_scale_data_for_display)),
+        'plan_get_fft_input': (plan.fft_mode, lambda : plan.get_fft_input(raw, background)),
+        'plan_run_fft': (plan.fft_mode, lambda : plan.run_fft(raw, background)),
+        'plan_run_post_fft': (plan.fft_mode, lambda : plan.run_post_fft(plan_fft)),
+        'plan_run': (plan.fft_mode, lambda : plan.run(raw)),
+        '_run_reconstruction_from_params': ('full', lambda : REC._run_reconstruction_from_params(raw, params)),
+    }
+    return [_get_result(size, stage, fft_mode, time_function(fct, n_repeats), b_len, n_bytes) for stage, (fft_mode, fct) in stages.items()]
+
+def benchmark_large_volume(a_len: int, b_len: int, c_len: int, params, fringe_params: FringeParams=FringeParams(),
+                           n_workers: int=None, n_repeats: int=1) -> list :
+    """ times the end-to-end reconstruction of a simulated volume file from disk (serial and parallel path) """
+    REC = OctReconstructionManager()
+    if n_workers is None :
+        n_workers = os.cpu_count() or 1
+    results = []
+    with tempfile.TemporaryDirectory() as dir_path :
+        path_raw = write_synthetic_volume(dir_path, (a_len, b_len, c_len), fringe_params)
+        path_recon = os.path.join(dir_path, 'recon.bin')
+        n_bytes = os.path.getsize(path_raw)
+        paths = {'process_large_volumes (serial)': 1}
+        if n_workers > 1 :
+            paths[f'process_large_volumes ({n_workers} workers)'] = n_workers
+        for stage, n in paths.items() :
+            timing = time_function(lambda : REC.process_large_volumes((a_len, b_len, c_len), params, path_raw, full_file_path_recon=path_recon,
+                                                                       n_workers=n, is_resume=False), n_repeats)
+            results.append( _get_result((a_len, b_len), stage, 'auto', timing, b_len * c_len, n_bytes) )
+    return results
+
+def run_benchmarks(sizes: tuple=BENCHMARK_SIZES, json_file_name: str='DefaultReconParams', c_len: int=8,
+                   n_repeats: int=3, full_file_path_results: str=None) -> dict :
+    """runs the benchmark suite and saves the results to a JSON-file
+    Args:
+        sizes (tuple, optional): (aLen, bLen) of the benchmarked B-scans. Defaults to BENCHMARK_SIZES.
+        json_file_name (str, optional): JSON-config-file with the reconstruction params. Defaults to 'DefaultReconParams'.
+        c_len (int, optional): number of B-scans of the simulated volumes (end-to-end paths, 0 := skip). Defaults to 8.
+        n_repeats (int, optional): repetitions per B-scan stage (the fastest one counts). Defaults to 3.
+        full_file_path_results (str, optional): path of the results file. Defaults to None (-> 'benchmark_<commit>_<time>.json').
+    Returns:
+        dict: meta data and results
+    """
+    params = load_recon_params(json_file_name)
+    report = {'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'), 'revision': get_git_revision(), 'machine': get_machine_info(),
+              'params': json_file_name, 'c_len': c_len, 'n_repeats': n_repeats, 'results': []}
+    for a_len, b_len in sizes :
+        report['results'] += benchmark_bScan_stages(a_len, b_len, params, n_repeats=n_repeats)
+        if c_len > 0 :
+            report['results'] += benchmark_large_volume(a_len, b_len, c_len, params)
+    report['peak_rss_bytes'] = get_peak_rss_bytes() # of the entire run
+    report['peak_rss_children_bytes'] = get_peak_rss_bytes(is_children=True) # largest worker process
+    if full_file_path_results is None :
+        full_file_path_results = f"benchmark_{report['revision']['commit']}_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(full_file_path_results, 'w') as f :
+        json.dump(report, f, indent=4)
+    print(f"[INFO:] Saved benchmark results to {os.path.abspath(full_file_path_results)}")
+    return report
+
+def compare_benchmarks(full_file_path_baseline: str, full_file_path_candidate: str) -> dict :
+    """ prints and returns the speedup (baseline time / candidate time) of all stages, that are in both result files
+    (the FFT-modes are printed, if they differ between both runs) """
+    with open(full_file_path_baseline) as f :
+        baseline = {(r['size'], r['stage']): r for r in json.load(f)['results']}
+    with open(full_file_path_candidate) as f :
+        candidate = {(r['size'], r['stage']): r for r in json.load(f)['results']}
+    speedups = {}
+    for key in baseline :
+        if key in candidate :
+            speedups[key] = baseline[key]['seconds'] / candidate[key]['seconds']
+            modes = (baseline[key].get('fft_mode'), candidate[key].get('fft_mode'))
+            modes_str = f" [{modes[0]} -> {modes[1]}]" if modes[0] != modes[1] else ''
+            print(f"{key[0]:>12} {key[1]:<32} {baseline[key]['seconds']*1e3:10.1f} ms -> {candidate[key]['seconds']*1e3:10.1f} ms ({speedups[key]:.2f}x){modes_str}")
+    return speedups
+
+
+# for testing and debugging purposes
+if __name__ == '__main__' :
+    print("[INFO:] Running from < benchmarkreconstruction.py > ...")
+    if len(sys.argv) == 3 : # compare two result files
+        compare_benchmarks(sys.argv[1], sys.argv[2])
+    else :
+        run_benchmarks()
@@ -1,5 +1,6 @@
 import os
 import cv2
+import sys
 import glob
 import numpy as np 
 from PIL import Image
@@ -10,6 +11,11 @@ from scipy.signal import find_peaks
 from scipy.optimize import curve_fit
 from scipy.ndimage import median_filter
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'BackEnd')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'Config')))
+
+from octreconstructionmanager import OctReconstructionManager
+
 
 def find_files_via_file_strings(directory: str, search_substring: str, file_type: str):
     """
@@ -35,11 +41,10 @@ def process_large_volumes(file_path: str, raw_dims: tuple) -> np.ndarray:
     aLen_recon = 2700
     raw_bScan_file_size = a * b # B-scan size in voxels
     
-    poly = np.asarray( np.polyval( (-5,125,0,0), np.linspace(-0.5, 0.5, a) ) )
-    wind = np.asarray( np.hanning(a), dtype=np.float32 )
-    x = np.multiply( poly, wind )
-    y = np.multiply( np.cos( poly ), wind )
-    dispersion = np.asarray( x + 1j * y, dtype=np.complex64 )
+    # 2x zero-padded FFT, of which only the depth-bins 100:2800 are kept -> narrow ROI lets the plan pick the zoom-FFT, if cheaper
+    plan = OctReconstructionManager.get_reconstruction_plan(a, (-5,125,0,0), 'hann', l_pad=a, 
+                                                            samples_dc_crop=100, samples_hf_crop=a-2800, 
+                                                            is_bg_sub=True, is_scale_data_for_disp=False, fft_mode='auto')
 
     file_saving = os.path.join(os.path.dirname(file_path), f"{os.path.basename(file_path).split('_')[0]}_{aLen_recon}x{b}x{c}_recon.bin")
     
@@ -48,14 +53,9 @@ def process_large_volumes(file_path: str, raw_dims: tuple) -> np.ndarray:
             offset = n * raw_bScan_file_size * np.dtype(np.uint16).itemsize # pointer-offset in bytes
             raw_buffer = np.fromfile(f_raw, dtype=np.uint16, count=raw_bScan_file_size, offset=offset) 
             raw_buffer = np.reshape(raw_buffer, (b, a)).swapaxes(0,1) # reshape to size len(A-Scan) * len(B-Scan)
-            raw_buffer = raw_buffer - np.mean(raw_buffer, axis=1)[:,np.newaxis] # BG subtraction
-            raw_buffer = np.asarray(raw_buffer, dtype=np.complex64) # recast as complex array
-            fft_buffer = np.zeros((2*a,b), dtype=np.complex64)
-            fft_buffer[a:,:] = raw_buffer * dispersion[:,np.newaxis]
-            buffer = 20 * np.log10( np.abs( np.fft.fft( fft_buffer, axis=0 )[:a] ) ) 
+            buffer = plan.run(raw_buffer) # BG subtraction, dispersion correction, FFT and log10 of rows 100:2800
             buffer = 4 * (buffer - 90)
             buffer = np.clip(buffer, 0, 255).astype(np.uint8)
-            buffer = buffer[100:2800,:]
             with open(file_saving, 'a+b') as f: 
                 buffer.astype(np.uint8).tofile(f) # save cropped buffer in cropped version
     return 
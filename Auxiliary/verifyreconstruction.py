@@ -0,0 +1,287 @@
+"""
+                                        ******
+        Author: @Philipp Matten - philipp.matten@meduniwien.ac.at / philipp.matten@gmx.de
+
+                                    Copyright 2023
+                                        ******
+
+        >>> Golden-output equivalence harness of the OCT reconstruction: compares optimized (candidate) reconstruction
+            paths (FFT modes, fused stages, parallel workers, ...) against a frozen, step-wise reference implementation
+            in double precision - on synthetic fringes (< octfringesimulator.py >) and on user-supplied raw volumes -
+            and gates them with configurable tolerances (dB and uint8 errors, fraction of differing voxels)
+
+"""
+
+# global imports
+import os
+import sys
+import tempfile
+import dataclasses
+import numpy as np
+from scipy import signal
+from dataclasses import dataclass
+
+# custom imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'BackEnd')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'Config')))
+
+from octreconstructionmanager import OctReconstructionManager
+from octfringesimulator import FringeParams, simulate_bScan, write_synthetic_volume
+from reconparamsmanager import ReconParams, load_recon_params
+
+
+# (aLen, bLen) of the simulated B-scans
+VERIFICATION_SIZES = ((1024, 256), (2048, 300), (6656, 128))
+
+
+@dataclass(frozen=True)
+class Tolerances() :
+    """
+    >>> upper limits of the deviations of a candidate from the reference, which still count as equivalent
+    NOTE: dB errors are only evaluated above the noise floor of the reference (see min_dB), since the (relative)
+    single precision errors of the candidates get arbitrarily large in dB for (close to) zero magnitudes
+    """
+    max_abs_err_dB: float = 0.05
+    mean_abs_err_dB: float = 1e-3
+    max_abs_err_uint8: int = 1
+    frac_diff_uint8: float = 1e-3 # fraction of voxels, whose uint8 values differ (by any amount)
+    min_dB: float = 0 # voxels of the reference below this level are excluded from the dB errors
+
+
+def _create_reference_window(a_len: int, key: str='hann', sigma: int=None) -> np.ndarray :
+    """ frozen copy of the windowing functions of < OctReconstructionManager.create_windowing_function() > (pre-plan version) """
+    if sigma is None :
+        sigma = a_len//10
+    if key.lower() == 'hann' :
+        return np.asarray( np.hanning(a_len), dtype=np.float32 )
+    elif key.lower() == 'hamm' :
+        return np.asarray( np.hamming(a_len), dtype=np.float32 )
+    elif key.lower() == 'kaiser' :
+        return np.asarray( np.kaiser(a_len, beta=sigma), dtype=np.float32 )
+    elif key.lower() == 'gauss' :
+        return np.asarray( signal.windows.gaussian(a_len, sigma), dtype=np.float32 )
+    raise ValueError("You have passed an unrecognized key for the windowing-parameter")
+
+def _get_reference_fft_length(a_len: int, l_pad: int=None) -> int :
+    """ frozen copy of the zero-padding of < OctReconstructionManager.perform_fft() > (pre-plan version): None := pad by 
+    the A-scan length (2x), 1 := pad to the next power of 2 (> a_len), otherwise l_pad zeros """
+    if l_pad is None :
+        l_pad = a_len
+    elif l_pad == 1 :
+        j = 0
+        while 2**j <= a_len :
+            j += 1
+        l_pad = 2**j - a_len
+    assert l_pad >= 0, "Padding values must be positve integer values"
+    return a_len + l_pad
+
+def reconstruct_reference(buffer: np.ndarray, params: ReconParams, background: np.ndarray=None, 
+                          is_default_padding: bool=False) -> np.ndarray :
+    """frozen reference implementation of < OctReconstructionManager._run_reconstruction() >: step-wise (not fused)
+    background subtraction, dispersion correction and windowing, zero-padding and FFT, cropping of one Fourier-plane,
+    log-scaling and scaling to display range - all in double precision and with numpy only (no FFT backend or plan)
+    >>> must NOT be changed to speed it up - it defines the output that all optimized paths are compared against
+    NOTE: self-contained copy of the math before the reconstruction plan, i.e. it does not call OctReconstructionManager,
+    only with the (intended) fixes of honouring the windowing key, the DC/HF-crops and clipping to the display range
+    Args:
+        buffer (np.ndarray): raw OCT data (A-, B-, or C-scan) with A-scans along axis 0
+        params (ReconParams): reconstruction params
+        background (np.ndarray, optional): background A-scan. Defaults to None (-> mean A-scan of the buffer).
+        is_default_padding (bool, optional): flag to pad as < _run_reconstruction() > (no padding parameter -> 2x), 
+        instead of by params.zeros_to_pad. Defaults to False.
+    Returns:
+        np.ndarray: reconstructed and cropped OCT data (float64 in dB, or uint8 if scaled for display)
+    """
+    buffer = np.asarray(buffer, dtype=np.float64)
+    lateral = (1,) * (buffer.ndim - 1)
+    if params.is_substract_background :
+        if background is None :
+            background = np.mean(buffer, axis=tuple(range(1, buffer.ndim)))
+        buffer = buffer - np.reshape(np.asarray(background, dtype=np.float64), (-1,) + lateral)
+    a_len = buffer.shape[0]
+    poly_disp = np.polyval( params.dispersion_coefficients, np.linspace(-0.5, 0.5, a_len) )
+    window = _create_reference_window( a_len, key=params.windowing_key )
+    disp_vec = poly_disp * window + 1j * np.cos(poly_disp) * window
+    buffer = buffer * np.reshape(disp_vec, (-1,) + lateral)
+    l_fft = _get_reference_fft_length(a_len, None if is_default_padding else params.zeros_to_pad)
+    buffer = np.concatenate( (np.zeros((l_fft - a_len,) + buffer.shape[1:], dtype=buffer.dtype), buffer), axis=0 )
+    buffer = np.fft.fft(buffer, axis=0)[:l_fft//2]
+    buffer = buffer[params.dc_crop_samples:l_fft//2 - params.hf_crop_samples]
+    with np.errstate(divide='ignore') :
+        recon = 20 * np.log10( np.abs(buffer) )
+    if not params.is_scale_data_for_display :
+        return recon
+    return np.asarray( np.clip( 255 * (recon - params.black_lvl_for_dis) / params.disp_scale_factor, 0, 255 ), dtype=np.uint8 )
+
+def reconstruct_reference_bScan_for_volume(raw_bScan: np.ndarray, params: ReconParams, background: np.ndarray=None) -> np.ndarray :
+    """ frozen reference of a B-scan of < OctReconstructionManager.process_large_volumes() >, i.e. reconstructed,
+    median-filtered (3x3) and casted to uint8 (raw and reconstructed B-scans with A-scans along axis 0) """
+    recon = reconstruct_reference(raw_bScan, params, background)
+    return np.asarray( signal.medfilt2d(np.asarray(recon, dtype=np.float64), kernel_size=(3,3)), dtype=np.uint8 )
+
+def compare_outputs(reference: np.ndarray, candidate: np.ndarray, min_dB: float=None) -> dict :
+    """returns the absolute errors of a candidate output
+    Args:
+        reference (np.ndarray): reference output (float in dB, or uint8)
+        candidate (np.ndarray): candidate output of the same shape
+        min_dB (float, optional): for dB-outputs - voxels of the reference below this level are excluded. Defaults to None.
+    Returns:
+        dict: max. and mean absolute error and fraction of differing voxels
+    """
+    if reference.shape != candidate.shape :
+        raise ValueError(f"Candidate output has shape {candidate.shape}, expected shape {reference.shape}")
+    reference, candidate = np.asarray(reference, dtype=np.float64), np.asarray(candidate, dtype=np.float64)
+    mask = np.isfinite(reference)
+    if min_dB is not None :
+        mask &= reference >= min_dB
+    err = np.abs(reference[mask] - candidate[mask])
+    err[~np.isfinite(err)] = np.inf # i.e. -inf in the candidate, where the reference is finite
+    return {'max_abs_err': float(err.max()) if err.size > 0 else 0.0, 'mean_abs_err': float(err.mean()) if err.size > 0 else 0.0,
+            'frac_diff': float(np.count_nonzero(reference != candidate) / reference.size), 'n_voxels': int(err.size)}
+
+def evaluate_candidate(errors_dB: dict, errors_uint8: dict, tolerances: Tolerances=Tolerances()) -> bool :
+    """ returns True, if the errors of a candidate (dB-errors can be None, i.e. for volume files) are within the tolerances """
+    is_passed = errors_uint8['max_abs_err'] <= tolerances.max_abs_err_uint8 and errors_uint8['frac_diff'] <= tolerances.frac_diff_uint8
+    if errors_dB is not None :
+        is_passed &= errors_dB['max_abs_err'] <= tolerances.max_abs_err_dB and errors_dB['mean_abs_err'] <= tolerances.mean_abs_err_dB
+    return bool(is_passed)
+
+def get_bScan_candidates(params: ReconParams) -> dict :
+    """ returns the in-memory reconstruction paths, that are verified for the params: name -> (fct(buffer, params), 
+    is_default_padding), where the flag selects the padding of the reference (see < reconstruct_reference() >) """
+    REC = OctReconstructionManager()
+    def run_plan(fft_mode: str) :
+        def fct(buffer: np.ndarray, params: ReconParams) -> np.ndarray :
+            return REC.get_reconstruction_plan_from_params(buffer.shape[0], params, fft_mode=fft_mode).run(buffer)
+        return fct
+    candidates = {f'plan.run ({fft_mode})' : (run_plan(fft_mode), False) for fft_mode in ('full', 'one_sided', 'czt', 'auto')}
+    # GUI path has no padding parameter -> always compared against the default (2x) padding
+    candidates['_run_reconstruction'] = (lambda buffer, params : REC._run_reconstruction( buffer, params.dispersion_coefficients,
+        params.windowing_key, samples_hf_crop=params.hf_crop_samples, samples_dc_crop=params.dc_crop_samples,
+        scale_fac=params.disp_scale_factor, blck_lvl=params.black_lvl_for_dis, is_bg_sub=params.is_substract_background,
+        show_scaled_data=params.is_scale_data_for_display ), True)
+    candidates['plan.run_chunked (small budget)'] = (lambda buffer, params : REC.get_reconstruction_plan_from_params(
+        buffer.shape[0], params).run_chunked(buffer, mem_budget_bytes=buffer.shape[0] * 64 * 16), False) # few A-scans per chunk
+    return candidates
+
+def _print_result(name: str, result: dict) -> None :
+    if 'error' in result :
+        print(f"{'FAILED':>6} {name:<40} {result['error']}")
+        return
+    dB = result['dB']
+    dB_str = 'n/a' if dB is None else f"{dB['max_abs_err']:9.2e} dB (max) {dB['mean_abs_err']:9.2e} dB (mean)"
+    print(f"{'PASSED' if result['is_passed'] else 'FAILED':>6} {name:<40} {dB_str:>40} "
+          f"{result['uint8']['max_abs_err']:4.0f} (max. uint8) {100*result['uint8']['frac_diff']:8.4f}% voxels differ")
+
+def verify_bScan(buffer: np.ndarray, params: ReconParams, candidates: dict=None, tolerances: Tolerances=Tolerances()) -> dict :
+    """compares the candidates with the reference on a raw buffer - in dB (w/o display scaling) and in uint8 (with scaling)
+    Args:
+        buffer (np.ndarray): raw OCT data (A-, B-, or C-scan) with A-scans along axis 0
+        params (ReconParams): reconstruction params (display scaling is switched off/on for the dB/uint8 comparison)
+        candidates (dict, optional): name -> (fct(buffer, params), is_default_padding). Defaults to None (-> get_bScan_candidates(params)).
+        tolerances (Tolerances, optional): gating tolerances. Defaults to Tolerances().
+    Returns:
+        dict: name -> errors in dB and uint8 and flag, whether the candidate passed
+    """
+    candidates = get_bScan_candidates(params) if candidates is None else candidates
+    params_dB = dataclasses.replace(params, is_scale_data_for_display=False)
+    params_uint8 = dataclasses.replace(params, is_scale_data_for_display=True)
+    references = {} # padding flag -> references in dB and uint8
+    results = {}
+    for name, (fct, is_default_padding) in candidates.items() :
+        if is_default_padding not in references :
+            references[is_default_padding] = (reconstruct_reference(buffer, params_dB, is_default_padding=is_default_padding),
+                                              reconstruct_reference(buffer, params_uint8, is_default_padding=is_default_padding))
+        reference_dB, reference_uint8 = references[is_default_padding]
+        try :
+            errors_dB = compare_outputs(reference_dB, fct(buffer, params_dB), min_dB=tolerances.min_dB)
+            errors_uint8 = compare_outputs(reference_uint8, fct(buffer, params_uint8))
+        except ValueError as e : # i.e. other FFT length (depth sampling) than the reference
+            results[name] = {'dB': None, 'uint8': None, 'is_passed': False, 'error': str(e)}
+        else :
+            results[name] = {'dB': errors_dB, 'uint8': errors_uint8, 'is_passed': evaluate_candidate(errors_dB, errors_uint8, tolerances)}
+        _print_result(name, results[name])
+    return results
+
+def verify_large_volume(raw_dims: tuple, params: ReconParams, full_file_path_raw: str, bScan_start_idx: int=0,
+                        n_workers: tuple=None, fft_modes: tuple=('full', 'auto'), tolerances: Tolerances=Tolerances()) -> dict :
+    """compares the output files of < process_large_volumes() > (serial and parallel, for each FFT-mode) with the
+    reference in uint8 (the files do not contain dB values)
+    Args:
+        raw_dims (tuple): raw volume dimensions (aLen, bLen, cLen)
+        params (ReconParams): reconstruction params
+        full_file_path_raw (str): path to raw volume file
+        bScan_start_idx (int, optional): index of B-scan to start with. Defaults to 0.
+        n_workers (tuple, optional): numbers of worker processes to verify. Defaults to None (-> 1 and all cores).
+        fft_modes (tuple, optional): FFT-modes to verify. Defaults to ('full', 'auto').
+        tolerances (Tolerances, optional): gating tolerances. Defaults to Tolerances().
+    Returns:
+        dict: name -> errors in uint8 and flag, whether the candidate passed
+    """
+    a_len, b_len, c_len = raw_dims
+    if n_workers is None :
+        n_workers = tuple(sorted({1, os.cpu_count() or 1}))
+    REC = OctReconstructionManager()
+    raw = np.memmap(full_file_path_raw, dtype=REC.dtype_loading, mode='r', shape=(c_len, b_len, a_len))
+    reference = np.stack([reconstruct_reference_bScan_for_volume(raw[(c + bScan_start_idx) % c_len].T, params)
+                          for c in range(c_len)])
+    results = {}
+    with tempfile.TemporaryDirectory() as dir_path :
+        for fft_mode in fft_modes :
+            for n in n_workers :
+                path_recon = os.path.join(dir_path, f'recon_{fft_mode}_{n}.bin')
+                REC.process_large_volumes(raw_dims, params, full_file_path_raw, bScan_start_idx=bScan_start_idx,
+                                          full_file_path_recon=path_recon, fft_mode=fft_mode, n_workers=n, is_resume=False)
+                candidate = np.fromfile(path_recon, dtype=REC.dtype_recon)
+                name = f'process_large_volumes ({fft_mode}, {n} worker(s))'
+                if candidate.size != reference.size : # i.e. other FFT length (depth sampling) than the reference
+                    results[name] = {'dB': None, 'uint8': None, 'is_passed': False,
+                                     'error': f"Output file has {candidate.size} voxels, expected {reference.size}"}
+                else :
+                    errors_uint8 = compare_outputs(reference, candidate.reshape(reference.shape))
+                    results[name] = {'dB': None, 'uint8': errors_uint8, 'is_passed': evaluate_candidate(None, errors_uint8, tolerances)}
+                _print_result(name, results[name])
+    return results
+
+def run_verification(json_file_name: str='DefaultReconParams', sizes: tuple=VERIFICATION_SIZES, c_len: int=6,
+                     full_file_path_raw: str=None, fringe_params: FringeParams=FringeParams(),
+                     tolerances: Tolerances=Tolerances()) -> bool :
+    """runs the equivalence harness on simulated B-scans and volumes and (optionally) on a user-supplied raw volume file
+    Args:
+        json_file_name (str, optional): JSON-config-file with the reconstruction params. Defaults to 'DefaultReconParams'.
+        sizes (tuple, optional): (aLen, bLen) of the simulated B-scans. Defaults to VERIFICATION_SIZES.
+        c_len (int, optional): number of B-scans of the simulated volumes (large-volume paths, 0 := skip). Defaults to 6.
+        full_file_path_raw (str, optional): raw volume file, whose name contains its dimensions. Defaults to None.
+        fringe_params (FringeParams, optional): parameters of the simulated fringes. Defaults to FringeParams().
+        tolerances (Tolerances, optional): gating tolerances. Defaults to Tolerances().
+    Returns:
+        bool: True, if all candidates passed
+    """
+    params = load_recon_params(json_file_name)
+    results = {}
+    for a_len, b_len in sizes :
+        print(f"[INFO:] Verifying simulated B-scan of size {a_len}x{b_len} ...")
+        results[f'{a_len}x{b_len}'] = verify_bScan(simulate_bScan(a_len, b_len, fringe_params), params, tolerances=tolerances)
+        if c_len > 0 :
+            with tempfile.TemporaryDirectory() as dir_path :
+                path_raw = write_synthetic_volume(dir_path, (a_len, b_len, c_len), fringe_params)
+                results[f'{a_len}x{b_len}x{c_len}'] = verify_large_volume((a_len, b_len, c_len), params, path_raw,
+                                                                          bScan_start_idx=1, tolerances=tolerances)
+    if full_file_path_raw is not None :
+        REC = OctReconstructionManager()
+        raw_dims, _ = REC.get_oct_volume_dims(full_file_path_raw)
+        print(f"[INFO:] Verifying {full_file_path_raw} ...")
+        volume = np.memmap(full_file_path_raw, dtype=REC.dtype_loading, mode='r', shape=raw_dims[::-1])
+        results[os.path.basename(full_file_path_raw)] = verify_bScan(np.asarray(volume[0].T), params, tolerances=tolerances)
+        results[os.path.basename(full_file_path_raw) + ' (volume)'] = verify_large_volume(raw_dims, params, full_file_path_raw,
+                                                                                          tolerances=tolerances)
+    n_failed = sum(not r['is_passed'] for size in results.values() for r in size.values())
+    print(f"[INFO:] {'All candidates passed' if n_failed == 0 else f'{n_failed} candidate(s) FAILED'}")
+    return n_failed == 0
+
+
+# for testing and debugging purposes
+if __name__ == '__main__' :
+    print("[INFO:] Running from < verifyreconstruction.py > ...")
+    is_passed = run_verification(full_file_path_raw=sys.argv[1] if len(sys.argv) > 1 else None)
+    sys.exit(0 if is_passed else 1)
@@ -0,0 +1,161 @@
+"""
+                                        ******
+        Author: @Philipp Matten - philipp.matten@meduniwien.ac.at / philipp.matten@gmx.de
+
+                                    Copyright 2023
+                                        ******
+
+        >>> Contains the volume-wide (streaming) estimation of the background spectrum of raw OCT data,
+            which is saved as a reusable calibration file and applied in all B-scans of a reconstruction
+
+"""
+
+# global imports
+import os
+import numpy as np
+
+# custom imports
+from octdatastreammanager import PrefetchingBScanReader
+
+
+BACKGROUND_KEYS = ('mean', 'median')
+
+# number of values, that are sorted at once in the median computation
+MEDIAN_CHUNK_SIZE = 2**22
+
+
+class BackgroundEstimator() :
+    """
+    >>> Accumulates the mean A-scan (and optionally an approximated median A-scan) of raw buffers in bounded memory,
+    i.e. B-scan by B-scan over an entire volume (or a separate background acquisition)
+    NOTE: the median is initialized with the exact median of the first buffer and then refined with every further 
+    buffer by stochastic approximation (Robbins-Monro), i.e. with the fraction of values below the current estimate
+    -> one comparison per value (instead of sorting), accurate to ~1 count for stationary backgrounds
+    """
+    def __init__(self, a_len: int, is_median: bool=False) -> None :
+        self.a_len = int(a_len)
+        self.is_median = is_median
+        self.n_aScans = 0
+        self._sum = np.zeros(self.a_len, dtype=np.float64)
+        self._median = None
+        self._step = None # inverse (normal-approximated) density of the values at their median
+
+    def update(self, buffer: np.ndarray) -> None :
+        """ accumulates a raw buffer (A-, B-, or C-scan) with A-scans along axis 0 """
+        if buffer.shape[0] != self.a_len :
+            raise ValueError(f"Buffer A-scan length ({buffer.shape[0]}) does not match the estimators length ({self.a_len})")
+        lateral_axes = tuple(range(1, buffer.ndim))
+        self._sum += np.sum(buffer, axis=lateral_axes, dtype=np.float64)
+        n_new = int(np.prod(buffer.shape[1:], dtype=np.int64))
+        self.n_aScans += n_new
+        if self.is_median :
+            self._update_median( buffer.reshape(self.a_len, -1), n_new )
+    
+    def _update_median(self, buffer: np.ndarray, n_new: int) -> None :
+        if self._median is None :
+            self._median = np.asarray( calculate_median_aScan(buffer), dtype=np.float64 )
+            # mean absolute deviation * pi == 1/f(median) for normal distributed values
+            mean_abs_dev = np.mean( np.abs(buffer - self._median[:, np.newaxis]), axis=1 )
+            self._step = np.maximum( np.pi * mean_abs_dev, 1 )
+            return
+        frac_below = np.count_nonzero(buffer < self._median[:, np.newaxis], axis=1) / n_new
+        # gain decays with the number of accumulated values -> converges to the median of all values
+        self._median += self._step * (n_new / self.n_aScans) * (0.5 - frac_below)
+
+    @property
+    def mean(self) -> np.ndarray :
+        """ returns the mean A-scan (float32) of all accumulated buffers """
+        assert self.n_aScans > 0, "No buffers have been accumulated yet"
+        return np.asarray( self._sum / self.n_aScans, dtype=np.float32 )
+
+    @property
+    def median(self) -> np.ndarray :
+        """ returns the (approximated) median A-scan (float32) of all accumulated buffers """
+        assert self.is_median and self._median is not None, "No median A-scans have been accumulated"
+        return np.asarray( self._median, dtype=np.float32 )
+
+    def save(self, file_path: str) -> str :
+        """ saves the estimated background spectra as calibration file (*.npz) and returns its path """
+        spectra = {'mean': self.mean}
+        if self.is_median :
+            spectra['median'] = self.median
+        np.savez(file_path, n_aScans=self.n_aScans, **spectra)
+        return file_path if file_path.endswith('.npz') else file_path + '.npz'
+
+
+def _get_median_ranks(n: int) -> tuple :
+    """ returns the (0-based) rank(s) of the median of n values (2 ranks for an even n, which are averaged) """
+    return ((n - 1) // 2, n // 2) if n % 2 == 0 else (n // 2,)
+
+def calculate_median_aScan(buffer: np.ndarray) -> np.ndarray :
+    """returns the (exact) median A-scan of a raw buffer - for up to 16 Bit integer data the lateral values of blocks 
+    of spectral samples are sorted via (stable) radix sort, i.e. counting instead of comparison-based partitioning
+    Args:
+        buffer (np.ndarray): raw OCT data (B-, or C-scan) with A-scans along axis 0
+    Returns:
+        np.ndarray: median A-scan (float32)
+    """
+    if not np.issubdtype(buffer.dtype, np.integer) or buffer.dtype.itemsize > 2 : # no radix sort for floats
+        return np.asarray( np.median(buffer, axis=tuple(range(1, buffer.ndim))), dtype=np.float32 )
+    values = np.reshape(buffer, (buffer.shape[0], -1)) # copy, if lateral axes are not contiguous
+    ranks = list(_get_median_ranks(values.shape[1]))
+    rows_per_block = max(1, MEDIAN_CHUNK_SIZE // values.shape[1]) # sorted copy of a block stays bounded
+    median = np.empty(values.shape[0], dtype=np.float32)
+    for r in range(0, values.shape[0], rows_per_block) :
+        block = np.sort(np.asarray(values[r:r + rows_per_block], dtype=values.dtype.newbyteorder('=')), axis=1, kind='stable')
+        median[r:r + rows_per_block] = np.mean(block[:, ranks], axis=1)
+    return median
+
+def get_background_file_path(full_file_path_raw: str) -> str :
+    """ returns the default path of the background calibration file of a raw volume file """
+    return os.path.splitext(full_file_path_raw)[0] + '_background.npz'
+
+def estimate_volume_background(full_file_path_raw: str, raw_dims: tuple, dtype_raw='<u2', is_median: bool=False,
+                               full_file_path_background: str=None, n_prefetch: int=4) -> BackgroundEstimator :
+    """streams once over all B-scans of a raw volume file (or a separate background acquisition)
+    and saves the estimated background spectra as calibration file
+    Args:
+        full_file_path_raw (str): path to raw volume file
+        raw_dims (tuple): raw volume dimensions (aLen, bLen, cLen)
+        dtype_raw (optional): data type (and endianness) of the raw file. Defaults to '<u2'.
+        is_median (bool, optional): flag to also estimate the (approximated) median background. Defaults to False.
+        full_file_path_background (str, optional): path of the calibration file. Defaults to None (-> < get_background_file_path() >).
+        n_prefetch (int, optional): number of B-scans a background thread reads ahead. Defaults to 4.
+    Returns:
+        BackgroundEstimator: estimator with the accumulated background spectra
+    """
+    assert len(raw_dims) == 3, "Expecting the dimensions of a (3D) volume"
+    estimator = BackgroundEstimator(raw_dims[0], is_median=is_median)
+    with PrefetchingBScanReader(full_file_path_raw, raw_dims, range(raw_dims[2]), dtype=dtype_raw, n_prefetch=n_prefetch) as reader :
+        for raw_buffer in reader :
+            estimator.update( raw_buffer.swapaxes(0,1) ) # swap axis (A is 0th axis, by convention)
+    if full_file_path_background is None :
+        full_file_path_background = get_background_file_path(full_file_path_raw)
+    print(f"[INFO:] Saved background of {estimator.n_aScans} A-scans to {estimator.save(full_file_path_background)}")
+    return estimator
+
+def load_background(full_file_path_background: str, key: str='mean') -> np.ndarray :
+    """returns a background spectrum from a calibration file
+    Args:
+        full_file_path_background (str): path to calibration file (*.npz), i.e. from < estimate_volume_background() >
+        key (str, optional): 'mean' or 'median'. Defaults to 'mean'.
+    Returns:
+        np.ndarray: background A-scan (float32)
+    """
+    if key not in BACKGROUND_KEYS :
+        raise ValueError(f"Unrecognized background key '{key}' (expected one of {BACKGROUND_KEYS})")
+    with np.load(full_file_path_background) as spectra :
+        if key not in spectra :
+            raise ValueError(f"Calibration file {full_file_path_background} contains no {key}-background")
+        return np.asarray( spectra[key], dtype=np.float32 )
+
+
+# for testing and debugging purposes
+if __name__ == '__main__' :
+    print("[INFO:] Running from < octbackgroundmanager.py > ...")
+    from octreconstructionmanager import OctReconstructionManager
+    REC = OctReconstructionManager()
+    path = REC._tk_file_selection()
+    dims, _ = REC.get_oct_volume_dims(path)
+    estimator = estimate_volume_background(path, dims, is_median=True)
+    print(f"Max. deviation of median and mean background: {np.max(np.abs(estimator.median - estimator.mean))}")
@@ -20,6 +20,7 @@ from tkinter.filedialog import Tk, askopenfilename, askdirectory
 from numpy.core.fromnumeric import reshape 
 
 # custom imports
+from octstagerecorder import recorded_stage
 
 
 class OctDataFileManager() :
@@ -77,16 +78,31 @@ class OctDataFileManager() :
         dims = tuple(int(i) for i in dims)
         return dims, len(dims)
     
+    @recorded_stage('load_oct_data')
     def load_oct_data(self, dtype=np.uint16) -> np.ndarray :
         """ returns properly reshaped OCT data (cube) """
         self._get_oct_meta_data() # creates <self.file_path_main>, which is needed in < self.load_selected_bin_file() >
         return np.asarray( self._reshape_oct_volume(self.load_selected_bin_file()), dtype=dtype )
+    
+    def open_oct_volume(self, path_file: str=None) -> 'OctVolume' :
+        """ returns lazy, memory-mapped OCT data (cube) in (A, B, C)-axis convention, 
+        of the passed-in file or of a user-selected file (if path_file is None) 
+        NOTE: nothing is read from disk, until slices of the volume are accessed """
+        if path_file is None :
+            self._get_oct_meta_data()
+        else :
+            assert os.path.isfile(path_file), "[CAUTION] path/string doesn't contain a valid file"
+            self.file_path_main = path_file
+            self.dir_main = self._get_main_dir()
+            self.oct_dims, self.oct_ndims = self.get_oct_volume_dims(self.file_path_main)
+        return OctVolume(self.file_path_main, self.oct_dims, dtype_file=self.dtype_loading)
             
     def load_selected_bin_file(self) :
         """ loads and returns bin file that was selected when class instance was created 
         NOTE: always loads data as uint"""
         return self.load_bin_file( self.file_path_main )
     
+    @recorded_stage('reshape_volume')
     def _reshape_oct_volume(self, buffer: np.array) -> np.array :
         """ Returns reshaped volume buffer/np-array acc. to self.dims-shape """
         if len(self.oct_dims) == 1 :
@@ -97,6 +113,7 @@ class OctDataFileManager() :
             dims = (self.oct_dims[2], self.oct_dims[1], self.oct_dims[0])
         return np.asarray( np.swapaxes(np.reshape(buffer, dims), 0, -1) )
     
+    @recorded_stage('io_read')
     def load_bin_file(self, path_file) -> np.array :
         """ loads and returns data in a numpy.array """
         # # debug
@@ -148,6 +165,58 @@ class OctDataFileManager() :
                     img_buffer.append(c_img)
         return np.asarray(img_buffer, dtype=dtype_loading) 
                     
+
+class OctVolume() :
+    """
+    >>> lazy, np.memmap-backed OCT volume, with the (A, B, C)-axis convention already applied (as a view)
+    NOTE: indexing only pages in the accessed slices and returns them as in-memory arrays in native byte order 
+    (i.e. volume[:, :, c] := B-scan c along the slow-scanning axis, which is contiguous on disk)
+    """
+    def __init__(self, file_path: str, dims: tuple, dtype_file='<u2') -> None :
+        assert 1 <= len(dims) <= 3, "Dimensionality is not in range - expected 1D, 2D or 3D data"
+        self.file_path = file_path
+        self.dims = tuple(int(d) for d in dims)
+        self.dtype_file = np.dtype(dtype_file)
+        self.dtype = self.dtype_file.newbyteorder('=') # endianness gets converted on the fly per accessed slice
+        n_bytes_expected = int(np.prod(self.dims)) * self.dtype_file.itemsize
+        if os.path.getsize(file_path) != n_bytes_expected :
+            raise ValueError(f"Dims {self.dims}: File size of {file_path} ({os.path.getsize(file_path)} bytes) does not match {n_bytes_expected} bytes")
+        # file layout is (C, B, A) -> swap first and last axis for (A, B, C)-view, same as < reshape_oct_volume() >
+        self._memmap = np.memmap(file_path, dtype=self.dtype_file, mode='r', shape=self.dims[::-1])
+        self._view = np.swapaxes(self._memmap, 0, -1)
+    
+    @property
+    def shape(self) -> tuple :
+        return self._view.shape
+    
+    @property
+    def ndim(self) -> int :
+        return self._view.ndim
+    
+    @property
+    def size(self) -> int :
+        return self._view.size
+    
+    @property
+    def nbytes(self) -> int :
+        return self.size * self.dtype.itemsize
+    
+    def __len__(self) -> int :
+        return self.shape[0]
+    
+    def __getitem__(self, key) -> np.ndarray :
+        """ returns the accessed slice(s) as in-memory array in native byte order """
+        return np.asarray( self._view[key], dtype=self.dtype )
+    
+    def __array__(self, dtype=None, copy=None) -> np.ndarray :
+        """ materializes the entire volume in memory (CAUTION: for large volumes) """
+        return np.asarray( self._view, dtype=self.dtype if dtype is None else dtype )
+    
+    def iter_bScans(self, axis: int=-1) :
+        """ yields B-scans along passed-in axis (default: slow-scanning axis), one at a time """
+        for idx in range(self.shape[axis]) :
+            yield np.asarray( np.take(self._view, idx, axis=axis), dtype=self.dtype )
+    
     
 #---------------------------------------------------------
 ### General static methods related to volume reshaping ###
@@ -0,0 +1,252 @@
+"""
+                                        ******
+        Author: @Philipp Matten - philipp.matten@meduniwien.ac.at / philipp.matten@gmx.de
+
+                                    Copyright 2023
+                                        ******
+
+        >>> Contains background reader/writer threads for streaming reconstruction of large OCT volumes,
+            so that file I/O (i.e. from a network share) overlaps with the reconstruction of the B-scans
+
+"""
+
+# global imports
+import os
+import json
+import queue
+import threading
+import numpy as np
+
+# custom imports
+from octstagerecorder import record_stage
+
+
+class PrefetchingBScanReader() :
+    """
+    >>> Reads B-scans of a raw volume file in a background thread into a bounded pool of reusable buffers
+    NOTE: iterating yields the buffers (shape=(bLen, aLen), as on disk) in the order of the passed-in B-scan indices
+    NOTE: a yielded buffer is handed back to the reader (and overwritten) as soon as the next one is requested
+    """
+    def __init__(self, file_path: str, raw_dims: tuple, bScan_indices, dtype=np.uint16, n_prefetch: int=4) -> None :
+        assert len(raw_dims) == 3, "Expecting the dimensions of a (3D) volume"
+        assert n_prefetch >= 1, "At least one B-scan has to be prefetched"
+        self.file_path = file_path
+        self.dtype = np.dtype(dtype)
+        self.bScan_shape = (raw_dims[1], raw_dims[0])
+        self.bScan_size_bytes = raw_dims[0] * raw_dims[1] * self.dtype.itemsize
+        self.bScan_indices = list(bScan_indices)
+        # n_prefetch buffers can be filled, while one is being processed by the consumer
+        self._free_buffers = queue.Queue()
+        for _ in range(n_prefetch + 1) :
+            self._free_buffers.put( np.empty(self.bScan_shape, dtype=self.dtype) )
+        self._filled_buffers = queue.Queue(maxsize=n_prefetch)
+        self._stop_event = threading.Event()
+        self._curr_buffer = None
+        self._thread = threading.Thread(target=self._read_bScans, daemon=True)
+        self._thread.start()
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *args) -> None :
+        self.close()
+
+    def __len__(self) -> int :
+        return len(self.bScan_indices)
+
+    def __iter__(self) :
+        for _ in range(len(self.bScan_indices)) :
+            self._release_curr_buffer()
+            with record_stage('io_read_wait') : # consumer stalls, because the reader thread falls behind
+                item = self._filled_buffers.get()
+            if isinstance(item, BaseException) : # re-raise errors of the reader thread in consumer thread
+                raise item
+            self._curr_buffer = item
+            yield item
+        self._release_curr_buffer()
+
+    def _release_curr_buffer(self) -> None :
+        if self._curr_buffer is not None :
+            self._free_buffers.put(self._curr_buffer)
+            self._curr_buffer = None
+
+    def _wait_for(self, q: queue.Queue, item=None) :
+        """ blocking get (item is None) or put on queue, which returns None if the reader has been closed """
+        while not self._stop_event.is_set() :
+            try :
+                if item is None :
+                    return q.get(timeout=0.1)
+                q.put(item, timeout=0.1)
+                return item
+            except (queue.Empty, queue.Full) :
+                continue
+        return None
+
+    def _read_bScans(self) -> None :
+        """ reader thread: fills free buffers with the B-scans of the volume file """
+        try :
+            with open(self.file_path, 'rb') as f_raw :
+                for c_idx in self.bScan_indices :
+                    buffer = self._wait_for(self._free_buffers)
+                    if buffer is None :
+                        return
+                    with record_stage('io_read', self.bScan_size_bytes) :
+                        f_raw.seek(c_idx * self.bScan_size_bytes)
+                        n_bytes = f_raw.readinto( memoryview(buffer).cast('B') )
+                    if n_bytes != self.bScan_size_bytes :
+                        raise IOError(f"Could only read {n_bytes}/{self.bScan_size_bytes} bytes of B-scan {c_idx} from {self.file_path}")
+                    if self._wait_for(self._filled_buffers, buffer) is None :
+                        return
+        except BaseException as e :
+            self._wait_for(self._filled_buffers, e)
+
+    def close(self) -> None :
+        """ stops the reader thread (also if not all B-scans have been consumed) """
+        self._stop_event.set()
+        self._thread.join()
+
+
+class ResumableVolumeWriter() :
+    """
+    >>> Writes B-scans of a volume at their own offset into an output file, which is preallocated to its final size
+    NOTE: completed B-scans are tracked in a small sidecar file (< file_path + '.progress' >), so that an interrupted 
+    job can resume exactly where it stopped - the sidecar gets deleted once all B-scans have been written
+    NOTE: the sidecar also holds the (JSON-serializable) fingerprint of the job (i.e. params, raw file, start index), 
+    a job with another fingerprint restarts from scratch, so that B-scans of different jobs never get merged into one volume
+    """
+    def __init__(self, file_path: str, n_bScans: int, bScan_size_bytes: int, is_resume: bool=True, 
+                 fingerprint: dict=None) -> None :
+        self.file_path = file_path
+        self.progress_file_path = file_path + '.progress'
+        self.n_bScans = int(n_bScans)
+        self.bScan_size_bytes = int(bScan_size_bytes)
+        self.fingerprint = fingerprint
+        self.is_done = np.zeros(self.n_bScans, dtype=bool)
+        if not (is_resume and self._load_progress()) : # start from scratch -> (re-)allocate output file
+            with open(self.file_path, 'wb') as f :
+                f.truncate(self.n_bScans * self.bScan_size_bytes)
+            self._save_progress()
+        self._f = open(self.file_path, 'r+b')
+    
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *args) -> None :
+        self.close()
+    
+    def _load_progress(self) -> bool :
+        """ loads completion bitmap of a previous run, returns False if there is none or it doesn't match this job """
+        if not (os.path.isfile(self.progress_file_path) and os.path.isfile(self.file_path)) :
+            return False
+        try :
+            with open(self.progress_file_path) as f :
+                progress = json.load(f)
+            is_match = (progress['n_bScans'] == self.n_bScans and progress['bScan_size_bytes'] == self.bScan_size_bytes
+                        and progress.get('fingerprint') == self.fingerprint
+                        and os.path.getsize(self.file_path) == self.n_bScans * self.bScan_size_bytes)
+            if not is_match :
+                print(f"[WARNING:] Progress file {self.progress_file_path} does not match the current job - restarting")
+                return False
+            bits = np.frombuffer(bytes.fromhex(progress['bitmap']), dtype=np.uint8)
+            self.is_done = np.asarray( np.unpackbits(bits, count=self.n_bScans), dtype=bool )
+        except (ValueError, KeyError) :
+            print(f"[WARNING:] Could not parse progress file {self.progress_file_path} - restarting")
+            return False
+        print(f"[INFO:] Resuming {self.file_path} ({np.count_nonzero(self.is_done)}/{self.n_bScans} B-scans already done)")
+        return True
+    
+    def _save_progress(self) -> None :
+        """ (atomically) replaces the sidecar with the current completion bitmap """
+        progress = {'n_bScans': self.n_bScans, 'bScan_size_bytes': self.bScan_size_bytes, 'fingerprint': self.fingerprint,
+                    'bitmap': np.packbits(self.is_done).tobytes().hex()}
+        with open(self.progress_file_path + '.tmp', 'w') as f :
+            json.dump(progress, f)
+        os.replace(self.progress_file_path + '.tmp', self.progress_file_path)
+    
+    def pending_indices(self) -> list :
+        """ returns the indices of all B-scans that have not been written yet """
+        return [int(i) for i in np.flatnonzero(~self.is_done)]
+    
+    def write(self, buffer: np.ndarray, bScan_idx: int) -> None :
+        """ writes buffer at the offset of B-scan bScan_idx and marks it as done (data first, then bitmap) """
+        if buffer.nbytes != self.bScan_size_bytes :
+            raise ValueError(f"B-scan has {buffer.nbytes} bytes, expected {self.bScan_size_bytes} bytes")
+        with record_stage('io_write', buffer.nbytes) :
+            self._f.seek(bScan_idx * self.bScan_size_bytes)
+            buffer.tofile(self._f)
+            self._f.flush()
+            self.mark_done(bScan_idx)
+    
+    def mark_done(self, bScan_idxs) -> None :
+        """ marks B-scan(s) as done, i.e. if they were written to the output file by other (worker) processes """
+        self.is_done[bScan_idxs] = True
+        self._save_progress()
+    
+    def close(self) -> None :
+        """ closes the output file and deletes the sidecar, if all B-scans have been written """
+        if not self._f.closed :
+            self._f.close()
+        if self.is_done.all() and os.path.isfile(self.progress_file_path) :
+            os.remove(self.progress_file_path)
+
+
+class BackgroundBScanWriter() :
+    """
+    >>> Writes (reconstructed) buffers to a file in a background thread, in the order they have been passed in
+    NOTE: passed-in buffers must not be modified by the caller afterwards
+    NOTE: target is either a file path (opened with mode) or a ResumableVolumeWriter (offsets := B-scan indices)
+    """
+    def __init__(self, target, mode: str='a+b', max_queued: int=8) -> None :
+        self.target = target
+        self.mode = mode
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._error = None
+        self._thread = threading.Thread(target=self._write_buffers, daemon=True)
+        self._thread.start()
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *args) -> None :
+        self.close()
+
+    def write(self, buffer: np.ndarray, offset: int=None) -> None :
+        """ queues buffer to be written at the end of the file (offset=None) or at the passed-in byte offset
+        (or at the passed-in B-scan index for a ResumableVolumeWriter-target) """
+        if self._error is not None :
+            raise self._error
+        with record_stage('io_write_wait') : # producer stalls, because the writer thread falls behind
+            self._queue.put( (buffer, offset) )
+
+    def _write_buffers(self) -> None :
+        """ writer thread: drains the queue until the closing sentinel (None) arrives """
+        if isinstance(self.target, ResumableVolumeWriter) :
+            self._drain_queue(self.target.write)
+            return
+        with open(self.target, self.mode) as f :
+            def write_to_file(buffer: np.ndarray, offset: int) -> None :
+                with record_stage('io_write', buffer.nbytes) :
+                    if offset is not None :
+                        f.seek(offset)
+                    buffer.tofile(f)
+            self._drain_queue(write_to_file)
+    
+    def _drain_queue(self, write_fct) -> None :
+        while True :
+            item = self._queue.get()
+            if item is None :
+                return
+            if self._error is not None : # keep draining, so that the producer does not block
+                continue
+            try :
+                write_fct(*item)
+            except BaseException as e :
+                self._error = e
+
+    def close(self) -> None :
+        """ waits until all queued buffers are written and re-raises errors of the writer thread """
+        if self._thread.is_alive() :
+            self._queue.put(None)
+            self._thread.join()
+        if self._error is not None :
+            raise self._error
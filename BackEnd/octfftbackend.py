@@ -0,0 +1,317 @@
+"""
+                                        ******
+        Author: @Philipp Matten - philipp.matten@meduniwien.ac.at / philipp.matten@gmx.de
+
+                                    Copyright 2023
+                                        ******
+
+        >>> Contains the registry of pluggable (FFT) compute backends (numpy, multi-threaded scipy.fft, torch on the CPU),
+            through which all transforms of an OCT reconstruction are computed - the fastest available backend
+            of the host is chosen by a micro-benchmark at startup, whose results are cached between runs
+
+"""
+
+# global imports
+import os
+import json
+import time
+import importlib
+import threading
+import importlib.util
+import numpy as np
+from functools import lru_cache
+
+try :
+    import scipy.fft as scipy_fft
+except ImportError :
+    scipy_fft = None
+
+
+# machine-local cache file of the startup benchmark (not under version control)
+FFT_BACKEND_CACHE_FILE = os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'Config', 'fft_backend_cache.json'))
+
+# shape of the (complex64) buffer, that is transformed in the startup benchmark
+BENCHMARK_SHAPE = (6656, 64)
+
+
+class NumpyFftBackend() :
+    """
+    >>> FFT backend based on < np.fft > (fallback, if scipy is not available)
+    NOTE: np.fft has no thread-parallelism -> the number of workers is ignored
+    NOTE: all backends implement the transforms of this class with the same signatures (and return numpy arrays), 
+    so that a < ReconstructionPlan > runs unchanged on each of them
+    """
+    name = 'numpy'
+    is_multithreaded = False
+    is_in_place = False # can overwrite its input (overwrite_x)
+
+    def __init__(self, workers: int=None) -> None :
+        self.workers = 1
+        self._planned_sizes = set()
+
+    @classmethod
+    def is_available(cls) -> bool :
+        """ returns True, if the backend can be used in the current environment """
+        return True
+
+    @classmethod
+    def get_version(cls) -> str :
+        return np.__version__
+
+    def get_capabilities(self) -> dict :
+        """ returns the capabilities of the backend, i.e. for logging and backend selection """
+        return {'name': self.name, 'version': self.get_version(), 'device': 'cpu', 'workers': self.workers,
+                'is_multithreaded': self.is_multithreaded, 'is_in_place': self.is_in_place, 
+                'transforms': ('fft', 'ifft', 'rfft')}
+
+    def _get_workers(self, workers: int=None) -> int :
+        """ returns the number of threads of one transform (None -> global setting of the backend) """
+        return self.workers if workers is None else max(1, int(workers))
+
+    def fft(self, buffer: np.ndarray, axis: int=0, overwrite_x: bool=False, workers: int=None) -> np.ndarray :
+        return np.fft.fft(buffer, axis=axis)
+
+    def ifft(self, buffer: np.ndarray, axis: int=0, overwrite_x: bool=False, workers: int=None) -> np.ndarray :
+        return np.fft.ifft(buffer, axis=axis)
+
+    def rfft(self, buffer: np.ndarray, axis: int=0, overwrite_x: bool=False, workers: int=None) -> np.ndarray :
+        return np.fft.rfft(buffer, axis=axis)
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def next_fast_len(n: int) -> int :
+        """ returns the smallest 2/3/5-smooth length >= n (cached) """
+        return get_next_smooth_length(n, (2, 3, 5))
+
+    def plan(self, l_fft: int, kind: str='fft', dtype=np.complex64) -> None :
+        """prepares a transform of length l_fft once (one dummy transform, which initializes the backends twiddle factors),
+        so that the first reconstructed buffer does not pay for it - already planned sizes are cached
+        Args:
+            l_fft (int): transform length
+            kind (str, optional): 'fft', 'ifft' or 'rfft'. Defaults to 'fft'.
+            dtype (optional): input data type of the transform. Defaults to np.complex64.
+        """
+        key = (int(l_fft), kind, np.dtype(dtype).str)
+        if key in self._planned_sizes :
+            return
+        getattr(self, kind)( np.zeros((l_fft, 1), dtype=dtype), axis=0 )
+        self._planned_sizes.add(key)
+
+    @property
+    def planned_sizes(self) -> list :
+        """ returns the (length, kind, dtype) of all planned transforms """
+        return sorted(self._planned_sizes)
+
+
+class ScipyFftBackend(NumpyFftBackend) :
+    """
+    >>> FFT backend based on < scipy.fft >, which transforms the lateral A-scans of a buffer with multiple threads
+    (workers) and computes in single precision for complex64/float32 input
+    NOTE: scipy keeps the twiddle factors of recently used lengths in its own plan cache
+    """
+    name = 'scipy'
+    is_multithreaded = True
+    is_in_place = True
+
+    def __init__(self, workers: int=None) -> None :
+        super().__init__()
+        self.workers = (os.cpu_count() or 1) if workers is None else max(1, int(workers))
+
+    @classmethod
+    def is_available(cls) -> bool :
+        return scipy_fft is not None
+
+    @classmethod
+    def get_version(cls) -> str :
+        return importlib.import_module('scipy').__version__
+
+    def fft(self, buffer: np.ndarray, axis: int=0, overwrite_x: bool=False, workers: int=None) -> np.ndarray :
+        return scipy_fft.fft(buffer, axis=axis, overwrite_x=overwrite_x, workers=self._get_workers(workers))
+
+    def ifft(self, buffer: np.ndarray, axis: int=0, overwrite_x: bool=False, workers: int=None) -> np.ndarray :
+        return scipy_fft.ifft(buffer, axis=axis, overwrite_x=overwrite_x, workers=self._get_workers(workers))
+
+    def rfft(self, buffer: np.ndarray, axis: int=0, overwrite_x: bool=False, workers: int=None) -> np.ndarray :
+        return scipy_fft.rfft(buffer, axis=axis, overwrite_x=overwrite_x, workers=self._get_workers(workers))
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def next_fast_len(n: int) -> int :
+        """ returns the next length >= n, that scipy transforms efficiently (cached) """
+        return scipy_fft.next_fast_len(n)
+
+
+class TorchFftBackend(NumpyFftBackend) :
+    """
+    >>> FFT backend based on < torch.fft > on the CPU, which shares the memory of the numpy buffers (no copies)
+    NOTE: torch is only imported, when this backend is used - its number of threads is a process-wide setting
+    """
+    name = 'torch'
+    is_multithreaded = True
+
+    def __init__(self, workers: int=None) -> None :
+        super().__init__()
+        self._torch = importlib.import_module('torch')
+        self.workers = (os.cpu_count() or 1) if workers is None else max(1, int(workers))
+
+    @classmethod
+    def is_available(cls) -> bool :
+        return importlib.util.find_spec('torch') is not None
+
+    @classmethod
+    def get_version(cls) -> str :
+        return importlib.import_module('torch').__version__
+
+    def _transform(self, fct, buffer: np.ndarray, axis: int, workers: int) -> np.ndarray :
+        n_threads = self._get_workers(workers)
+        if self._torch.get_num_threads() != n_threads :
+            self._torch.set_num_threads(n_threads)
+        if not (buffer.flags.writeable and buffer.dtype.isnative) : # torch can only share writeable, native arrays
+            buffer = np.array(buffer, dtype=buffer.dtype.newbyteorder('='))
+        with self._torch.no_grad() :
+            return fct(self._torch.from_numpy(buffer), dim=axis).numpy()
+
+    def fft(self, buffer: np.ndarray, axis: int=0, overwrite_x: bool=False, workers: int=None) -> np.ndarray :
+        return self._transform(self._torch.fft.fft, buffer, axis, workers)
+
+    def ifft(self, buffer: np.ndarray, axis: int=0, overwrite_x: bool=False, workers: int=None) -> np.ndarray :
+        return self._transform(self._torch.fft.ifft, buffer, axis, workers)
+
+    def rfft(self, buffer: np.ndarray, axis: int=0, overwrite_x: bool=False, workers: int=None) -> np.ndarray :
+        return self._transform(self._torch.fft.rfft, buffer, axis, workers)
+
+
+# registry of all backends (name -> class), in order of preference if they are equally fast
+FFT_BACKENDS = {}
+_fft_backend = None
+_fft_backend_lock = threading.RLock() # the backend is chosen once, even if several threads (i.e. GUI worker pool) use it first
+
+
+def register_fft_backend(backend_class: type) -> type :
+    """ adds a backend class (with the interface of < NumpyFftBackend >) to the registry, under its name """
+    FFT_BACKENDS[backend_class.name] = backend_class
+    return backend_class
+
+for backend_class in (ScipyFftBackend, TorchFftBackend, NumpyFftBackend) :
+    register_fft_backend(backend_class)
+
+
+def get_next_smooth_length(n: int, primes: tuple=(2, 3, 5)) -> int :
+    """ returns the smallest integer >= n, which has no prime factors other than the passed-in primes """
+    assert n >= 1, "Length must be a positive integer"
+    while True :
+        m = n
+        for p in primes :
+            while m % p == 0 :
+                m //= p
+        if m == 1 :
+            return n
+        n += 1
+
+def is_fft_backend_available(name: str) -> bool :
+    """ returns True, if the FFT backend can be used in the current environment """
+    if name not in FFT_BACKENDS :
+        raise ValueError(f"Unrecognized FFT backend '{name}' (expected one of {tuple(FFT_BACKENDS)})")
+    return FFT_BACKENDS[name].is_available()
+
+def get_available_fft_backends() -> list :
+    """ returns the names of all registered backends, that can be used in the current environment """
+    return [name for name in FFT_BACKENDS if is_fft_backend_available(name)]
+
+def benchmark_fft_backends(shape: tuple=BENCHMARK_SHAPE, n_repeats: int=3) -> dict :
+    """ returns the (best of n_repeats) runtime in seconds of a complex64 FFT along axis 0 of a buffer of the 
+    passed-in shape for all available backends """
+    buffer = np.ones(shape, dtype=np.complex64)
+    timings = {}
+    for name in get_available_fft_backends() :
+        try :
+            backend = FFT_BACKENDS[name]()
+            backend.plan(shape[0])
+            t = []
+            for _ in range(n_repeats) :
+                t1 = time.perf_counter()
+                backend.fft(buffer, axis=0)
+                t.append(time.perf_counter() - t1)
+            timings[name] = min(t)
+        except Exception as e : # i.e. a broken installation -> backend is skipped
+            print(f"[WARNING:] Could not benchmark {name}-FFT backend ({e})")
+    return timings
+
+def get_fastest_fft_backend(cache_file_path: str=FFT_BACKEND_CACHE_FILE) -> str :
+    """returns the name of the fastest available backend on this host - the benchmark only runs, if the cache file
+    holds no result for the current set of available backends (and their versions) and number of cores
+    Args:
+        cache_file_path (str, optional): path of the (JSON) cache file. Defaults to FFT_BACKEND_CACHE_FILE.
+    Returns:
+        str: name of the fastest backend
+    """
+    key = ';'.join(f"{n}-{FFT_BACKENDS[n].get_version()}" for n in get_available_fft_backends()) + f";cores-{os.cpu_count()}"
+    cache = {}
+    if os.path.isfile(cache_file_path) :
+        try :
+            with open(cache_file_path) as f :
+                cache = json.load(f)
+        except (ValueError, OSError) :
+            print(f"[WARNING:] Could not parse FFT backend cache {cache_file_path} - re-running benchmark")
+    if key in cache and is_fft_backend_available(cache[key]['fastest']) :
+        return cache[key]['fastest']
+    timings = benchmark_fft_backends()
+    # registry order breaks (near) ties, i.e. torch is not imported for a marginal gain
+    fastest = next(n for n in FFT_BACKENDS if n in timings and timings[n] <= min(timings.values()) * 1.05)
+    print(f"[INFO:] Benchmarked FFT backends: " + ', '.join(f"{n}={t*1e3:.1f}ms" for n, t in timings.items()))
+    cache[key] = {'fastest': fastest, 'timings': timings}
+    try :
+        with open(cache_file_path + '.tmp', 'w') as f :
+            json.dump(cache, f, indent=4)
+        os.replace(cache_file_path + '.tmp', cache_file_path)
+    except OSError as e :
+        print(f"[WARNING:] Could not save FFT backend cache {cache_file_path} ({e})")
+    return fastest
+
+def set_fft_backend(name: str=None, workers: int=None) -> NumpyFftBackend :
+    """sets the (global) FFT backend, through which all reconstructions are computed
+    Args:
+        name (str, optional): name of a registered backend, i.e. 'scipy', 'torch' or 'numpy'. 
+        Defaults to None (-> fastest available backend, see < get_fastest_fft_backend() >).
+        workers (int, optional): default number of threads per transform. Defaults to None (-> all cores).
+    Returns:
+        NumpyFftBackend: the newly set backend
+    """
+    global _fft_backend
+    with _fft_backend_lock :
+        if name is None :
+            name = get_fastest_fft_backend()
+        elif not is_fft_backend_available(name) :
+            raise ValueError(f"FFT backend '{name}' is not available (is it installed?)")
+        _fft_backend = FFT_BACKENDS[name](workers)
+        print(f"[INFO:] Using {_fft_backend.name}-FFT backend with {_fft_backend.workers} worker(s)")
+        return _fft_backend
+
+def get_fft_backend() -> NumpyFftBackend :
+    """ returns the (global) FFT backend, which is chosen once (on first use), if none has been set """
+    backend = _fft_backend
+    if backend is None :
+        with _fft_backend_lock :
+            if _fft_backend is None : # not chosen by another thread in the meantime
+                return set_fft_backend()
+            return _fft_backend
+    return backend
+
+def set_fft_workers(workers: int) -> None :
+    """ sets the default number of threads per transform of the (global) FFT backend,
+    i.e. to 1 in worker processes, which reconstruct B-scans in parallel """
+    get_fft_backend().workers = max(1, int(workers))
+
+
+# for testing and debugging purposes
+if __name__ == '__main__' :
+    print("[INFO:] Running from < octfftbackend.py > ...")
+    import time
+    buffer = np.asarray( np.random.default_rng(0).standard_normal((13312, 512)), dtype=np.complex64 )
+    for name in get_available_fft_backends() :
+        backend = set_fft_backend(name)
+        print(backend.get_capabilities())
+        backend.plan(buffer.shape[0])
+        t1 = time.perf_counter()
+        backend.fft(buffer, axis=0)
+        print(f"{name}: {time.perf_counter() - t1:.3f}s for {buffer.shape[1]} A-scans of length {buffer.shape[0]}")
@@ -0,0 +1,136 @@
+"""
+                                        ******
+        Author: @Philipp Matten - philipp.matten@meduniwien.ac.at / philipp.matten@gmx.de
+
+                                    Copyright 2023
+                                        ******
+
+        >>> Contains the FFT-length autotuner, which benchmarks candidate transform lengths of an A-scan once per
+            machine (and FFT backend) and keeps the fastest one in a local cache file
+
+"""
+
+# global imports
+import os
+import json
+import time
+import numpy as np
+
+# custom imports
+from octfftbackend import get_fft_backend, get_next_smooth_length
+
+
+# machine-local cache file of the tuned FFT lengths (not under version control)
+FFT_LENGTH_CACHE_FILE = os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'Config', 'fft_length_cache.json'))
+
+# candidates, which are within this (relative) margin of the fastest one, count as equally fast -> shortest one wins
+TIMING_TOLERANCE = 0.05
+
+
+class FftLengthTuner() :
+    """
+    >>> Benchmarks the candidate FFT lengths of an A-scan length (native length, next 2/3/5-smooth length and next power
+    of 2, of the A-scan length or twice of it for zero-padded interpolation) and returns the fastest one
+    NOTE: results are keyed by FFT backend, number of threads and A-scan length and persisted in a JSON-file,
+    i.e. each length is only benchmarked once per machine
+    """
+    def __init__(self, cache_file_path: str=FFT_LENGTH_CACHE_FILE, n_aScans: int=128, n_repeats: int=3) -> None :
+        self.cache_file_path = cache_file_path
+        self.n_aScans = n_aScans
+        self.n_repeats = n_repeats
+        self._cache = self._load_cache()
+
+    def _load_cache(self) -> dict :
+        if not os.path.isfile(self.cache_file_path) :
+            return {}
+        try :
+            with open(self.cache_file_path) as f :
+                return json.load(f)
+        except (ValueError, OSError) :
+            print(f"[WARNING:] Could not parse FFT length cache {self.cache_file_path} - re-tuning")
+            return {}
+
+    def _save_cache(self) -> None :
+        """ (atomically) replaces the cache file with the current results """
+        try :
+            with open(self.cache_file_path + '.tmp', 'w') as f :
+                json.dump(self._cache, f, indent=4)
+            os.replace(self.cache_file_path + '.tmp', self.cache_file_path)
+        except OSError as e : # i.e. read-only installation -> results are only kept for this session
+            print(f"[WARNING:] Could not save FFT length cache {self.cache_file_path} ({e})")
+
+    @staticmethod
+    def get_candidate_lengths(a_len: int, is_interpolate: bool=False) -> list :
+        """ returns the (unique, sorted) candidate FFT lengths for an A-scan of length a_len """
+        l_min = 2 * a_len if is_interpolate else a_len
+        l_pow2 = 1 << (l_min - 1).bit_length()
+        return sorted({l_min, get_next_smooth_length(l_min, (2, 3, 5)), l_pow2})
+
+    def benchmark(self, l_fft: int) -> float :
+        """ returns the (best of n_repeats) runtime in seconds of a complex64 FFT of n_aScans A-scans with length l_fft """
+        backend = get_fft_backend()
+        backend.plan(l_fft)
+        buffer = np.ones((l_fft, self.n_aScans), dtype=np.complex64)
+        timings = []
+        for _ in range(self.n_repeats) :
+            t1 = time.perf_counter()
+            backend.fft(buffer, axis=0)
+            timings.append(time.perf_counter() - t1)
+        return min(timings)
+
+    @staticmethod
+    def _get_key(a_len: int, is_interpolate: bool=False) -> str :
+        backend = get_fft_backend()
+        return f"{backend.name}:{backend.workers}:{a_len}{':interpolate' if is_interpolate else ''}"
+
+    def set_fft_length(self, a_len: int, l_fft: int, is_interpolate: bool=False) -> None :
+        """ pins the FFT length of an A-scan length for this session (not saved to the cache file), i.e. in worker processes,
+        which have fewer threads than their parent, but must use the same length to write into its preallocated output file """
+        self._cache[self._get_key(a_len, is_interpolate)] = {'l_fft': int(l_fft)}
+
+    def get_fft_length(self, a_len: int, is_interpolate: bool=False) -> int :
+        """returns the fastest FFT length for an A-scan of length a_len (benchmarked once, then from the cache)
+        Args:
+            a_len (int): length of raw A-scan
+            is_interpolate (bool, optional): flag to (at least) double the FFT length, i.e. to interpolate the
+            reconstructed A-scans by zero-padding. Defaults to False.
+        Returns:
+            int: FFT length (>= a_len, or >= 2*a_len for is_interpolate)
+        """
+        key = self._get_key(a_len, is_interpolate)
+        if key not in self._cache :
+            timings = {l : self.benchmark(l) for l in self.get_candidate_lengths(a_len, is_interpolate)}
+            t_min = min(timings.values())
+            winner = min(l for l, t in timings.items() if t <= t_min * (1 + TIMING_TOLERANCE))
+            self._cache[key] = {'l_fft': winner, 'timings': {str(l) : t for l, t in timings.items()}}
+            self._save_cache()
+            print(f"[INFO:] Tuned FFT length for A-scans of length {a_len}: {winner} (candidates: {sorted(timings)})")
+        return int(self._cache[key]['l_fft'])
+
+
+_fft_length_tuner = None
+
+
+def get_tuned_fft_length(a_len: int, is_interpolate: bool=False) -> int :
+    """ returns the fastest FFT length for an A-scan of length a_len from the (global) tuner, see < FftLengthTuner.get_fft_length() > """
+    return _get_fft_length_tuner().get_fft_length(a_len, is_interpolate=is_interpolate)
+
+def set_tuned_fft_length(a_len: int, l_fft: int, is_interpolate: bool=False) -> None :
+    """ pins the FFT length for an A-scan of length a_len in the (global) tuner, see < FftLengthTuner.set_fft_length() > """
+    _get_fft_length_tuner().set_fft_length(a_len, l_fft, is_interpolate=is_interpolate)
+
+def _get_fft_length_tuner() -> FftLengthTuner :
+    global _fft_length_tuner
+    if _fft_length_tuner is None :
+        _fft_length_tuner = FftLengthTuner()
+    return _fft_length_tuner
+
+
+# for testing and debugging purposes
+if __name__ == '__main__' :
+    print("[INFO:] Running from < octfftlengthtuner.py > ...")
+    tuner = FftLengthTuner(cache_file_path=FFT_LENGTH_CACHE_FILE + '.debug')
+    for a_len in (1024, 2048, 6656, 13312) :
+        for is_interpolate in (False, True) :
+            l_fft = tuner.get_fft_length(a_len, is_interpolate=is_interpolate)
+            print(f"A-scan length {a_len} (interpolate: {is_interpolate}) -> FFT length {l_fft}")
@@ -0,0 +1,102 @@
+"""
+                                        ******
+        Author: @Philipp Matten - philipp.matten@meduniwien.ac.at / philipp.matten@gmx.de
+
+                                    Copyright 2023
+                                        ******
+
+        >>> Contains a generator of synthetic, but realistic spectral OCT fringes (layered reflectors, dispersion,
+            source spectrum, background and noise) for benchmarking and testing the reconstruction
+
+"""
+
+# global imports
+import os
+import numpy as np
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class FringeParams() :
+    """
+    >>> parameters of the simulated sample and OCT system
+    NOTE: depths are given as fraction of the imaging depth (0 := DC, 1 := Nyquist), the dispersion coefficients
+    follow the convention of < OctReconstructionManager.create_3rd_order_polynominal() >
+    """
+    layer_depths: tuple = (0.15, 0.2, 0.24, 0.3, 0.42)
+    layer_reflectivities: tuple = (1e-3, 4e-4, 2e-4, 6e-4, 1e-4)
+    layer_curvature: float = 0.05 # max. axial displacement of the layers across a B-scan (same unit as depths)
+    disp_coeffs: tuple = (-5, 125, 0, 0)
+    spectrum_width: float = 0.35 # 1/e-half width of the Gaussian source spectrum (fraction of the A-scan length)
+    background_level: float = 1800 # peak counts of the reference arm spectrum
+    fixed_pattern_level: float = 20 # peak counts of a static, A-scan independent ripple on the background
+    noise_std: float = 6 # counts of the (Gaussian) detection noise
+    bit_depth: int = 12
+
+
+def simulate_bScan(a_len: int, b_len: int, params: FringeParams=FringeParams(), seed: int=0) -> np.ndarray :
+    """returns a simulated raw B-scan with A-scans along axis 0 (in-memory convention of the reconstruction)
+    Args:
+        a_len (int): number of spectral samples per A-scan
+        b_len (int): number of A-scans
+        params (FringeParams, optional): sample and system parameters. Defaults to FringeParams().
+        seed (int, optional): seed of the random speckle and noise. Defaults to 0.
+    Returns:
+        np.ndarray: raw B-scan of shape (a_len, b_len) in uint16
+    """
+    assert len(params.layer_depths) == len(params.layer_reflectivities), "Expecting one reflectivity per layer"
+    rng = np.random.default_rng(seed)
+    n = np.arange(a_len, dtype=np.float64)[:, np.newaxis]
+    x = np.linspace(-0.5, 0.5, a_len)[:, np.newaxis]
+    spectrum = np.exp( -(x / params.spectrum_width)**2 )
+    phase_disp = np.polyval(params.disp_coeffs, x)
+    lateral = np.linspace(0, np.pi, b_len)[np.newaxis, :]
+    fringes = np.zeros((a_len, b_len), dtype=np.float64)
+    for depth, reflectivity in zip(params.layer_depths, params.layer_reflectivities) :
+        depths = depth + params.layer_curvature * np.sin(lateral) # curved layers, i.e. like a retina
+        speckle = rng.rayleigh(1 / np.sqrt(np.pi / 2), size=(1, b_len)) # unit mean amplitude
+        fringes += np.sqrt(reflectivity) * speckle * np.cos( np.pi * depths * n + phase_disp )
+    background = 1 + params.fixed_pattern_level / params.background_level * np.cos(0.37 * n)
+    raw = params.background_level * spectrum * (background + 2 * fringes)
+    raw += rng.normal(0, params.noise_std, size=raw.shape)
+    return np.asarray( np.clip(raw, 0, 2**params.bit_depth - 1), dtype=np.uint16 )
+
+def write_synthetic_volume(dir_path: str, dims: tuple, params: FringeParams=FringeParams(), n_unique_bScans: int=4,
+                           dtype='<u2', name: str='synthetic') -> str :
+    """writes a simulated raw volume file in the (B-scan wise) layout of the acquisition software, i.e. one B-scan of
+    shape (bLen, aLen) after the other - the file name contains the dimensions, as expected by < get_oct_volume_dims() >
+    Args:
+        dir_path (str): directory of the volume file
+        dims (tuple): raw volume dimensions (aLen, bLen, cLen)
+        params (FringeParams, optional): sample and system parameters. Defaults to FringeParams().
+        n_unique_bScans (int, optional): number of different simulated B-scans, that are repeated along the slow axis
+        (simulating is slower than reconstructing). Defaults to 4.
+        dtype (optional): data type (and endianness) of the file. Defaults to '<u2'.
+        name (str, optional): file name prefix. Defaults to 'synthetic'.
+    Returns:
+        str: full path of the volume file
+    """
+    assert len(dims) == 3, "Expecting the dimensions of a (3D) volume"
+    a_len, b_len, c_len = dims
+    full_file_path = os.path.join(dir_path, f"{name}_{a_len}x{b_len}x{c_len}.bin")
+    bScans = [np.asarray(simulate_bScan(a_len, b_len, params, seed=s).T, dtype=dtype) for s in range(min(n_unique_bScans, c_len))]
+    with open(full_file_path, 'wb') as f :
+        for c in range(c_len) :
+            bScans[c % len(bScans)].tofile(f)
+    return full_file_path
+
+
+# for testing and debugging purposes
+if __name__ == '__main__' :
+    print("[INFO:] Running from < octfringesimulator.py > ...")
+    import sys
+    import matplotlib.pyplot as plt
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'Config')))
+    from octreconstructionmanager import OctReconstructionManager
+    raw = simulate_bScan(6656, 700)
+    plan = OctReconstructionManager.get_reconstruction_plan(raw.shape[0], FringeParams().disp_coeffs, 'hann',
+                                                             samples_dc_crop=25, is_bg_sub=True, is_scale_data_for_disp=False)
+    fig, ax = plt.subplots(1, 2)
+    ax[0].plot(raw[:, raw.shape[1]//2])
+    ax[1].imshow(plan.run(raw), cmap='gray', aspect='auto')
+    plt.show()
@@ -0,0 +1,206 @@
+"""
+                                        ******
+        Author: @Philipp Matten - philipp.matten@meduniwien.ac.at / philipp.matten@gmx.de
+
+                                    Copyright 2023
+                                        ******
+
+        >>> Contains the memory-profiling mode of reconstruction (and auxiliary) jobs: traced allocations (tracemalloc)
+            and sampled RSS give the peak memory per pipeline stage and the largest (transient) arrays of a job
+
+"""
+
+# global imports
+import os
+import sys
+import json
+import threading
+import contextlib
+import tracemalloc
+import numpy as np
+
+# custom imports
+from octstagerecorder import StageRecorder, get_stage_recorder, enable_stage_recording, disable_stage_recording
+
+
+def get_rss_bytes() -> int :
+    """ returns the current resident set size of this process, None if it can not be determined on this platform """
+    try :
+        with open('/proc/self/statm') as f : # Linux
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError) :
+        pass
+    try :
+        import psutil
+        return int(psutil.Process().memory_info().rss)
+    except ImportError :
+        return None
+
+
+class MemoryProfiler(StageRecorder) :
+    """
+    >>> Context manager, that profiles the memory of the job in its body: all instrumented stages (see < octstagerecorder.py >)
+    report their (traced) peak allocation, a sampling thread tracks the RSS and captures the largest arrays, which are
+    referenced by any thread, whenever the traced memory reaches a new high
+    NOTE: tracemalloc slows down allocations of Python objects (not the computations on arrays) - only for profiling!
+    NOTE: peaks of concurrent stages (i.e. reader/writer threads) overlap, worker processes are not profiled
+    """
+    def __init__(self, interval: float=0.01, n_largest: int=10, n_frames: int=8) -> None :
+        super().__init__()
+        self.interval = interval
+        self.n_largest = n_largest
+        self.n_frames = n_frames
+        self._open_stages = [] # [stage, traced bytes at start, peak since start]
+        self._memory = {} # stage -> [calls, max. peak above start, max. absolute peak]
+        self._largest_arrays = {}
+        self._top_allocations = []
+        self.peak_traced_bytes = 0
+        self.peak_rss_bytes = None
+        self.baseline_rss_bytes = None
+
+    def __enter__(self) :
+        self._is_own_tracing = not tracemalloc.is_tracing()
+        if self._is_own_tracing :
+            tracemalloc.start(self.n_frames)
+        tracemalloc.reset_peak()
+        self.reset()
+        self.baseline_rss_bytes = self.peak_rss_bytes = get_rss_bytes()
+        self._snapshot_threshold = tracemalloc.get_traced_memory()[0]
+        self._previous_recorder = get_stage_recorder()
+        enable_stage_recording(self)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None :
+        self._stop_event.set()
+        self._thread.join()
+        self._update_peaks()
+        disable_stage_recording()
+        if self._previous_recorder is not None :
+            enable_stage_recording(self._previous_recorder)
+        if self._is_own_tracing :
+            tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def record(self, stage: str, n_bytes: int=0) :
+        """ same as < StageRecorder.record() >, but also records the (traced) peak allocation of the stage """
+        self._fold_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        entry = [stage, start, start]
+        self._open_stages.append(entry)
+        try :
+            with super().record(stage, n_bytes) :
+                yield
+        finally :
+            self._fold_peak()
+            self._open_stages.remove(entry)
+            with self._lock :
+                memory = self._memory.setdefault(stage, [0, 0, 0])
+                memory[0] += 1
+                memory[1] = max(memory[1], entry[2] - entry[1])
+                memory[2] = max(memory[2], entry[2])
+
+    def _fold_peak(self) -> None :
+        """ passes the traced peak since the last reset on to all open stages (before it gets reset again) """
+        peak = tracemalloc.get_traced_memory()[1]
+        self.peak_traced_bytes = max(self.peak_traced_bytes, peak)
+        for entry in list(self._open_stages) :
+            entry[2] = max(entry[2], peak)
+
+    def _update_peaks(self) -> None :
+        rss = get_rss_bytes()
+        if rss is not None :
+            self.peak_rss_bytes = max(self.peak_rss_bytes or 0, rss)
+        self.peak_traced_bytes = max(self.peak_traced_bytes, tracemalloc.get_traced_memory()[1])
+
+    def _sample(self) -> None :
+        """ sampling thread: tracks RSS and captures the largest arrays at each new high (+10%) of the traced memory """
+        while not self._stop_event.wait(self.interval) :
+            self._update_peaks()
+            current = tracemalloc.get_traced_memory()[0]
+            if current > self._snapshot_threshold * 1.1 :
+                self._snapshot_threshold = current
+                self._capture_largest_arrays(current)
+
+    def _capture_largest_arrays(self, traced_bytes: int) -> None :
+        """ collects the arrays, that are referenced by local variables of all other threads, and the allocation sites of
+        the largest traced (numpy) memory blocks, i.e. also of temporaries without a name """
+        stage = self._open_stages[-1][0] if self._open_stages else None
+        arrays = {}
+        for thread_id, frame in sys._current_frames().items() :
+            if thread_id == threading.get_ident() :
+                continue
+            while frame is not None :
+                for name, value in list(frame.f_locals.items()) :
+                    if isinstance(value, np.ndarray) :
+                        owner = value
+                        while isinstance(owner.base, np.ndarray) : # views are attributed to the array owning the data
+                            owner = owner.base
+                        site = f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}:{name}"
+                        arrays[id(owner)] = {'bytes': owner.nbytes, 'shape': owner.shape, 'dtype': str(owner.dtype),
+                                             'site': site, 'stage': stage, 'traced_bytes': traced_bytes}
+                frame = frame.f_back
+        with self._lock :
+            for array in arrays.values() :
+                key = (array['site'], array['shape'], array['dtype'])
+                if key not in self._largest_arrays or self._largest_arrays[key]['traced_bytes'] < traced_bytes :
+                    self._largest_arrays[key] = array
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.DomainFilter(True, np.lib.tracemalloc_domain)])
+        self._top_allocations = [{'bytes': s.size, 'count': s.count, 'site': str(s.traceback[0]), 'stage': stage,
+                                  'traced_bytes': traced_bytes} for s in snapshot.statistics('lineno')[:self.n_largest]]
+
+    def get_memory_report(self) -> dict :
+        """ returns the peak memory (traced and RSS), the peak allocation per stage and the largest arrays of the job """
+        with self._lock :
+            stages = {stage : {'calls': calls, 'peak_bytes': peak, 'peak_traced_bytes': peak_abs}
+                      for stage, (calls, peak, peak_abs) in self._memory.items()}
+            largest = sorted(self._largest_arrays.values(), key=lambda a : -a['bytes'])[:self.n_largest]
+        return {'peak_traced_bytes': self.peak_traced_bytes, 'peak_rss_bytes': self.peak_rss_bytes,
+                'baseline_rss_bytes': self.baseline_rss_bytes, 'stages': stages,
+                'largest_arrays': [dict(a, shape=list(a['shape'])) for a in largest], 'top_allocations': self._top_allocations}
+
+    def print_summary(self) -> None :
+        """ prints the stage timings and the memory report """
+        super().print_summary()
+        report, MB = self.get_memory_report(), 1024**2
+        rss = 'n/a' if report['peak_rss_bytes'] is None else f"{report['peak_rss_bytes']/MB:.1f} MB"
+        print(f"[INFO:] Peak memory: {report['peak_traced_bytes']/MB:.1f} MB traced, {rss} RSS")
+        for stage, s in sorted(report['stages'].items(), key=lambda item : -item[1]['peak_bytes']) :
+            print(f"{stage:>24}: {s['peak_bytes']/MB:10.1f} MB above start of stage ({s['peak_traced_bytes']/MB:.1f} MB traced in total)")
+        print("[INFO:] Largest arrays:")
+        for a in report['largest_arrays'] :
+            print(f"{a['bytes']/MB:10.1f} MB {str(tuple(a['shape'])):>22} {a['dtype']:>10} {a['site']} (stage: {a['stage']})")
+        print("[INFO:] Largest allocation sites of arrays (at the highest traced memory):")
+        for a in report['top_allocations'] :
+            print(f"{a['bytes']/MB:10.1f} MB in {a['count']:4d} block(s) at {a['site']}")
+
+    def to_json(self, file_path: str) -> None :
+        """ saves the stage timings and the memory report as JSON-file """
+        with open(file_path, 'w') as f :
+            json.dump(dict(self.get_summary(), memory=self.get_memory_report()), f, indent=4)
+
+
+def profile_memory(fct, *args, **kwargs) -> tuple :
+    """runs a (reconstruction or auxiliary) job in memory-profiling mode and prints its report
+    Args:
+        fct: job, that is called with the passed-in (keyword) arguments
+    Returns:
+        tuple: result of the job and the MemoryProfiler (i.e. to export its report with < to_json() >)
+    """
+    with MemoryProfiler() as profiler :
+        result = fct(*args, **kwargs)
+    profiler.print_summary()
+    return result, profiler
+
+
+# for testing and debugging purposes
+if __name__ == '__main__' :
+    print("[INFO:] Running from < octmemoryprofiler.py > ...")
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'Config')))
+    from octreconstructionmanager import OctReconstructionManager
+    from octfringesimulator import simulate_bScan
+    raw = np.stack([simulate_bScan(6656, 700, seed=s) for s in range(4)], axis=-1)
+    profile_memory(OctReconstructionManager()._run_reconstruction_from_json, raw, 'DefaultReconParams')
@@ -12,27 +12,38 @@
 # global imports
 import os
 import sys
+import hashlib
 import numpy as np
 from tqdm import tqdm
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from scipy import signal
 import matplotlib.pyplot as plt
 
 # custom imports
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'Config')))
-from configdatamanager import ConfigDataManager
+from reconparamsmanager import ReconParams, load_recon_params
 
 import octdatafilemanager as IO
+from octreconstructionplan import ReconstructionPlan, DEFAULT_MEM_BUDGET_BYTES
+from octdatastreammanager import PrefetchingBScanReader, BackgroundBScanWriter, ResumableVolumeWriter
+from octbackgroundmanager import load_background, calculate_median_aScan
+from octfftbackend import get_fft_backend, set_fft_workers
+from octfftlengthtuner import get_tuned_fft_length, set_tuned_fft_length
+from octstagerecorder import record_stage, recorded_stage, get_stage_recorder, enable_stage_recording, disable_stage_recording
 
 class OctReconstructionManager(IO.OctDataFileManager) :
     def __init__(self, dtype_loading='<u2') -> None:
         super().__init__(dtype_loading=dtype_loading)
         self.dtype_raw = np.uint16
         self.dtype_recon = np.uint8
+        self.fft_backend = get_fft_backend() # chosen once per process (i.e. multi-threaded scipy.fft, if available)
         
     ###########################################                     
     # ***** high-level processing methods *****
     ###########################################
     # ***** Pre-Processing *****  
+    @recorded_stage('pre_fft')
     def perform_pre_fft_functions(self, buffer: np.ndarray, coeffs: tuple, key: str, is_sub_bg: bool=False) -> np.ndarray :
         """applies pre-FFT operations, with an option for Background Subtraction of OCT raw buffer
         Args:
@@ -48,44 +59,46 @@ class OctReconstructionManager(IO.OctDataFileManager) :
         return self.apply_dispersion_correction(buffer, coeffs=coeffs, key=key)
     
     # ***** Fast Fourier-Transform *****
+    @recorded_stage('fft')
     def perform_fft(self, buffer: np.ndarray, l_pad: int=None) -> np.ndarray :
         """apply fast fourier transform to the entire OCT data buffer
         Args:
             buffer (np.ndarray): OCT data, ready to be Fourier Transfpormed 
-            l_pad (int): number of zeros to be added along A-scan. Defaults to None.
+            l_pad (int): number of zeros to be added along A-scan (1 := autotuned FFT length). Defaults to None (-> A-scan length).
 
         Returns:
             np.ndarray: complex-valued FFT buffer of the OCT volume/buffer
         """
-        # TODO: check if it can be optimized, so that the FFT length of an A-scan is always powers of 2
-        if l_pad == None :
-            l_pad = buffer.shape[0]
-        elif l_pad == 1:
-            l_pad = OctReconstructionManager.diff_to_next_power_of_2(buffer.shape[0])
-        assert l_pad >= 0, "Padding values must be positve integer values"
-        return np.asarray( np.fft.fft( self.pad_buffer_along_axis(buffer, l_pad + buffer.shape[0]), axis=0 ), dtype=np.complex64 )
+        buffer = self.pad_buffer_along_axis(buffer, self.get_fft_length(buffer.shape[0], l_pad))
+        return np.asarray( get_fft_backend().fft(buffer, axis=0), dtype=np.complex64 )
     
     # ***** Post-Processing ***** ---------------------------------------------
-    def perform_post_fft_functions(self, buffer: np.ndarray, fac_scale: int, black_lvl: int, is_scale_data_for_disp: bool) -> np.ndarray:
-        """applies all neccessary post-FFT operations 
+    def perform_post_fft_functions(self, buffer: np.ndarray, fac_scale: int, black_lvl: int, is_scale_data_for_disp: bool, 
+                                   out: np.ndarray=None) -> np.ndarray:
+        """applies all neccessary post-FFT operations (fused, see < ReconstructionPlan.apply_post_fft() >)
         >>> FFT has to be perfomed first (not iFFT(! due to values/dtype-conversions and log10)
         Args:
             buffer (np.ndarray): OCT data 
             fac_scale (int): scaling factor to scale in uint8 value-space
             black_lvl (int): constant to be substrated from signal
             is_scale_data_for_disp (bool): flag to deterine wether of not the data should be scaled to uint8 value space
+            out (np.ndarray, optional): output buffer for the cropped half of the A-scans (self.dtype_recon or float32). 
+            Defaults to None (-> newly allocated).
         Returns:
             np.ndarray: final reconstructed OCT signal
         """
-        data = self.return_abs_val_in_log_scale( self.crop_fft_buffer(buffer) ) # already cropped compl.-conj.
+        buffer = buffer[:buffer.shape[0]//2] # view on first "Fourier-plane" (w/o copy)
+        if out is None :
+            out = np.empty(buffer.shape, dtype=self.dtype_recon if is_scale_data_for_disp else np.float32)
         if is_scale_data_for_disp :
-            return self.return_scaled( data, black_lvl=black_lvl, disp_scale=fac_scale ) 
-        return data
+            return ReconstructionPlan.apply_post_fft( buffer, out, scale_fac=fac_scale, blck_lvl=black_lvl )
+        return ReconstructionPlan.apply_post_fft( buffer, out )
    
     # ***** HIGH-LEVEL METHODs that performs entire OCT-RECONSTRUCTION *****
     #-----------------------------------------------------------------
     def _run_reconstruction(self, buffer: np.ndarray, disp_coeffs: tuple, wind_key: str, samples_hf_crop: int=0, samples_dc_crop: int=0, 
-                           scale_fac: int=65, blck_lvl: int=77, is_bg_sub: bool=False, show_scaled_data: bool=True) -> np.ndarray : 
+                           scale_fac: int=65, blck_lvl: int=77, is_bg_sub: bool=False, show_scaled_data: bool=True, sigma: int=None, 
+                           background: np.ndarray=None) -> np.ndarray : 
         """performs reconstruction on entire passed-in OCT data buffer 
         created as high level method call for easy accessability of OCT capabilities from GUI
         Args:
@@ -98,33 +111,48 @@ class OctReconstructionManager(IO.OctDataFileManager) :
             blck_lvl (int, optional): constant to be subtracted from recon signal. Defaults to 77.
             is_bg_sub (bool, optional): flag to enable background subtraction. Defaults to False.
             show_scaled_data (bool, optional): flag to enable scaling of data to 8 Bit uint8 display range. Defaults to True.
+            sigma (int, optional): sigma-param for Gaussian/Kaiser windowing function. Defaults to None.
+            background (np.ndarray, optional): background A-scan, i.e. from a calibration file (< octbackgroundmanager.py >),
+            which is subtracted if is_bg_sub is set. Defaults to None (-> mean A-scan of the passed-in buffer).
         Returns:
             np.ndarray: reconstructed OCT data
         """
-        pre_ = self.perform_pre_fft_functions( buffer, disp_coeffs, wind_key, is_bg_sub)
-        post_ = self.perform_fft( pre_ )
-        return self.perform_post_fft_functions( post_, scale_fac, blck_lvl, show_scaled_data )
+        plan = self.get_reconstruction_plan( buffer.shape[0], tuple(disp_coeffs), wind_key, sigma, 
+                                             samples_dc_crop=samples_dc_crop, samples_hf_crop=samples_hf_crop, 
+                                             scale_fac=scale_fac, blck_lvl=blck_lvl, is_bg_sub=is_bg_sub, 
+                                             is_scale_data_for_disp=show_scaled_data )
+        return plan.run( buffer, background=background )
 
     # -----------------------------------------------------------------------------------------------------
-    def _run_reconstruction_from_json(self, buffer: np.ndarray, json_config_file_path: str) -> np.ndarray : 
+    def _run_reconstruction_from_json(self, buffer: np.ndarray, json_config_file_path: str, 
+                                      mem_budget_bytes: int=DEFAULT_MEM_BUDGET_BYTES) -> np.ndarray : 
         """same functionality as _run_reconstruction(), 
         only that the reconstruction-parameters are parsed from JSON-congig-file
+        >>> the file is only parsed again if it changed on disk - for per-buffer calls use _run_reconstruction_from_params()
         Args:
             buffer (np.ndarray): raw OCT data
             json_config_file_path (str): path to the JSON-file containing the reconstruction params
+            mem_budget_bytes (int, optional): upper limit for the intermediate buffers. Defaults to DEFAULT_MEM_BUDGET_BYTES.
         Returns:
             np.ndarray: reconstructed OCT data
         """
-        JSON = ConfigDataManager(filename=json_config_file_path).load_json_file()
-        pre_ = self.perform_pre_fft_functions( buffer=buffer, 
-                                               coeffs=JSON['dispersion_coefficients'], 
-                                               key=JSON['windowing_key'], 
-                                               is_sub_bg=JSON['is_substract_background'])
-        post_ = self.perform_fft( pre_, l_pad=JSON["zeros_to_pad"] )
-        return self.perform_post_fft_functions( buffer=post_, 
-                                                fac_scale=JSON['disp_scale_factor'], 
-                                                black_lvl=JSON['black_lvl_for_dis'], 
-                                                is_scale_data_for_disp=JSON['is_scale_data_for_display'] )
+        return self._run_reconstruction_from_params( buffer, load_recon_params(json_config_file_path), mem_budget_bytes )
+    
+    # -----------------------------------------------------------------------------------------------------
+    def _run_reconstruction_from_params(self, buffer: np.ndarray, params: ReconParams, 
+                                        mem_budget_bytes: int=DEFAULT_MEM_BUDGET_BYTES) -> np.ndarray : 
+        """same functionality as _run_reconstruction_from_json(), 
+        only that the (once) loaded reconstruction-parameters are passed in directly -> no file-system or JSON work
+        >>> (large) buffers are reconstructed in chunks of B-scans, whose intermediates stay within the memory budget
+        Args:
+            buffer (np.ndarray): raw OCT data (or a lazily loaded < IO.OctVolume >)
+            params (ReconParams): reconstruction params, i.e. from < load_recon_params() >
+            mem_budget_bytes (int, optional): upper limit for the intermediate buffers. Defaults to DEFAULT_MEM_BUDGET_BYTES.
+        Returns:
+            np.ndarray: reconstructed OCT data
+        """
+        plan = self.get_reconstruction_plan_from_params( buffer.shape[0], params, is_crop=False )
+        return plan.run_chunked( buffer, mem_budget_bytes=mem_budget_bytes )
         
     # -----------------------------------------------------------------------------------------------------
     def _run_reconstruction_no_log_scale_from_json(self, buffer: np.ndarray, json_config_file_path: str) -> np.ndarray :
@@ -136,15 +164,61 @@ class OctReconstructionManager(IO.OctDataFileManager) :
         Returns:
             np.ndarray: reconstructed (non log10_scaled) OCT data
         """
-        JSON = ConfigDataManager(filename=json_config_file_path).load_json_file()
+        params = load_recon_params(json_config_file_path)
         pre_ = self.perform_pre_fft_functions(buffer=buffer, 
-                                              coeffs=JSON['dispersion_coefficients'], 
-                                              key=JSON['windowing_key'], 
-                                              is_sub_bg=JSON['is_substract_background'])
+                                              coeffs=params.dispersion_coefficients, 
+                                              key=params.windowing_key, 
+                                              is_sub_bg=params.is_substract_background)
         post_ = self.perform_fft( pre_ )
         return self.return_abs_val_in_log_scale( post_ ) # already cropped compl.-conj.
         
 
+    # -----------------------------------------------------------------------------------------------------
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def get_reconstruction_plan(a_len: int, disp_coeffs: tuple, wind_key: str='hann', sigma: int=None, l_pad: int=None, 
+                                samples_dc_crop: int=0, samples_hf_crop: int=0, scale_fac: float=65, blck_lvl: float=77, 
+                                is_bg_sub: bool=False, is_scale_data_for_disp: bool=True, fft_mode: str='full', 
+                                fft_workers: int=None) -> ReconstructionPlan :
+        """returns a (cached) reconstruction plan with precomputed dispersion x window vector, FFT length and output slice
+        >>> plans are kept in an LRU-cache, keyed by the passed-in parameter tuple (hence all params must be hashable)
+        Args:
+            a_len (int): length of raw A-scan
+            disp_coeffs (tuple): coefficients of polynominal for dispersion correction
+            wind_key (str, optional): key for windowing function for spectral shaping. Defaults to 'hann'.
+            sigma (int, optional): sigma-param for Gaussian/Kaiser windowing function. Defaults to None.
+            l_pad (int, optional): number of zeros to be added along A-scan (1 := autotuned FFT length). Defaults to None (-> A-scan length).
+            samples_dc_crop (int, optional): DC samples to be cropped. Defaults to 0.
+            samples_hf_crop (int, optional): HF samples to be cropped. Defaults to 0.
+            scale_fac (float, optional): scale factor for display in log10 - uint8 value range. Defaults to 65.
+            blck_lvl (float, optional): constant to be subtracted from recon signal. Defaults to 77.
+            is_bg_sub (bool, optional): flag to enable background subtraction. Defaults to False.
+            is_scale_data_for_disp (bool, optional): flag to enable scaling of data to uint8 display range. Defaults to True.
+            fft_mode (str, optional): 'full', 'one_sided' (only computes the kept Fourier-plane), 'czt' (only computes the 
+            depth-bins within the DC/HF-crops) or 'auto' (cheapest of 'one_sided' and 'czt'). Defaults to 'full'.
+            fft_workers (int, optional): threads per transform of this plan. Defaults to None (-> global FFT backend setting).
+        Returns:
+            ReconstructionPlan: plan, whose < run(buffer) >-method reconstructs raw buffers of A-scan length a_len
+        """
+        disp_vec = OctReconstructionManager.create_comp_disp_vec( a_len, disp_coeffs, key=wind_key, sigma=sigma )
+        return ReconstructionPlan( disp_vec, OctReconstructionManager.get_fft_length(a_len, l_pad), 
+                                   samples_dc_crop=samples_dc_crop, samples_hf_crop=samples_hf_crop, 
+                                   scale_fac=scale_fac, blck_lvl=blck_lvl, is_bg_sub=is_bg_sub, 
+                                   is_scale_data_for_disp=is_scale_data_for_disp, fft_mode=fft_mode, fft_workers=fft_workers )
+    
+    def get_reconstruction_plan_from_params(self, a_len: int, params: ReconParams, is_crop: bool=True, fft_mode: str='full') -> ReconstructionPlan :
+        """ returns the (cached) reconstruction plan for the loaded params of a JSON-config-file 
+        (with, or without the DC/HF-cropping of the config-file applied) """
+        return self.get_reconstruction_plan( a_len, params.dispersion_coefficients, params.windowing_key, 
+                                             l_pad=params.zeros_to_pad, 
+                                             samples_dc_crop=params.dc_crop_samples if is_crop else 0, 
+                                             samples_hf_crop=params.hf_crop_samples if is_crop else 0, 
+                                             scale_fac=params.disp_scale_factor, 
+                                             blck_lvl=params.black_lvl_for_dis, 
+                                             is_bg_sub=params.is_substract_background, 
+                                             is_scale_data_for_disp=params.is_scale_data_for_display, 
+                                             fft_mode=fft_mode )
+
     ##########################################
     # ***** low-level processing methods *****
     ##########################################-------------------------------------------------------------
@@ -155,6 +229,17 @@ class OctReconstructionManager(IO.OctDataFileManager) :
         while 2**j <= n:
             j += 1
         return 2**j - n
+    
+    @staticmethod
+    def get_fft_length(a_len: int, l_pad: int=None) -> int :
+        """ returns the FFT length for an A-scan of length a_len, with l_pad zeros added (None := a_len, i.e. twice the A-scan length,
+        1 := fastest of native length, next 2/3/5-smooth length and next power of 2 on this machine, see < octfftlengthtuner.py >) """
+        if l_pad == None :
+            l_pad = a_len
+        elif l_pad == 1:
+            l_pad = get_tuned_fft_length(a_len) - a_len
+        assert l_pad >= 0, "Padding values must be positve integer values"
+        return a_len + l_pad
     @staticmethod
     def create_3rd_order_polynominal(a_len: int, coeffs: tuple) -> np.ndarray :
         """creates real-valued polynominal to correct for dispersion mismatches
@@ -238,8 +323,8 @@ class OctReconstructionManager(IO.OctDataFileManager) :
         return np.asarray( np.mean(buffer, axis=tuple(range(1, buffer.ndim))) )
     
     def calculate_nDim_independant_ascan_median(self, buffer: np.ndarray) -> np.ndarray :
-        """ calculates and returns median A-scan for i.e. background subtraction """
-        return np.asarray( np.median(buffer, axis=tuple(range(1, buffer.ndim)), dtype=self.dtype_raw) )
+        """ calculates and returns median A-scan (float32) for i.e. (outlier-robust) background subtraction """
+        return calculate_median_aScan(buffer)
        
                 
     def apply_windowing(self, buffer: np.ndarray, key: str) -> np.ndarray :
@@ -249,7 +334,7 @@ class OctReconstructionManager(IO.OctDataFileManager) :
     
     def apply_dispersion_correction(self, buffer: np.ndarray, coeffs: tuple=(0,0,0,0), key: str='hann') -> np.ndarray : 
         """ apply windowing function to the entire OCT data buffer """
-        disp = self.create_comp_disp_vec( buffer.shape[0], coeffs=coeffs )
+        disp = self.create_comp_disp_vec( buffer.shape[0], coeffs=coeffs, key=key )
         return np.asarray( np.multiply( *self.adjust_dim_for_processing(buffer, disp) ), dtype=np.complex64 )
     
     #### FFT methods ####
@@ -302,10 +387,13 @@ class OctReconstructionManager(IO.OctDataFileManager) :
         return np.asarray( np.abs(buffer ), dtype=np.float )
     
     def return_scaled(self, buffer: np.ndarray, black_lvl: int=77, disp_scale: int=66) -> np.ndarray :
-        """ returns scaled version of OCT data buffer """
-        buffer = np.asarray( 255 * ( (buffer - black_lvl) / disp_scale ), dtype=self.dtype_recon )
-        buffer[buffer < 0] = 0
-        return np.asarray(buffer , dtype=self.dtype_recon )
+        """ returns scaled version of OCT data buffer (in dB), i.e. 255 * (buffer - black_lvl) / disp_scale in display range 
+        >>> only one temporary in the precision of the buffer (float32 dB-buffers stay in single precision), since it is 
+        the only step, that is re-run on changes of the display parameters (see < FrontEnd/bscanreconstructionworker.py >) """
+        scaled = np.multiply( buffer, 255 / disp_scale, dtype=np.result_type(buffer.dtype, np.float32) )
+        np.subtract( scaled, 255 * black_lvl / disp_scale, out=scaled )
+        np.clip( scaled, 0, 255, out=scaled ) # clip before cast (no wrap-around)
+        return np.asarray( scaled, dtype=self.dtype_recon )
     
     def perform_aScan_cropping(self, buffer: np.ndarray, lf_smpls_crop: int, hf_smpls_crop: int) -> np.ndarray :
         """ returns (reconstructed) buffer which has low- and high-frequency components/samples cropped """
@@ -346,6 +434,8 @@ class OctReconstructionManager(IO.OctDataFileManager) :
         
     def calculate_enface_for_display(self, buffer: np.ndarray, map_key='max') -> np.ndarray:
         """ ... TBD """
+        if isinstance(buffer, IO.OctVolume) and buffer.ndim == 3 : # lazy volumes are reduced B-scan-wise
+            return self._calculate_enface_for_display_bScan_wise(buffer, map_key=map_key)
         buffer = np.subtract( *self.adjust_dim_for_processing(buffer, np.mean(buffer, axis=(1,buffer.ndim-1))) )
         if map_key == 'max' :
             enface_map = np.amax(buffer, axis=(0))
@@ -354,35 +444,173 @@ class OctReconstructionManager(IO.OctDataFileManager) :
         elif map_key == 'median' :
             enface_map = np.median(buffer, axis=(0))
         return np.asarray( enface_map, dtype=np.uint16 )
+    
+    def _calculate_enface_for_display_bScan_wise(self, volume: IO.OctVolume, map_key='max') -> np.ndarray:
+        """ same as calculate_enface_for_display(), only that the (lazy) volume is paged in one B-scan at a time """
+        reduce_fcts = {'max': np.amax, 'mean': np.mean, 'median': np.median}
+        # 1st pass: mean A-scan of the entire volume
+        mean_aScan = np.zeros(volume.shape[0], dtype=np.float64)
+        for bScan in volume.iter_bScans(axis=-1) :
+            mean_aScan += np.mean(bScan, axis=1)
+        mean_aScan /= volume.shape[-1]
+        # 2nd pass: reduce mean-subtracted B-scans along A-scan axis
+        enface_map = np.zeros(volume.shape[1:], dtype=np.float64)
+        for c, bScan in enumerate(volume.iter_bScans(axis=-1)) :
+            enface_map[:, c] = reduce_fcts[map_key](bScan - mean_aScan[:, np.newaxis], axis=0)
+        return np.asarray( enface_map, dtype=np.uint16 )
 
 
     def process_large_volumes(self, raw_dims: tuple, json_file_name: str,  full_file_path_raw: str, 
-                              bScan_start_idx: int=0, full_file_path_recon: str=None, is_save_volume_2disk: bool=False) -> np.ndarray:
-        # Pre-allocations and sanity checks for function params
-        assert len(raw_dims) == 3, "Expecting a large (3D) volume when invoking this function"
-        JSON = ConfigDataManager(filename=json_file_name).load_json_file() # file rwith reconstruction hyperparameters
-        aLen_raw, bLen, cLen = raw_dims # input dimensions
-        aLen_recon = aLen_raw - JSON["dc_crop_samples"] - JSON["hf_crop_samples"] # output A-Scan length
-        raw_full_file_size_bytes = os.path.getsize(full_file_path_raw) # file size for sanity checks
+                              bScan_start_idx: int=0, full_file_path_recon: str=None, is_save_volume_2disk: bool=False, 
+                              fft_mode: str='auto', n_workers: int=1, n_prefetch: int=4, is_resume: bool=True, 
+                              background=None, background_key: str='mean', is_record_stages: bool=False) -> np.ndarray:
+        """reconstructs a large raw volume from disk B-scan-wise (along the slow-scanning axis) and saves it to disk
+        Args:
+            raw_dims (tuple): raw volume dimensions (aLen, bLen, cLen)
+            json_file_name (str): JSON-config-file with the reconstruction params (or already loaded ReconParams)
+            full_file_path_raw (str): path to raw volume file
+            bScan_start_idx (int, optional): index of B-scan to start with (volume is rolled along slow axis). Defaults to 0.
+            full_file_path_recon (str, optional): path to reconstructed volume file. Defaults to None (-> generated from raw path).
+            is_save_volume_2disk (bool, optional): flag to generate the default output path. Defaults to False.
+            fft_mode (str, optional): FFT-mode of the reconstruction plan. Defaults to 'auto'.
+            n_workers (int, optional): number of worker processes (> 1 := chunks of B-scans are reconstructed in parallel, 
+            each worker writes into its own region of the preallocated output file). Defaults to 1.
+            n_prefetch (int, optional): number of B-scans a background thread reads ahead (serial mode). Defaults to 4.
+            is_resume (bool, optional): flag to resume an interrupted job, i.e. only B-scans, that are not marked as done 
+            in the sidecar progress file of the (preallocated) output file, are reconstructed. Defaults to True.
+            background (optional): background A-scan or path to a background calibration file (< octbackgroundmanager.py >), 
+            which is subtracted from all B-scans (if background subtraction is enabled in the params). 
+            Defaults to None (-> mean A-scan of each B-scan).
+            background_key (str, optional): background of the calibration file ('mean' or 'median'), if a path is passed in
+            as background. Defaults to 'mean'.
+            is_record_stages (bool, optional): flag to record wall time, bytes and calls of all stages (I/O, pre-FFT, FFT, 
+            post-FFT, median filter, ...), which are printed at the end - also printed, if a recorder has been enabled 
+            globally (< octstagerecorder.enable_stage_recording() >), i.e. to export them afterwards. Defaults to False.
+        """
+        recorder = get_stage_recorder()
+        is_own_recorder = is_record_stages and recorder is None
+        if is_own_recorder :
+            recorder = enable_stage_recording()
+        try :
+            # Pre-allocations and sanity checks for function params
+            assert len(raw_dims) == 3, "Expecting a large (3D) volume when invoking this function"
+            params = load_recon_params(json_file_name) # file (or ReconParams) with reconstruction hyperparameters
+            aLen_raw, bLen, cLen = raw_dims # input dimensions
+            plan = self.get_reconstruction_plan_from_params(aLen_raw, params, fft_mode=fft_mode) # dispersion/window vectors are computed once per volume
+            if isinstance(background, str) : # volume-wide background from calibration file
+                background = load_background(background, key=background_key)
+            if background is not None and not params.is_substract_background :
+                print("[WARNING:] Background subtraction is disabled in the reconstruction params - ignoring passed-in background")
+            aLen_recon = plan.l_out # output A-Scan length
+            raw_full_file_size_bytes = os.path.getsize(full_file_path_raw) # file size for sanity checks
+            raw_bScan_file_size = aLen_raw * bLen # B-scan size in voxels
+            assert raw_full_file_size_bytes % (raw_bScan_file_size * 2 * cLen) == 0, f"Dims ({aLen_raw}, {bLen}, {cLen}): Either the dimensions or the data type are mismatched"
+            if (full_file_path_recon is None) and (is_save_volume_2disk): # create default file for saving reconstructed volume in case none was created
+                 file_name_saving = os.path.basename(full_file_path_raw).split('_')[0] + "_" + str(aLen_recon) + "x" + str(bLen) + "x" + str(cLen) + '_recon.bin'
+                 full_file_path_recon = os.path.join(os.path.dirname(full_file_path_raw), file_name_saving) # final file path for saving
+            # output file is preallocated -> every B-scan is written to its own region (offset = c * size of recon. B-scan)
+            recon_bScan_size_bytes = aLen_recon * bLen * np.dtype(self.dtype_recon).itemsize
+            fingerprint = self.get_volume_job_fingerprint(params, plan, full_file_path_raw, bScan_start_idx, 
+                                                          background if params.is_substract_background else None)
+            with ResumableVolumeWriter(full_file_path_recon, cLen, recon_bScan_size_bytes, is_resume=is_resume, 
+                                       fingerprint=fingerprint) as volume_writer:
+                pending_idxs = volume_writer.pending_indices() # indices of B-scans in output file, that still have to be processed
+                if len(pending_idxs) == 0 :
+                    print(f"[INFO:] All B-scans of {full_file_path_recon} have already been reconstructed")
+                    return
+                if n_workers > 1 : # PARALLEL PROCESSING: B-scan chunks are distributed across a process pool
+                    n_chunks = min(len(pending_idxs), 4 * n_workers) # more chunks than workers for load balancing
+                    jobs = [(raw_dims, params, fft_mode, self.dtype_loading, full_file_path_raw, full_file_path_recon, 
+                             bScan_start_idx, background, recorder is not None, [int(c) for c in chunk]) 
+                            for chunk in np.array_split(pending_idxs, n_chunks)]
+                    # cores are shared between the worker processes -> fewer FFT threads per process (no oversubscription),
+                    # the autotuned FFT length is passed on, since it may differ for fewer threads (-> size of output B-scans)
+                    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker_process, 
+                                             initargs=(max(1, (os.cpu_count() or 1) // n_workers), aLen_raw, 
+                                                       plan.l_fft if params.zeros_to_pad == 1 else None)) as executor :
+                        futures = {executor.submit(_process_bScan_chunk, job): job[-1] for job in jobs}
+                        for future in tqdm(as_completed(futures), total=len(futures)):
+                            summary = future.result() # re-raises errors of the worker
+                            if recorder is not None :
+                                recorder.merge(summary) # stages of the worker process
+                            volume_writer.mark_done(futures[future]) # chunk has been written (and its file closed) by the worker
+                    return
+                # MAIN PROCESSING LOOP
+                # loop though volume and reconstruct (optional: and safe) BUFFER-WISE
+                # -> B-scans are prefetched and results are written by background threads, so that I/O overlaps with compute
+                bScan_indices = [(c + bScan_start_idx) % cLen for c in pending_idxs] # "slow-scanning axis"
+                with PrefetchingBScanReader(full_file_path_raw, raw_dims, bScan_indices, dtype=self.dtype_raw, n_prefetch=n_prefetch) as reader, \
+                     BackgroundBScanWriter(volume_writer) as writer:
+                    for c, raw_buffer in zip(pending_idxs, tqdm(reader)):
+                        writer.write( self._reconstruct_raw_bScan(raw_buffer, plan, background), c ) # save cropped buffer at its own offset
+        finally :
+            if recorder is not None :
+                recorder.print_summary()
+            if is_own_recorder :
+                disable_stage_recording()
+
+    def get_volume_job_fingerprint(self, params: ReconParams, plan: ReconstructionPlan, full_file_path_raw: str, 
+                                   bScan_start_idx: int, background: np.ndarray=None) -> dict :
+        """ returns the (JSON-serializable) fingerprint of everything the output of < process_large_volumes() > depends on,
+        i.e. an interrupted job is only resumed with the same params, plan, raw file, start index, background and data types """
+        raw_stat = os.stat(full_file_path_raw)
+        return {'params': hashlib.sha1(repr(params).encode()).hexdigest(),
+                'plan': [plan.l_fft, plan.fft_mode],
+                'raw_file': [os.path.abspath(full_file_path_raw), raw_stat.st_size, raw_stat.st_mtime_ns],
+                'bScan_start_idx': int(bScan_start_idx),
+                'background': None if background is None else hashlib.sha1(np.ascontiguousarray(background)).hexdigest(),
+                'dtypes': [np.dtype(self.dtype_loading).str, np.dtype(self.dtype_raw).str, np.dtype(self.dtype_recon).str]}
+
+    def _reconstruct_bScan_from_file(self, f_raw, plan: ReconstructionPlan, raw_dims: tuple, c_idx: int, 
+                                     background: np.ndarray=None) -> np.ndarray :
+        """ loads the B-scan with index c_idx (along slow axis) from an opened raw file and returns it reconstructed, 
+        cropped, median-filtered and casted to self.dtype_recon """
+        aLen_raw, bLen, _ = raw_dims
         raw_bScan_file_size = aLen_raw * bLen # B-scan size in voxels
-        assert raw_full_file_size_bytes % (raw_bScan_file_size * 2 * cLen) == 0, f"Dims ({aLen_raw}, {bLen}, {cLen}): Either the dimensions or the data type are mismatched"
-        if (full_file_path_recon is None) and (is_save_volume_2disk): # create default file for saving reconstructed volume in case none was created
-             file_name_saving = os.path.basename(full_file_path_raw).split('_')[0] + "_" + str(aLen_recon) + "x" + str(bLen) + "x" + str(cLen) + '_recon.bin'
-             full_file_path_recon = os.path.join(os.path.dirname(full_file_path_raw), file_name_saving) # final file path for saving
-        # MAIN PROCESSING LOOP
-        # loop though volume and reconstruct (optional: and safe) BUFFER-WISE
-        for c in tqdm(range(cLen)): # loop through "slow-scanning axis"
-            with open(full_file_path_raw, 'rb') as f_raw: # open binary in read mode
-                offset = ((c + bScan_start_idx) % cLen) * raw_bScan_file_size * np.dtype(self.dtype_loading).itemsize # pointer-offset in bytes
-                raw_buffer = np.fromfile(f_raw, dtype=self.dtype_raw, count=raw_bScan_file_size, offset=offset) # load buffer of expected B-Scan size and with offset
-                raw_buffer = np.reshape(raw_buffer, (bLen, aLen_raw)) # reshape to size len(A-Scan) * len(B-Scan)
-                raw_buffer = raw_buffer.swapaxes(0,1) # swap axis (A is 0th axis, by convention)
-                recon_buffer = self._run_reconstruction_from_json(buffer=raw_buffer,
-                                                                  json_config_file_path=json_file_name) # reconstruct current buffer
-                recon_buffer = recon_buffer[JSON["dc_crop_samples"]:recon_buffer.shape[0]-JSON["hf_crop_samples"], :]
-                recon_buffer = signal.medfilt2d(recon_buffer, kernel_size=(3,3))
-                with open(full_file_path_recon, 'a+b') as f: # Save to file in binary append mode
-                    recon_buffer.astype(self.dtype_recon).tofile(f) # save cropped buffer in cropped version
+        f_raw.seek(c_idx * raw_bScan_file_size * np.dtype(self.dtype_loading).itemsize) # pointer-offset in bytes
+        with record_stage('io_read', raw_bScan_file_size * np.dtype(self.dtype_raw).itemsize) :
+            raw_buffer = np.fromfile(f_raw, dtype=self.dtype_raw, count=raw_bScan_file_size) # load buffer of expected B-Scan size
+        raw_buffer = np.reshape(raw_buffer, (bLen, aLen_raw)) # reshape to size len(A-Scan) * len(B-Scan)
+        return self._reconstruct_raw_bScan(raw_buffer, plan, background)
+    
+    def _reconstruct_raw_bScan(self, raw_buffer: np.ndarray, plan: ReconstructionPlan, background: np.ndarray=None) -> np.ndarray :
+        """ returns a B-scan (in file layout, i.e. shape=(bLen, aLen)) reconstructed, cropped, median-filtered 
+        and casted to self.dtype_recon (with the volume-wide background, if passed in) """
+        raw_buffer = raw_buffer.swapaxes(0,1) # swap axis (A is 0th axis, by convention)
+        recon_buffer = plan.run(raw_buffer, background=background) # reconstruct (and crop) current buffer
+        with record_stage('median_filter', recon_buffer.nbytes) :
+            recon_buffer = signal.medfilt2d(recon_buffer, kernel_size=(3,3))
+        with record_stage('cast', recon_buffer.nbytes) :
+            return recon_buffer.astype(self.dtype_recon)
+
+
+def _init_worker_process(fft_workers: int, a_len: int, l_fft_tuned: int=None) -> None :
+    """ initializer of the worker processes of the parallel < process_large_volumes() >: sets the FFT threads per process
+    and pins the autotuned FFT length of the parent process (if the params use it), so that all B-scans match the output file """
+    set_fft_workers(fft_workers)
+    if l_fft_tuned is not None :
+        set_tuned_fft_length(a_len, l_fft_tuned)
+
+def _process_bScan_chunk(job: tuple) -> dict :
+    """worker function (top-level for pickling) of the parallel < process_large_volumes() >: reconstructs the passed-in 
+    B-scans and writes them to their own region (offset = c * size of reconstructed B-scan) in the preallocated output file
+    Returns:
+        dict: summary of the recorded stages of the worker (empty, if stages are not recorded)
+    """
+    (raw_dims, params, fft_mode, dtype_loading, full_file_path_raw, full_file_path_recon, bScan_start_idx, background, 
+     is_record_stages, c_idxs) = job
+    if is_record_stages :
+        enable_stage_recording()
+    REC = OctReconstructionManager(dtype_loading=dtype_loading)
+    plan = REC.get_reconstruction_plan_from_params(raw_dims[0], params, fft_mode=fft_mode) # cached per worker process
+    recon_bScan_size_bytes = plan.l_out * raw_dims[1] * np.dtype(REC.dtype_recon).itemsize
+    with open(full_file_path_raw, 'rb') as f_raw, open(full_file_path_recon, 'r+b') as f_recon :
+        for c in c_idxs :
+            recon_buffer = REC._reconstruct_bScan_from_file(f_raw, plan, raw_dims, (c + bScan_start_idx) % raw_dims[2], background)
+            with record_stage('io_write', recon_buffer.nbytes) :
+                f_recon.seek(c * recon_bScan_size_bytes)
+                recon_buffer.tofile(f_recon)
+    return disable_stage_recording().get_summary() if is_record_stages else {}
 
     
 
@@ -0,0 +1,360 @@
+"""
+                                        ******
+        Author: @Philipp Matten - philipp.matten@meduniwien.ac.at / philipp.matten@gmx.de
+
+                                    Copyright 2023
+                                        ******
+
+        >>> Contains a precompiled reconstruction plan, that holds all parameter-dependent
+            vectors and lengths of an OCT reconstruction, so they only get computed once per job
+
+"""
+
+# global imports
+import numpy as np
+
+# custom imports
+from octfftbackend import get_fft_backend
+from octstagerecorder import record_stage, recorded_stage
+
+
+# 'full' := complex FFT of the entire (padded) A-scan, as in < OctReconstructionManager.perform_fft() >
+# 'one_sided' := only the kept Fourier-plane is computed/stored (real-input FFT, if the shaping vector allows it)
+# 'czt' := chirp-z (zoom) transform, that only computes the depth-bins of the output slice (depth ROI)
+# 'auto' := chooses between 'one_sided' and 'czt', depending on the (estimated) computational costs
+FFT_MODES = ('full', 'one_sided', 'czt', 'auto')
+
+# default upper limit for the intermediate buffers of a chunked reconstruction, i.e. < ReconstructionPlan.run_chunked() >
+DEFAULT_MEM_BUDGET_BYTES = 1024**3
+
+
+class ReconstructionPlan() :
+    """
+    >>> Holds the precomputed (complex64) dispersion x window vector, the FFT length and
+    the output slice for one set of reconstruction parameters and applies them to raw buffers
+    NOTE: plans should be created via < OctReconstructionManager.get_reconstruction_plan() >,
+    which caches them (LRU) by their parameter tuple
+    """
+    def __init__(self, disp_vec: np.ndarray, l_fft: int, samples_dc_crop: int=0, samples_hf_crop: int=0,
+                 scale_fac: float=65, blck_lvl: float=77, is_bg_sub: bool=False, is_scale_data_for_disp: bool=True,
+                 dtype_recon=np.uint8, fft_mode: str='full', fft_workers: int=None) -> None :
+        assert disp_vec.ndim == 1, "Dispersion vector must be 1-dimensional (one value per spectral sample)"
+        assert l_fft >= disp_vec.shape[0], "FFT length must be larger or equal than the A-scan length"
+        if fft_mode not in FFT_MODES :
+            raise ValueError(f"Unrecognized FFT mode '{fft_mode}' (expected one of {FFT_MODES})")
+        self.a_len = disp_vec.shape[0]
+        self.disp_vec = np.asarray( disp_vec, dtype=np.complex64 )
+        self.disp_vec.setflags(write=False) # plans are shared between callers -> read-only
+        self.l_fft = int(l_fft)
+        self.l_half = self.l_fft // 2 # samples that are kept from one "Fourier-plane"
+        assert samples_dc_crop + samples_hf_crop < self.l_half, "Amount of cropping pixels must be less than A-scan sampling length"
+        self.out_slice = slice(samples_dc_crop, self.l_half - samples_hf_crop)
+        self.scale_fac = scale_fac
+        self.blck_lvl = blck_lvl
+        self.is_bg_sub = is_bg_sub
+        self.is_scale_data_for_disp = is_scale_data_for_disp
+        self.dtype_recon = dtype_recon
+        # data type of reconstructed buffers (log-scaled data is kept in single precision)
+        self.dtype_out = np.dtype(dtype_recon) if is_scale_data_for_disp else np.dtype(np.float32)
+        # real-valued vector (w/o its constant phase), if the spectrum of a shaped raw buffer is Hermitian symmetric
+        self.real_vec = self.get_real_shaping_vector(self.disp_vec)
+        if fft_mode == 'auto' :
+            fft_mode = self.choose_fft_mode()
+        self.fft_mode = fft_mode
+        self.fft_workers = fft_workers # threads per transform (None -> setting of the global FFT backend)
+        if self.fft_mode == 'czt' :
+            self._init_zoom_transform()
+        self._plan_transforms()
+    
+    def estimate_fft_costs(self) -> dict :
+        """ returns the estimated number of (real) floating point operations per A-scan for the 'one_sided' and 'czt' FFT modes """
+        l_czt = get_fft_backend().next_fast_len(self.a_len + self.l_out - 1)
+        cost_fft = 5 * self.l_fft * np.log2(self.l_fft)
+        if self.real_vec is not None :
+            cost_fft /= 2 # real-input FFT
+        # one forward and one inverse FFT of length l_czt, plus complex multiplications with chirp and filter
+        cost_czt = 2 * 5 * l_czt * np.log2(l_czt) + 6 * (self.a_len + l_czt)
+        return {'one_sided': cost_fft, 'czt': cost_czt}
+    
+    def choose_fft_mode(self) -> str :
+        """ returns the cheaper FFT-mode for the plans depth ROI, i.e. 'czt' if the ROI is narrow compared to the FFT length """
+        costs = self.estimate_fft_costs()
+        return min(costs, key=costs.get)
+    
+    def _init_zoom_transform(self) -> None :
+        """precomputes chirp vector and chirp filter of a Bluestein chirp-z transform, which evaluates the l_fft-point DFT 
+        of the (unpadded) A-scans only at the depth-bins of the output slice, i.e. X[k0 + m] for m < l_out, via
+        X[k0 + m] = W^(m^2/2) * sum_n ( x[n] * W^(n*k0 + n^2/2) ) * W^(-(m-n)^2/2), with W = exp(-2*pi*i/l_fft)
+        >>> the chirp is folded into the dispersion x window vector and the post-chirp W^(m^2/2) is omitted, 
+        since it does not change the magnitudes of the reconstructed signal
+        """
+        k0 = self.out_slice.start
+        self.l_czt = get_fft_backend().next_fast_len(self.a_len + self.l_out - 1)
+        def chirp(j: np.ndarray, sign: int) -> np.ndarray : 
+            # W^(sign * j^2/2), with j^2 reduced modulo 2*l_fft to keep the phase arguments small (precision)
+            return np.exp( sign * -1j * np.pi * ((j * j) % (2 * self.l_fft)) / self.l_fft )
+        n = np.arange(self.a_len, dtype=np.int64)
+        czt_vec = self.disp_vec * chirp(n, 1) * np.exp( -2j * np.pi * ((n * k0) % self.l_fft) / self.l_fft )
+        self.czt_vec = np.asarray( czt_vec, dtype=np.complex64 )
+        czt_filter = np.zeros(self.l_czt, dtype=np.complex128)
+        czt_filter[:self.l_out] = chirp(np.arange(self.l_out, dtype=np.int64), -1)
+        czt_filter[self.l_czt - self.a_len + 1:] = chirp(np.arange(self.a_len - 1, 0, -1, dtype=np.int64), -1)
+        self.czt_filter = np.asarray( get_fft_backend().fft(czt_filter), dtype=np.complex64 )
+        
+    def _plan_transforms(self) -> None :
+        """ prepares the transform lengths of the plan in the (global) FFT backend, so that they are only planned once """
+        backend = get_fft_backend()
+        if self.fft_mode == 'czt' :
+            backend.plan(self.l_czt, 'fft')
+            backend.plan(self.l_czt, 'ifft')
+        elif self.fft_mode == 'one_sided' and self.real_vec is not None :
+            backend.plan(self.l_fft, 'rfft', dtype=np.float32)
+        else :
+            backend.plan(self.l_fft, 'fft')
+
+    @staticmethod
+    def get_real_shaping_vector(disp_vec: np.ndarray) -> np.ndarray :
+        """returns the real-valued shaping vector g, if disp_vec = exp(i*phi) * g for a constant phase phi, otherwise None
+        >>> since the FFT-magnitudes are invariant to a constant phase, raw (real) buffers shaped with g have 
+        a Hermitian symmetric spectrum -> only one Fourier-plane has to be computed (rfft)
+        Args:
+            disp_vec (np.ndarray): complex-valued dispersion x window vector
+        Returns:
+            np.ndarray: real-valued (float32) shaping vector or None (if the vector has a non-constant phase)
+        """
+        idx_max = np.argmax(np.abs(disp_vec))
+        if disp_vec[idx_max] == 0 :
+            return np.zeros(disp_vec.shape, dtype=np.float32)
+        phase = disp_vec[idx_max] / np.abs(disp_vec[idx_max])
+        rotated = disp_vec * np.conj(phase)
+        if not np.allclose(rotated.imag, 0, atol=1e-6 * np.abs(disp_vec[idx_max])) :
+            return None
+        return np.asarray( rotated.real, dtype=np.float32 )
+
+    @property
+    def l_out(self) -> int :
+        """ returns the length of a reconstructed (cropped) A-scan """
+        return self.out_slice.stop - self.out_slice.start
+
+    def estimate_stage_bytes_per_aScan(self, dtype_raw=np.uint16) -> dict :
+        """returns the (estimated) bytes, that each stage of < run() > allocates per A-scan 
+        >>> the stages are summed up in < get_chunk_size() >, which gives an upper bound of the memory that is allocated at once
+        Args:
+            dtype_raw (optional): data type of the raw buffer (i.e. for chunks loaded from a memory-mapped volume). Defaults to np.uint16.
+        Returns:
+            dict: bytes per A-scan for each stage of the reconstruction
+        """
+        c64, f32 = np.dtype(np.complex64).itemsize, np.dtype(np.float32).itemsize
+        stages = {'raw': self.a_len * np.dtype(dtype_raw).itemsize}
+        # fused pre-FFT stage writes into one (zero-padded) FFT input buffer
+        vec, l_in = self._get_fft_input_vector()
+        stages['pre_fft'] = l_in * np.dtype(vec.dtype).itemsize
+        if self.fft_mode == 'czt' : # forward and inverse FFT of length l_czt
+            stages['fft'] = 2 * self.l_czt * c64
+        elif self.fft_mode == 'one_sided' and self.real_vec is not None :
+            stages['fft'] = (self.l_half + 1) * c64
+        else : # np.fft (fallback backend) can not transform in-place and might compute in double precision
+            stages['fft'] = self.l_fft * c64 * (2 if get_fft_backend().name == 'numpy' else 1)
+        # fused post-FFT stage works in-place on the FFT buffer -> only the output (and a float32 power buffer) is allocated
+        stages['post_fft'] = self.l_out * (self.dtype_out.itemsize + (f32 if self.dtype_out != np.float32 else 0))
+        return stages
+
+    def get_chunk_size(self, shape: tuple, mem_budget_bytes: int=DEFAULT_MEM_BUDGET_BYTES, dtype_raw=np.uint16) -> int :
+        """returns the number of slices along the last axis of a buffer of the passed-in shape (i.e. B-scans of a volume or 
+        A-scans of a B-scan), that can be reconstructed at once without the intermediates exceeding the memory budget
+        Args:
+            shape (tuple): shape of the raw buffer with A-scans along axis 0
+            mem_budget_bytes (int, optional): upper limit for the intermediate buffers. Defaults to DEFAULT_MEM_BUDGET_BYTES.
+            dtype_raw (optional): data type of the raw buffer. Defaults to np.uint16.
+        Returns:
+            int: chunk size (at least 1, at most shape[-1])
+        """
+        aScans_per_slice = int(np.prod(shape[1:-1], dtype=np.int64)) # 1 for B-scans
+        bytes_per_slice = aScans_per_slice * sum( self.estimate_stage_bytes_per_aScan(dtype_raw).values() )
+        return int( np.clip(mem_budget_bytes // bytes_per_slice, 1, shape[-1]) )
+
+    @recorded_stage('background')
+    def get_background(self, buffer: np.ndarray, chunk_size: int=None) -> np.ndarray :
+        """returns the mean A-scan (float32) of a raw buffer, accumulated over chunks along its last axis, 
+        so that i.e. memory-mapped volumes never get loaded entirely
+        Args:
+            buffer (np.ndarray): raw OCT data (A-, B-, or C-scan) with A-scans along axis 0
+            chunk_size (int, optional): number of slices along the last axis per chunk. Defaults to None (-> entire buffer).
+        Returns:
+            np.ndarray: mean A-scan of the buffer
+        """
+        if buffer.ndim == 1 :
+            return np.asarray( buffer, dtype=np.float32 )
+        chunk_size = buffer.shape[-1] if chunk_size is None else chunk_size
+        lateral_axes = tuple(range(1, buffer.ndim))
+        background = np.zeros(buffer.shape[0], dtype=np.float64)
+        for k in range(0, buffer.shape[-1], chunk_size) :
+            background += np.sum( buffer[..., k:k + chunk_size], axis=lateral_axes, dtype=np.float64 )
+        return np.asarray( background / (np.prod(buffer.shape[1:], dtype=np.int64)), dtype=np.float32 )
+
+    def _expand_dims(self, vector: np.ndarray, ndim: int) -> np.ndarray :
+        """ returns view on vector that broadcasts along the A-scan axis (axis=0) of a buffer of dimension ndim """
+        return vector.reshape( (-1,) + (1,) * (ndim - 1) )
+
+    def run(self, buffer: np.ndarray, background: np.ndarray=None, out: np.ndarray=None) -> np.ndarray :
+        """performs the entire reconstruction (pre-FFT, FFT and post-FFT steps) of the passed-in buffer
+        Args:
+            buffer (np.ndarray): raw OCT data (A-, B-, or C-scan) with A-scans along axis 0
+            background (np.ndarray, optional): mean A-scan to be subtracted (if background subtraction is enabled). 
+            Defaults to None (-> mean A-scan of the passed-in buffer).
+            out (np.ndarray, optional): buffer (of shape (l_out, ...) and any real data type, i.e. self.dtype_out), 
+            which the reconstructed data is written to. Defaults to None (-> newly allocated).
+        Returns:
+            np.ndarray: reconstructed and cropped OCT data
+        """
+        if buffer.shape[0] != self.a_len :
+            raise ValueError(f"Buffer A-scan length ({buffer.shape[0]}) does not match the length of the plan ({self.a_len})")
+        if self.is_bg_sub and background is None :
+            with record_stage('background', buffer.nbytes) :
+                background = np.asarray( np.mean(buffer, axis=tuple(range(1, buffer.ndim))), dtype=np.float32 )
+        buffer = self.run_fft( buffer, background=background if self.is_bg_sub else None )
+        return self.run_post_fft( buffer, out=out, overwrite_x=True )
+
+    def run_post_fft(self, buffer: np.ndarray, out: np.ndarray=None, overwrite_x: bool=False) -> np.ndarray :
+        """ applies the fused post-FFT stage with the plans scaling parameters (see < apply_post_fft() >) """
+        if out is None :
+            out = np.empty(buffer.shape, dtype=self.dtype_out)
+        if self.is_scale_data_for_disp :
+            return self.apply_post_fft( buffer, out, scale_fac=self.scale_fac, blck_lvl=self.blck_lvl, overwrite_x=overwrite_x )
+        return self.apply_post_fft( buffer, out, overwrite_x=overwrite_x )
+
+    @staticmethod
+    @recorded_stage('post_fft')
+    def apply_post_fft(buffer: np.ndarray, out: np.ndarray, scale_fac: float=None, blck_lvl: float=None, 
+                       overwrite_x: bool=False) -> np.ndarray :
+        """fused post-FFT stage, which writes 10*log10(re^2 + im^2) [dB] of a (cropped) FFT buffer into the caller-provided 
+        out buffer - optionally scaled to display range, i.e. 255 * (dB - blck_lvl) / scale_fac, and clipped to [0, 255]
+        >>> magnitudes are never computed (no sqrt) and the only intermediate is a float32 power buffer (if out is not float32)
+        Args:
+            buffer (np.ndarray): complex-valued (cropped) FFT buffer
+            out (np.ndarray): output buffer of the same shape (i.e. uint8 for display or float32)
+            scale_fac (float, optional): scale factor for display in log10 - uint8 value range. Defaults to None (-> no scaling).
+            blck_lvl (float, optional): constant to be subtracted from the signal [dB] before scaling. Defaults to None.
+            overwrite_x (bool, optional): flag to use the FFT buffer as scratch space (it is overwritten). Defaults to False.
+        Returns:
+            np.ndarray: out buffer
+        """
+        if out.shape != buffer.shape :
+            raise ValueError(f"Output buffer has shape {out.shape}, expected shape {buffer.shape}")
+        power = out if out.dtype == np.float32 else np.empty(buffer.shape, dtype=np.float32)
+        if overwrite_x and buffer.dtype == np.complex64 and buffer.flags.writeable and buffer.strides[-1] == buffer.itemsize :
+            # interleaved (re, im)-pairs are squared in-place and summed into the (contiguous) power buffer
+            pairs = buffer.view(np.float32)
+            np.multiply(pairs, pairs, out=pairs)
+            np.add(pairs[..., 0::2], pairs[..., 1::2], out=power)
+        else :
+            np.multiply(buffer.real, buffer.real, out=power, casting='same_kind')
+            power += np.square(buffer.imag, dtype=np.float32)
+        with np.errstate(divide='ignore') : # log10(0) := -inf (clipped to 0, if scaled)
+            np.log10(power, out=power)
+        if scale_fac is None :
+            np.multiply(power, 10, out=power)
+        else : # 255 * (10*log10(power) - blck_lvl) / scale_fac, clipped BEFORE the cast to the output data type
+            np.multiply(power, 2550 / scale_fac, out=power)
+            np.subtract(power, 255 * blck_lvl / scale_fac, out=power)
+            np.clip(power, 0, 255, out=power)
+        if power is not out :
+            np.copyto(out, power, casting='unsafe')
+        return out
+    
+    def run_chunked(self, buffer: np.ndarray, mem_budget_bytes: int=DEFAULT_MEM_BUDGET_BYTES) -> np.ndarray :
+        """same as < run() >, but reconstructs the buffer in chunks of slices along its last axis (B-scans of a volume), 
+        so that the (float32/complex64) intermediates of each FFT-call stay within the memory budget
+        >>> the background is computed over the entire buffer first -> results are identical to < run() >
+        Args:
+            buffer (np.ndarray): raw OCT data (A-, B-, or C-scan) with A-scans along axis 0, 
+            can also be a lazily loaded volume, i.e. < octdatafilemanager.OctVolume >
+            mem_budget_bytes (int, optional): upper limit for the intermediate buffers. Defaults to DEFAULT_MEM_BUDGET_BYTES.
+        Returns:
+            np.ndarray: reconstructed and cropped OCT data
+        """
+        if buffer.shape[0] != self.a_len :
+            raise ValueError(f"Buffer A-scan length ({buffer.shape[0]}) does not match the length of the plan ({self.a_len})")
+        if buffer.ndim == 1 :
+            return self.run( np.asarray(buffer) )
+        chunk_size = self.get_chunk_size(buffer.shape, mem_budget_bytes, dtype_raw=buffer.dtype)
+        background = self.get_background(buffer, chunk_size) if self.is_bg_sub else None
+        recon = np.empty((self.l_out,) + tuple(buffer.shape[1:]), dtype=self.dtype_out)
+        for k in range(0, buffer.shape[-1], chunk_size) :
+            self.run( np.asarray(buffer[..., k:k + chunk_size]), background=background, out=recon[..., k:k + chunk_size] )
+        return recon
+    
+    def _get_fft_input_vector(self) -> tuple :
+        """ returns the shaping vector and the (padded) length of the FFT input buffer for the plans FFT-mode """
+        if self.fft_mode == 'czt' : # chirp is folded into the dispersion x window vector
+            return self.czt_vec, self.l_czt
+        if self.fft_mode == 'one_sided' and self.real_vec is not None : # real-input FFT
+            return self.real_vec, self.l_fft
+        return self.disp_vec, self.l_fft
+    
+    @recorded_stage('pre_fft')
+    def get_fft_input(self, buffer: np.ndarray, background: np.ndarray=None) -> np.ndarray :
+        """fused pre-FFT stage, which writes the raw buffer - background subtracted and shaped with the dispersion x window 
+        vector - into one zero-padded FFT input buffer (complex64, or float32 for a real-input FFT)
+        >>> raw data (i.e. big- or little-endian uint16) is converted (and byte-swapped) inside the ufunc-loops, 
+        so the FFT input buffer is the only full-size copy of the buffer
+        >>> zeros are appended to the A-scans, which results in the same magnitudes as prepended zeros
+        Args:
+            buffer (np.ndarray): raw OCT data (A-, B-, or C-scan) with A-scans along axis 0
+            background (np.ndarray, optional): mean A-scan to be subtracted. Defaults to None (-> no background subtraction).
+        Returns:
+            np.ndarray: FFT input buffer of shape (l_fft, ...) (or (l_czt, ...) for the 'czt'-mode)
+        """
+        vec, l_in = self._get_fft_input_vector()
+        fft_in = np.empty((l_in,) + tuple(buffer.shape[1:]), dtype=vec.dtype)
+        fft_in[self.a_len:] = 0
+        shaped = fft_in[:self.a_len]
+        if background is None :
+            np.multiply(buffer, self._expand_dims(vec, buffer.ndim), out=shaped)
+        else :
+            np.subtract(buffer, self._expand_dims(np.asarray(background, dtype=np.float32), buffer.ndim), out=shaped)
+            np.multiply(shaped, self._expand_dims(vec, buffer.ndim), out=shaped)
+        return fft_in
+
+    def run_fft(self, buffer: np.ndarray, background: np.ndarray=None) -> np.ndarray :
+        """applies the fused pre-FFT stage and the FFT (acc. to the plans FFT-mode) to a raw buffer
+        Args:
+            buffer (np.ndarray): raw OCT data (A-, B-, or C-scan) with A-scans along axis 0
+            background (np.ndarray, optional): mean A-scan to be subtracted. Defaults to None (-> no background subtraction).
+        Returns:
+            np.ndarray: complex-valued FFT buffer, already cropped to the output slice of the plan
+        """
+        buffer = self.get_fft_input( buffer, background )
+        with record_stage('fft', buffer.nbytes) :
+            return self._transform(buffer)
+
+    def _transform(self, buffer: np.ndarray) -> np.ndarray :
+        """ transforms the FFT input buffer (in-place, if the backend supports it) and crops it to the output slice """
+        backend = get_fft_backend()
+        if self.fft_mode == 'czt' : # convolution with the chirp filter via FFTs of length l_czt
+            buffer = backend.fft(buffer, axis=0, overwrite_x=True, workers=self.fft_workers)
+            buffer *= self._expand_dims(self.czt_filter, buffer.ndim)
+            return backend.ifft(buffer, axis=0, overwrite_x=True, workers=self.fft_workers)[:self.l_out]
+        if self.fft_mode == 'one_sided' and self.real_vec is not None : # Hermitian symmetric spectrum -> real-input FFT of half the size
+            return backend.rfft(buffer, axis=0, overwrite_x=True, workers=self.fft_workers)[self.out_slice]
+        return backend.fft(buffer, axis=0, overwrite_x=True, workers=self.fft_workers)[self.out_slice]
+
+
+# for testing and debugging purposes
+if __name__ == '__main__' :
+    print("[INFO:] Running from < octreconstructionplan.py > ...")
+    import time
+    from octreconstructionmanager import OctReconstructionManager
+    REC = OctReconstructionManager()
+    raw = np.asarray( np.random.default_rng(0).integers(0, 2**12, size=(13312, 512)), dtype=np.uint16 )
+    for coeffs in [(0,0,0,0), (-5,125,0,0)] :
+        pre_ = REC.perform_pre_fft_functions(raw, coeffs, 'hann', is_sub_bg=True)
+        t1 = time.perf_counter()
+        reference = REC.perform_post_fft_functions(REC.perform_fft(pre_), 1, 0, False)
+        t_ref = time.perf_counter() - t1
+        plan = OctReconstructionManager.get_reconstruction_plan(raw.shape[0], coeffs, 'hann', is_bg_sub=True, 
+                                                                 is_scale_data_for_disp=False, fft_mode='one_sided')
+        t1 = time.perf_counter()
+        candidate = plan.run(raw)
+        print(f"coeffs={coeffs} (real-input FFT: {plan.real_vec is not None}): max. abs. error = {np.max(np.abs(candidate - reference)):.2e} dB, "
+              f"{t_ref:.2f}s (current) vs. {time.perf_counter() - t1:.2f}s (one-sided)")
@@ -0,0 +1,153 @@
+"""
+                                        ******
+        Author: @Philipp Matten - philipp.matten@meduniwien.ac.at / philipp.matten@gmx.de
+
+                                    Copyright 2023
+                                        ******
+
+        >>> Contains the opt-in instrumentation of the reconstruction hot paths: stages report their wall time,
+            processed bytes and calls to a (global) recorder, whose summary can be printed or exported (JSON/CSV)
+
+"""
+
+# global imports
+import csv
+import json
+import time
+import functools
+import threading
+import contextlib
+import numpy as np
+
+
+class StageRecorder() :
+    """
+    >>> Accumulates wall time, processed bytes and number of calls per (named) stage of the reconstruction
+    NOTE: stages can report from multiple threads (i.e. reader/writer threads) - their times are summed up,
+    so that the stages of parallel threads (or merged worker processes) can add up to more than the wall time
+    """
+    def __init__(self) -> None :
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None :
+        """ clears all recorded stages and restarts the wall time """
+        with self._lock :
+            self._stats = {} # stage -> [calls, seconds, bytes]
+            self.t_start = time.perf_counter()
+
+    def add(self, stage: str, seconds: float, n_bytes: int=0, n_calls: int=1) -> None :
+        """ adds one (or n_calls) call(s) of a stage """
+        with self._lock :
+            stats = self._stats.setdefault(stage, [0, 0.0, 0])
+            stats[0] += n_calls
+            stats[1] += seconds
+            stats[2] += int(n_bytes)
+
+    @contextlib.contextmanager
+    def record(self, stage: str, n_bytes: int=0) :
+        """ context manager, that adds the wall time of its body to a stage """
+        t1 = time.perf_counter()
+        try :
+            yield
+        finally :
+            self.add(stage, time.perf_counter() - t1, n_bytes)
+
+    def merge(self, summary: dict) -> None :
+        """ adds the stages of another recorders summary, i.e. of a worker process """
+        for stage, stats in summary.get('stages', {}).items() :
+            self.add(stage, stats['seconds'], stats['bytes'], stats['calls'])
+
+    def get_summary(self) -> dict :
+        """ returns the wall time since the start of the recorder and calls, seconds, bytes, MB/s and
+        share of the wall time per stage """
+        wall_time = time.perf_counter() - self.t_start
+        with self._lock :
+            stages = {stage : {'calls': calls, 'seconds': seconds, 'bytes': n_bytes,
+                               'MB_per_s': n_bytes / seconds / 1e6 if seconds > 0 else 0.0,
+                               'share': seconds / wall_time if wall_time > 0 else 0.0}
+                      for stage, (calls, seconds, n_bytes) in self._stats.items()}
+        return {'wall_time': wall_time, 'stages': stages}
+
+    def print_summary(self) -> None :
+        summary = self.get_summary()
+        print(f"[INFO:] Stage timings ({summary['wall_time']:.2f}s wall time):")
+        for stage, s in sorted(summary['stages'].items(), key=lambda item : -item[1]['seconds']) :
+            print(f"{stage:>24}: {s['seconds']:9.3f}s ({100*s['share']:5.1f}%) in {s['calls']:7d} calls, {s['MB_per_s']:10.1f} MB/s")
+
+    def to_json(self, file_path: str) -> None :
+        """ saves the summary as JSON-file """
+        with open(file_path, 'w') as f :
+            json.dump(self.get_summary(), f, indent=4)
+
+    def to_csv(self, file_path: str) -> None :
+        """ saves the summary as CSV-file (one row per stage) """
+        summary = self.get_summary()
+        with open(file_path, 'w', newline='') as f :
+            writer = csv.writer(f)
+            writer.writerow(['stage', 'calls', 'seconds', 'bytes', 'MB_per_s', 'share'])
+            for stage, s in summary['stages'].items() :
+                writer.writerow([stage, s['calls'], s['seconds'], s['bytes'], s['MB_per_s'], s['share']])
+
+
+_stage_recorder = None
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+def enable_stage_recording(recorder: StageRecorder=None) -> StageRecorder :
+    """ sets the (global) recorder, which all instrumented stages report to, and returns it """
+    global _stage_recorder
+    _stage_recorder = StageRecorder() if recorder is None else recorder
+    return _stage_recorder
+
+def disable_stage_recording() -> StageRecorder :
+    """ stops the recording of all stages and returns the recorder, that has been active (or None) """
+    global _stage_recorder
+    recorder, _stage_recorder = _stage_recorder, None
+    return recorder
+
+def get_stage_recorder() -> StageRecorder :
+    """ returns the active (global) recorder, None if recording is disabled """
+    return _stage_recorder
+
+def record_stage(stage: str, n_bytes: int=0) :
+    """returns a context manager, that reports the wall time of its body to the active recorder
+    >>> with recording disabled, a shared no-op context is returned (i.e. one global lookup per call)
+    Args:
+        stage (str): name of the stage
+        n_bytes (int, optional): bytes processed by the stage (i.e. of its input buffer). Defaults to 0.
+    """
+    if _stage_recorder is None :
+        return _NULL_CONTEXT
+    return _stage_recorder.record(stage, n_bytes)
+
+def recorded_stage(stage: str) :
+    """ decorator, that reports each call of a function as stage (bytes := size of its first array argument) """
+    def decorator(fct) :
+        @functools.wraps(fct)
+        def wrapper(*args, **kwargs) :
+            if _stage_recorder is None :
+                return fct(*args, **kwargs)
+            n_bytes = next((a.nbytes for a in args if isinstance(a, np.ndarray)), 0)
+            with _stage_recorder.record(stage, n_bytes) :
+                return fct(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# for testing and debugging purposes
+if __name__ == '__main__' :
+    print("[INFO:] Running from < octstagerecorder.py > ...")
+    n_calls = 10**6
+    t1 = time.perf_counter()
+    for _ in range(n_calls) :
+        with record_stage('disabled') :
+            pass
+    print(f"Overhead (disabled): {(time.perf_counter() - t1) / n_calls * 1e9:.0f} ns per call")
+    recorder = enable_stage_recording()
+    t1 = time.perf_counter()
+    for _ in range(n_calls) :
+        with record_stage('enabled', 8) :
+            pass
+    print(f"Overhead (enabled): {(time.perf_counter() - t1) / n_calls * 1e9:.0f} ns per call")
+    recorder.print_summary()
@@ -21,6 +21,7 @@ import matplotlib.pyplot as plt
 # custom imports
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'Config')))
 # sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'Backend'))) # TBD
+from octstagerecorder import recorded_stage
 
 
 class OctVolumeResmapler():
@@ -30,6 +31,7 @@ class OctVolumeResmapler():
         assert vol.ndim == 3
         self.vol = vol        
 
+    @recorded_stage('resample_volume')
     def resample_volume(self, scaling: tuple, is_crop: bool, crop: tuple) -> np.array:
         """Method that takes an OCT volume (reshaped properly with its optical axis notation (z,x,y))
         and interpolates its output size as (Z * scaling.z, X * scaling.x, Y * scaling.y), with an option 
@@ -22,7 +22,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..',
 
 from octdatafilemanager import OctDataFileManager as OctImport
 from octreconstructionmanager import OctReconstructionManager
-from configdatamanager import ConfigDataManager 
+from reconparamsmanager import load_recon_params 
 
 #---------------------------------------
 def find_nearest(array, value) -> tuple:
@@ -144,13 +144,13 @@ def plot_all_recon_data(data: np.array, aScan_range: tuple) -> None:
     """ Meant to visualize the plot in function body """
     recon_data = []
     REC = OctReconstructionManager()
+    params = load_recon_params('DefaultReconParams')
     for scan in range(data.shape[1]):
-        recon_scan = REC._run_reconstruction_from_json(data[:,scan], 'DefaultReconParams')
+        recon_scan = REC._run_reconstruction_from_params(data[:,scan], params)
         recon_data.append(recon_scan)
     recon_data = np.swapaxes(recon_data, 0, 1)
     data = crop_data_range(recon_data, aScan_range)
-    JSON = ConfigDataManager(filename='DefaultReconParams').load_json_file()
-    dc_crop = JSON['dc_crop_samples']
+    dc_crop = params.dc_crop_samples
     fig = plot_all_scans_in_stack(recon_data, 
                                   title=f'Reconstructed OCT Signals (cropped DC samples = ({data.shape[0]-dc_crop}/{data.shape[0]}))',
                                   x_label="Optical Depth [a.u.]", 
@@ -246,8 +246,9 @@ def plot_ascan_and_background(sig_path: str=r"C:\Users\PhilippsLabLaptop\Downloa
         
     # reconstruct A-scans
     REC = OctReconstructionManager()
-    subbed_recon_sig = REC._run_reconstruction_from_json(subbed_mean_sig, 'DefaultReconParams')
-    recon_sig = REC._run_reconstruction_from_json(mean_sig, 'DefaultReconParams')
+    params = load_recon_params('DefaultReconParams')
+    subbed_recon_sig = REC._run_reconstruction_from_params(subbed_mean_sig, params)
+    recon_sig = REC._run_reconstruction_from_params(mean_sig, params)
     
     def find_nearest(array, value) -> tuple:
         array = np.asarray(array)
@@ -260,7 +261,6 @@ def plot_ascan_and_background(sig_path: str=r"C:\Users\PhilippsLabLaptop\Downloa
     print(f"peak position: {peak}, left most -3dB position: {half_fwhm}, results in FWHM: {fwhm}[pxls]")
     
     # --- Plot ---
-    JSON = ConfigDataManager('DefaultReconParams').load_json_file() 
     fig, ax = plt.subplots(2, 2)
     # raw data - SIG/BG single and averaged
     ax[0,0].plot(signal[:,0], label = 'OCT Fringe Signal')
@@ -284,8 +284,8 @@ def plot_ascan_and_background(sig_path: str=r"C:\Users\PhilippsLabLaptop\Downloa
     ax[1,0].legend(loc='lower left')
     ax[1,0].set_title("Zoom-in on OCT raw fringes")
     # zoom-in on rconstructed signal
-    ax[1,1].plot(recon_sig[:recon_sig.shape[0]//10], label=f"Reconstructed Averaged A-scan\n({JSON['dispersion_coefficients']}) and a FWHM of\n{round(fwhm*pixel_pitch, 2)}µm [{fwhm}pxls] (air -> n=1)\n({round(fwhm*pixel_pitch/1.36, 2)}µm (tissue -> n=1.36)")  
-    ax[1,1].plot(subbed_recon_sig[:1500], label=f"Reconstructed Averaged & BG-subbed A-scan\n({JSON['dispersion_coefficients']}) and a FWHM of\n{round(fwhm*pixel_pitch, 2)}µm [{fwhm}pxls] (air -> n=1)\n({round(fwhm*pixel_pitch/1.36, 2)}µm (tissue -> n=1.36)")
+    ax[1,1].plot(recon_sig[:recon_sig.shape[0]//10], label=f"Reconstructed Averaged A-scan\n({params.dispersion_coefficients}) and a FWHM of\n{round(fwhm*pixel_pitch, 2)}µm [{fwhm}pxls] (air -> n=1)\n({round(fwhm*pixel_pitch/1.36, 2)}µm (tissue -> n=1.36)")  
+    ax[1,1].plot(subbed_recon_sig[:1500], label=f"Reconstructed Averaged & BG-subbed A-scan\n({params.dispersion_coefficients}) and a FWHM of\n{round(fwhm*pixel_pitch, 2)}µm [{fwhm}pxls] (air -> n=1)\n({round(fwhm*pixel_pitch/1.36, 2)}µm (tissue -> n=1.36)")
     ax[1,1].legend(loc='upper left')
     ax[1,1].set_title("Zoom-in on Reconstructed Averged A-scans with Axial Resolution")
     # show all subplots
@@ -0,0 +1,106 @@
+"""
+                                        ******
+        Author: @Philipp Matten - philipp.matten@meduniwien.ac.at / philipp.matten@gmx.de
+
+                                    Copyright 2023
+                                        ******
+
+    >>> file with a typed, validated and immutable container for the OCT reconstruction parameters,
+        that are parsed (once) from a *.JSON-config-file, i.e. < DefaultReconParams.json >
+
+"""
+
+# global imports
+import os
+from dataclasses import dataclass, fields
+
+# custom imports
+from configdatamanager import ConfigDataManager
+
+
+WINDOWING_KEYS = ('hann', 'hamm', 'kaiser', 'gauss')
+
+
+@dataclass(frozen=True)
+class ReconParams() :
+    """
+    >>> immutable set of reconstruction parameters - field names are identical to the keys in the JSON-config-file
+    NOTE: instances are hashable and can therefore directly be used as cache keys
+    """
+    windowing_key: str
+    dispersion_coefficients: tuple
+    disp_scale_factor: float
+    black_lvl_for_dis: float
+    dc_crop_samples: int
+    hf_crop_samples: int
+    zeros_to_pad: int
+    is_scale_data_for_display: bool
+    is_substract_background: bool
+
+    def __post_init__(self) -> None :
+        # JSON-lists are not hashable -> store coefficients as tuple
+        object.__setattr__(self, 'dispersion_coefficients', tuple(self.dispersion_coefficients))
+        self.validate()
+
+    def validate(self) -> None :
+        """ raises ValueError if any of the parameters is of the wrong type or out of range """
+        if not isinstance(self.windowing_key, str) or self.windowing_key.lower() not in WINDOWING_KEYS :
+            raise ValueError(f"Unrecognized windowing key '{self.windowing_key}' (expected one of {WINDOWING_KEYS})")
+        if len(self.dispersion_coefficients) == 0 or not all(_is_number(c) for c in self.dispersion_coefficients) :
+            raise ValueError(f"Dispersion coefficients must be a non-empty list of numbers (got {self.dispersion_coefficients})")
+        for name in ('disp_scale_factor', 'black_lvl_for_dis') :
+            if not _is_number(getattr(self, name)) :
+                raise ValueError(f"'{name}' must be a number (got {getattr(self, name)})")
+        if self.disp_scale_factor == 0 :
+            raise ValueError("'disp_scale_factor' must not be 0")
+        for name in ('dc_crop_samples', 'hf_crop_samples', 'zeros_to_pad') :
+            if not isinstance(getattr(self, name), int) or isinstance(getattr(self, name), bool) or getattr(self, name) < 0 :
+                raise ValueError(f"'{name}' must be a positive integer (got {getattr(self, name)})")
+        for name in ('is_scale_data_for_display', 'is_substract_background') :
+            if not isinstance(getattr(self, name), bool) :
+                raise ValueError(f"'{name}' must be a boolean (got {getattr(self, name)})")
+
+    @classmethod
+    def from_dict(cls, json_object: dict) -> 'ReconParams' :
+        """ returns validated parameters from a parsed JSON-object (unknown keys are ignored) """
+        names = [f.name for f in fields(cls)]
+        missing = [n for n in names if n not in json_object]
+        if missing :
+            raise ValueError(f"Reconstruction parameters are missing the key(s) {missing}")
+        unknown = [k for k in json_object if k not in names]
+        if unknown :
+            print(f"[WARNING:] Ignoring unknown reconstruction parameter(s) {unknown}")
+        return cls(**{n: json_object[n] for n in names})
+
+
+def _is_number(value) -> bool :
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+# in-process cache {full file path: (modification time, parameters)}
+_recon_params_cache = {}
+
+def load_recon_params(json_config_file: str) -> ReconParams :
+    """returns the reconstruction parameters of a JSON-config-file, which is only parsed again, if it changed on disk
+    Args:
+        json_config_file (str): file name (without *.json) in the Config-folder or full path w/o extension,
+        ALTERNATIVELY an already loaded ReconParams-instance, which is returned as is
+    Returns:
+        ReconParams: validated, immutable reconstruction parameters
+    """
+    if isinstance(json_config_file, ReconParams) :
+        return json_config_file
+    CONFIG = ConfigDataManager(filename=json_config_file)
+    mtime = os.stat(CONFIG.full_file_path).st_mtime_ns
+    cached = _recon_params_cache.get(CONFIG.full_file_path)
+    if cached is not None and cached[0] == mtime :
+        return cached[1]
+    params = ReconParams.from_dict(CONFIG.load_json_file())
+    _recon_params_cache[CONFIG.full_file_path] = (mtime, params)
+    return params
+
+
+# for testing and debugging purposes
+if __name__ == '__main__' :
+    print("[INFO:] Running from     < reconparamsmanager.py >   ...")
+    print(load_recon_params('DefaultReconParams'))
@@ -0,0 +1,96 @@
+"""
+                                        ******
+        Author: @Philipp Matten - philipp.matten@meduniwien.ac.at / philipp.matten@gmx.de
+
+                                    Copyright 2023
+                                        ******
+
+        >>> Contains the (bounded-memory) LRU cache of reconstructed B-scans of the Recon GUI, so that scrolling
+            through previously displayed B-scans does not trigger their reconstruction again
+
+"""
+
+# global imports
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+# default upper limit for the cached B-scans, i.e. ~27 B-scans of 6656x700 A-scans (float32 dB, one Fourier-plane of the 2x zero-padded FFT)
+DEFAULT_CACHE_BYTES = 512 * 1024**2
+
+
+class BScanCache() :
+    """
+    >>> Least-recently-used cache of reconstructed B-scans (in dB, i.e. independent of the display parameters), 
+    keyed by (axis, index, reconstruction-parameter key)
+    NOTE: a change of the display parameters (black level, scale) keeps all entries, since they are only scaled for display,
+    a change of the reconstruction parameters drops all entries of other reconstruction parameters
+    NOTE: thread-safe, since it is filled by the reconstruction worker and read in the GUI thread
+    """
+    def __init__(self, max_bytes: int=DEFAULT_CACHE_BYTES) -> None :
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # (axis, index, recon. key) -> B-scan
+        self.n_bytes = 0
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def __len__(self) -> int :
+        return len(self._entries)
+
+    def get(self, axis: int, index: int, recon_key: tuple) -> np.ndarray :
+        """ returns the cached B-scan (and marks it as most recently used), None if there is none for these parameters """
+        with self._lock :
+            bScan = self._entries.get((axis, index, recon_key))
+            if bScan is None :
+                self.n_misses += 1
+                return None
+            self._entries.move_to_end((axis, index, recon_key))
+            self.n_hits += 1
+            return bScan
+
+    def put(self, axis: int, index: int, recon_key: tuple, bScan: np.ndarray) -> None :
+        """ adds a B-scan and evicts the least recently used ones, until the cache is within its memory budget
+        (B-scans, that are larger than the entire budget, are not cached) """
+        if bScan.nbytes > self.max_bytes :
+            return
+        bScan.setflags(write=False) # entries are shared between threads
+        with self._lock :
+            self._remove((axis, index, recon_key))
+            self._entries[(axis, index, recon_key)] = bScan
+            self.n_bytes += bScan.nbytes
+            while self.n_bytes > self.max_bytes :
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: tuple) -> None :
+        bScan = self._entries.pop(key, None)
+        if bScan is not None :
+            self.n_bytes -= bScan.nbytes
+
+    def has_reconstruction(self, recon_key: tuple) -> bool :
+        """ returns True, if there are entries of these reconstruction parameters (i.e. they have not been invalidated) """
+        with self._lock :
+            return any(key[2] == recon_key for key in self._entries)
+
+    def invalidate_reconstruction(self, recon_key: tuple) -> None :
+        """ drops all entries of other reconstruction parameters """
+        with self._lock :
+            for key in [k for k in self._entries if k[2] != recon_key] :
+                self._remove(key)
+
+    def clear(self) -> None :
+        """ drops all entries, i.e. when another volume is loaded """
+        with self._lock :
+            self._entries.clear()
+            self.n_bytes = 0
+
+
+# for testing and debugging purposes
+if __name__ == '__main__' :
+    print("[INFO:] Running from < bscancache.py > ...")
+    cache = BScanCache(max_bytes=3 * 1024**2)
+    for idx in range(5) :
+        cache.put(1, idx, ('recon',), np.zeros((1024, 1024), dtype=np.uint8))
+    print(f"{len(cache)} entries ({cache.n_bytes / 1024**2:.0f} MB), oldest cached index: {next(iter(cache._entries))[1]}")
+    print(f"Hit: {cache.get(1, 4, ('recon',)) is not None}, other recon params: {cache.get(1, 4, ('other',)) is not None}")
@@ -0,0 +1,110 @@
+"""
+                                        ******
+        Author: @Philipp Matten - philipp.matten@meduniwien.ac.at / philipp.matten@gmx.de
+
+                                    Copyright 2023
+                                        ******
+
+        >>> Contains the neighbour prefetcher of the Recon GUI, which reconstructs the B-scans next to the displayed ones
+            (on both axes) in a background thread pool into the B-scan cache, while the user is idle
+
+"""
+
+# global imports
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# custom imports
+from bscancache import DEFAULT_CACHE_BYTES
+
+
+# default upper limit for the prefetched B-scans of one position (at most half of the cache, so that prefetching
+# never evicts all previously displayed B-scans)
+DEFAULT_PREFETCH_BYTES = DEFAULT_CACHE_BYTES // 2
+
+
+class BScanPrefetcher() :
+    """
+    >>> Reconstructs the +/-N neighbouring B-scans of the displayed pair (closest first, alternating between both axes)
+    with the settings of the displayed request into the B-scan cache
+    NOTE: prefetching is scheduled by the reconstruction worker once its (foreground) job has finished, queued B-scans
+    are dropped as soon as a newer request is submitted (different position or parameters) and running ones are
+    not cached, if their parameters have changed meanwhile
+    """
+    def __init__(self, reconstruct_bScan, cache, is_stale, n_neighbours: int=4, n_threads: int=None,
+                 max_bytes: int=DEFAULT_PREFETCH_BYTES) -> None :
+        """
+        Args:
+            reconstruct_bScan: fct(request, raw B-scan) -> reconstructed B-scan, i.e. < BScanReconstructionWorker.reconstruct_bScan() >
+            cache (BScanCache): cache of the reconstructed B-scans
+            is_stale: fct(job id) -> True, if a newer request has been submitted
+            n_neighbours (int, optional): B-scans on each side of the displayed ones (per axis). Defaults to 4.
+            n_threads (int, optional): threads of the pool. Defaults to None (-> half of the cores, the GUI and
+            the foreground reconstruction keep the others).
+            max_bytes (int, optional): upper limit for the prefetched B-scans of one position. Defaults to DEFAULT_PREFETCH_BYTES.
+        """
+        self.reconstruct_bScan = reconstruct_bScan
+        self.cache = cache
+        self.is_stale = is_stale
+        self.n_neighbours = n_neighbours
+        self.max_bytes = min(max_bytes, cache.max_bytes // 2)
+        if n_threads is None :
+            n_threads = max(1, (os.cpu_count() or 1) // 2)
+        self._executor = ThreadPoolExecutor(max_workers=n_threads, thread_name_prefix='BScanPrefetcher')
+        self._lock = threading.Lock()
+        self._futures = []
+
+    def get_neighbours(self, request) -> list :
+        """ returns (axis, index) of the neighbouring B-scans of a request, sorted by their distance to the displayed ones """
+        neighbours = []
+        for distance in range(1, self.n_neighbours + 1) :
+            for axis, idx in ((2, request.left_idx), (1, request.right_idx)) :
+                for neighbour in (idx + distance, idx - distance) :
+                    if 0 <= neighbour < request.volume.shape[axis] :
+                        neighbours.append((axis, neighbour))
+        return neighbours
+
+    def prefetch(self, job_id: int, request) -> None :
+        """ (non-blocking) schedules the uncached neighbours of the request, as many as fit into the memory budget
+        (estimated from the size of the displayed, already cached B-scans) """
+        self.cancel()
+        recon_key = request.get_recon_key()
+        n_bytes = {axis : getattr(self.cache.get(axis, idx, recon_key), 'nbytes', None)
+                   for axis, idx in request.get_bScan_indices()}
+        budget = self.max_bytes
+        futures = []
+        for axis, idx in self.get_neighbours(request) :
+            if n_bytes[axis] is None or n_bytes[axis] > budget :
+                break
+            if self.cache.get(axis, idx, recon_key) is None :
+                budget -= n_bytes[axis]
+                futures.append( self._executor.submit(self._prefetch_bScan, job_id, request, axis, idx) )
+        with self._lock :
+            self._futures = futures
+
+    def _prefetch_bScan(self, job_id: int, request, axis: int, idx: int) -> None :
+        if self.is_stale(job_id) : # user moved on or changed parameters -> drop queued work
+            return
+        recon_key = request.get_recon_key()
+        if self.cache.get(axis, idx, recon_key) is not None :
+            return
+        try :
+            bScan = self.reconstruct_bScan(request, request.get_raw_bScan(axis, idx)) # read lazily, in the pool thread
+        except Exception as e : # i.e. invalid parameter combinations are reported by the foreground reconstruction
+            print(f"[WARNING:] Prefetching of B-scan {idx} (axis {axis}) failed ({e})")
+            return
+        if not self.is_stale(job_id) or self.cache.has_reconstruction(recon_key) : # i.e. only the position has changed
+            self.cache.put(axis, idx, recon_key, bScan)
+
+    def cancel(self) -> None :
+        """ drops all queued (not yet running) prefetches """
+        with self._lock :
+            futures, self._futures = self._futures, []
+        for future in futures :
+            future.cancel()
+
+    def shutdown(self) -> None :
+        """ drops all queued prefetches and stops the pool (without waiting for running ones) """
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,260 @@
+"""
+                                        ******
+        Author: @Philipp Matten - philipp.matten@meduniwien.ac.at / philipp.matten@gmx.de
+
+                                    Copyright 2023
+                                        ******
+
+        >>> Contains the reconstruction worker of the Recon GUI, which reconstructs the displayed pair of B-scans
+            in its own QThread (see < functionality_tests.py >), so that the UI stays responsive during reconstructions
+
+"""
+
+# global imports
+import os
+import sys
+import cv2
+import time
+import threading
+import numpy as np
+from dataclasses import dataclass, field
+from PyQt5 import QtCore, QtGui
+
+# custom imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'BackEnd')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..', 'Config')))
+
+from octreconstructionmanager import OctReconstructionManager
+from bscancache import BScanCache, DEFAULT_CACHE_BYTES
+from bscanprefetcher import BScanPrefetcher
+
+
+# frame rate, that the (decimated) previews during slider drags should keep up with
+TARGET_PREVIEW_FPS = 15
+# upper limit for the lateral decimation of previews (every n-th A-scan is reconstructed)
+MAX_PREVIEW_DECIMATION = 16
+
+
+@dataclass(frozen=True)
+class BScanReconstructionRequest() :
+    """
+    >>> snapshot of the GUI settings for the reconstruction of the displayed pair of B-scans
+    NOTE: created in the GUI thread, so the worker never reads widgets (or attributes), that change while it runs
+    """
+    volume: object = field(compare=False) # (memory-mapped) raw volume with A-scans along axis 0
+    left_idx: int # index of the vertical/left B-scan (along axis 2)
+    right_idx: int # index of the horizontal/right B-scan (along axis 1)
+    disp_coeffs: tuple
+    wind_key: str
+    sigma: int
+    samples_hf_crop: int
+    samples_dc_crop: int
+    scale_fac: float
+    blck_lvl: float
+    background: np.ndarray = field(default=None, compare=False)
+    decimation: int = 1 # > 1 := preview, that only reconstructs every n-th A-scan (never cached)
+
+    @property
+    def is_preview(self) -> bool :
+        return self.decimation > 1
+
+    def get_recon_key(self) -> tuple :
+        """ returns the (hashable) key of all parameters, that the reconstructed B-scans depend on, except for display
+        NOTE: volume and background only change, when data is loaded (-> cache is cleared), previews are not cached """
+        return (id(self.volume), self.disp_coeffs, self.wind_key, self.sigma, self.samples_hf_crop, self.samples_dc_crop,
+                self.background is not None)
+
+    def get_bScan_indices(self) -> tuple :
+        """ returns (axis, index) of the vertical/left and the horizontal/right B-scan """
+        return ((2, self.left_idx), (1, self.right_idx))
+
+    def get_raw_bScan(self, axis: int, idx: int) -> np.ndarray :
+        """ returns the raw B-scan at idx along axis (decimated for previews), which is read from the (memory-mapped) 
+        volume - only called in the worker (pool) threads, i.e. for B-scans, which are not cached """
+        if axis == 2 :
+            return np.asarray( self.volume[:, ::self.decimation, idx] )
+        return np.asarray( self.volume[:, idx, ::self.decimation] )
+
+
+def convert_bScan_to_qimage(recon: np.ndarray) -> QtGui.QImage :
+    """ returns a (deep-copied) grayscale QImage of a reconstructed uint8 B-scan, i.e. to be passed between threads """
+    recon = np.ascontiguousarray( cv2.cvtColor( recon, cv2.COLOR_BAYER_GR2GRAY ) )
+    return QtGui.QImage(recon.data, recon.shape[1], recon.shape[0], recon.strides[0], QtGui.QImage.Format_Grayscale8).copy()
+
+
+class BScanReconstructionWorker(QtCore.QObject) :
+    """
+    >>> Reconstructs the requested pair of B-scans in its own thread and posts the finished QImages back via signals
+    NOTE: reconstructed B-scans are kept in dB (float32) in a LRU-cache (< bscancache.py >), so that revisited B-scans are
+    displayed instantly and changes of the display parameters (black level, scale) only re-run the scaling to display range
+    NOTE: once the displayed B-scans are finished, their neighbours are prefetched into the cache (< bscanprefetcher.py >)
+    NOTE: requests are coalesced (latest wins) - a request, that is submitted while the worker is busy, replaces any
+    pending one, and the running job is cancelled (between its stages) as soon as it is stale,
+    i.e. rapid changes of spin boxes or sliders only trigger the reconstruction of their latest setting
+    NOTE: during slider drags, the GUI requests laterally decimated previews, whose decimation is chosen from the measured 
+    reconstruction latency (see < get_preview_decimation() >), the full-resolution B-scans follow once the slider is released
+    """
+    signalBScansReconstructed = QtCore.pyqtSignal(int, QtGui.QImage, QtGui.QImage) # job id, left and right B-scan
+    signalReconstructionFailed = QtCore.pyqtSignal(int, str) # job id, error message
+
+    def __init__(self, dtype_loading='>u2', cache_bytes: int=DEFAULT_CACHE_BYTES, n_prefetch: int=4, 
+                 target_fps: float=TARGET_PREVIEW_FPS) -> None :
+        super().__init__()
+        self.target_fps = target_fps
+        self.seconds_per_aScan = None # (exponentially smoothed) latency of loading and reconstructing one A-scan
+        self.REC = OctReconstructionManager(dtype_loading) # own instance -> no state is shared with the GUI thread
+        self.cache = BScanCache(cache_bytes)
+        self.prefetcher = BScanPrefetcher(self.reconstruct_bScan, self.cache, self.is_stale, n_neighbours=n_prefetch)
+        self._last_request = None
+        self._condition = threading.Condition()
+        self._pending = None # (job id, request)
+        self._latest_job_id = 0
+        self._is_running = True
+
+    def submit(self, request: BScanReconstructionRequest) -> int :
+        """ (called from the GUI thread) replaces the pending request and returns its job id """
+        self.prefetcher.cancel() # neighbours of the previous request
+        with self._condition :
+            self._invalidate_cache(request)
+            self._latest_job_id += 1
+            self._pending = (self._latest_job_id, request)
+            self._condition.notify()
+            return self._latest_job_id
+
+    def get_cached_images(self, request: BScanReconstructionRequest) -> tuple :
+        """(called from the GUI thread) returns the images of a request, if both B-scans are cached (only scaled to the 
+        display range of the request) - the request counts as submitted (and finished), i.e. the running and pending jobs 
+        become stale
+        Returns:
+            tuple: job id, left and right image, or None (-> submit the request)
+        """
+        with self._condition :
+            self._invalidate_cache(request)
+            bScans = [self.cache.get(axis, idx, request.get_recon_key()) for axis, idx in request.get_bScan_indices()]
+            if any(bScan is None for bScan in bScans) :
+                return None
+            self._latest_job_id += 1
+            self._pending = None
+            self.prefetcher.prefetch(self._latest_job_id, request)
+            return (self._latest_job_id, *[convert_bScan_to_qimage(self.scale_bScan(request, bScan)) for bScan in bScans])
+
+    def _invalidate_cache(self, request: BScanReconstructionRequest) -> None :
+        """ drops the cached B-scans of other reconstruction parameters, if the request changed them (display changes keep all entries) """
+        last, self._last_request = self._last_request, request
+        if last is None :
+            return
+        if last.get_recon_key() != request.get_recon_key() :
+            self.cache.invalidate_reconstruction(request.get_recon_key())
+
+    def clear_cache(self) -> None :
+        """ (called from the GUI thread) drops all cached B-scans, i.e. when another volume is loaded """
+        with self._condition :
+            self._last_request = None
+            self.cache.clear()
+
+    def is_stale(self, job_id: int) -> bool :
+        """ returns True, if a newer request has been submitted since the job with job_id """
+        with self._condition :
+            return job_id != self._latest_job_id or not self._is_running
+
+    def stop(self) -> None :
+        """ (called from the GUI thread) stops the worker loop after the current stage, pending requests are discarded """
+        with self._condition :
+            self._is_running = False
+            self._pending = None
+            self._condition.notify_all()
+        self.prefetcher.shutdown()
+
+    def _take_next_request(self) -> tuple :
+        """ blocks until a request is pending and returns it, (None, None) if the worker has been stopped """
+        with self._condition :
+            while self._pending is None and self._is_running :
+                self._condition.wait()
+            if not self._is_running :
+                return None, None
+            job, self._pending = self._pending, None
+            return job
+
+    def get_preview_decimation(self, request: BScanReconstructionRequest) -> int :
+        """ returns the (power of 2) lateral decimation, at which the pair of B-scans of a request is expected to be loaded
+        and reconstructed within one frame of the target frame rate """
+        if self.seconds_per_aScan is None : # nothing measured yet
+            return 4
+        n_aScans = request.volume.shape[1] + request.volume.shape[2] # left and right B-scan
+        decimation = n_aScans * self.seconds_per_aScan * self.target_fps
+        return int(np.clip(1 << int(np.ceil(np.log2(max(decimation, 1)))), 1, MAX_PREVIEW_DECIMATION))
+
+    def _update_latency(self, seconds: float, n_aScans: int) -> None :
+        seconds_per_aScan = seconds / max(n_aScans, 1)
+        if self.seconds_per_aScan is None :
+            self.seconds_per_aScan = seconds_per_aScan
+        else :
+            self.seconds_per_aScan += 0.3 * (seconds_per_aScan - self.seconds_per_aScan)
+
+    def reconstruct_bScan(self, request: BScanReconstructionRequest, raw: np.ndarray) -> np.ndarray :
+        """ returns the reconstructed B-scan in dB (float32, not scaled to display range) of a raw B-scan with the 
+        settings of the request - the intermediate, that is kept in the cache
+        NOTE: the display parameters are not passed, so that the (LRU-cached) plan only depends on the reconstruction parameters """
+        return self.REC._run_reconstruction(raw,
+                                            disp_coeffs=request.disp_coeffs,
+                                            wind_key=request.wind_key,
+                                            sigma=request.sigma,
+                                            samples_hf_crop=request.samples_hf_crop,
+                                            samples_dc_crop=request.samples_dc_crop,
+                                            is_bg_sub=request.background is not None,
+                                            show_scaled_data=False,
+                                            background=request.background)
+
+    def scale_bScan(self, request: BScanReconstructionRequest, bScan_dB: np.ndarray) -> np.ndarray :
+        """ returns the (uint8) B-scan in display range of the request, i.e. the only step that depends on black level and scale """
+        return self.REC.return_scaled(bScan_dB, black_lvl=request.blck_lvl, disp_scale=request.scale_fac)
+
+    @QtCore.pyqtSlot()
+    def run(self) -> None :
+        """ worker loop (started with the thread): reconstructs the latest request, skips the remaining stages of stale jobs """
+        while True :
+            job_id, request = self._take_next_request()
+            if request is None :
+                return
+            try :
+                images = []
+                recon_key = request.get_recon_key()
+                for axis, idx in request.get_bScan_indices() :
+                    if self.is_stale(job_id) :
+                        break
+                    bScan = None if request.is_preview else self.cache.get(axis, idx, recon_key)
+                    if bScan is None :
+                        t1 = time.perf_counter()
+                        raw = request.get_raw_bScan(axis, idx) # only uncached B-scans are read from disk
+                        bScan = self.reconstruct_bScan(request, raw)
+                        self._update_latency(time.perf_counter() - t1, raw.shape[1])
+                        if not request.is_preview :
+                            self.cache.put(axis, idx, recon_key, bScan) # display-independent (dB) -> kept on display changes
+                    images.append( convert_bScan_to_qimage(self.scale_bScan(request, bScan)) )
+                if len(images) == 2 and not self.is_stale(job_id) :
+                    self.signalBScansReconstructed.emit(job_id, *images)
+                    if not request.is_preview :
+                        self.prefetcher.prefetch(job_id, request) # user is idle until the next request
+            except Exception as e : # worker must survive i.e. invalid parameter combinations
+                self.signalReconstructionFailed.emit(job_id, str(e))
+
+
+# for testing and debugging purposes
+if __name__ == '__main__' :
+    print("[INFO:] Running from < bscanreconstructionworker.py > ...")
+    from PyQt5 import QtWidgets
+    from octfringesimulator import simulate_bScan
+    app = QtWidgets.QApplication(sys.argv)
+    volume = np.stack([simulate_bScan(2048, 64, seed=s) for s in range(64)], axis=-1)
+    worker, thread = BScanReconstructionWorker(), QtCore.QThread()
+    worker.moveToThread(thread)
+    thread.started.connect(worker.run)
+    worker.signalBScansReconstructed.connect(lambda job_id, left, right : print(f"Job {job_id} finished: {left.size()}"))
+    thread.start()
+    for c in range(10) : # rapid changes -> only the latest one(s) get reconstructed
+        worker.submit(BScanReconstructionRequest(volume, c, c, (-5, 125, 0, 0), 'hann', None, 0, 25, 64, 77))
+    QtCore.QTimer.singleShot(2000, app.quit)
+    app.exec_()
+    worker.stop()
+    thread.quit()
+    thread.wait()
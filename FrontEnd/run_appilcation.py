@@ -14,6 +14,7 @@ import os
 import cv2
 import sys
 import numpy as np
+from dataclasses import replace
 from PyQt5 import QtCore, QtGui, QtWidgets
 import matplotlib.pyplot as plt # debug
 from matplotlib.figure import Figure
@@ -25,6 +26,8 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..',
 
 # import backend module(s)
 from octreconstructionmanager import OctReconstructionManager
+from octbackgroundmanager import get_background_file_path, load_background
+from bscanreconstructionworker import BScanReconstructionWorker, BScanReconstructionRequest
 # from guidesignparamatermanager import GuiConfigDataManager
 
 
@@ -673,6 +676,7 @@ class UiWindowDialog(object) :
         self.flag_loaded_oct_data = False
         self.flag_calculate_enface = False
         self.disp_coeffs_tuple = (0,0,0,0)
+        self.background = None # volume-wide background A-scan (from calibration file next to the raw data)
 
         # set all style elements in UI
         self.retranslateUi(Dialog)
@@ -681,6 +685,17 @@ class UiWindowDialog(object) :
         # ***** FROM BACKEND / SIGNALS AND CONNECTIONS *****
         ####################################################
         self.REC = OctReconstructionManager(self.data_endianness)
+        
+        # reconstructions of the displayed B-scans run in a worker thread (latest request wins) -> UI stays responsive
+        self.recon_worker = BScanReconstructionWorker(self.data_endianness)
+        self.recon_thread = QtCore.QThread()
+        self.recon_worker.moveToThread(self.recon_thread)
+        self.recon_thread.started.connect(self.recon_worker.run)
+        self.recon_worker.signalBScansReconstructed.connect(self.display_reconstructed_bScans)
+        self.recon_worker.signalReconstructionFailed.connect(self.display_reconstruction_error)
+        QtCore.QCoreApplication.instance().aboutToQuit.connect(self.stop_reconstruction_worker)
+        self.recon_thread.start()
+        self.recon_job_id = 0 # job id of the latest submitted reconstruction
     
         # START PROCESING: load OCT data
         self.pushButton_loadOctData.clicked.connect(self._load_oct_data)
@@ -708,30 +723,38 @@ class UiWindowDialog(object) :
         # if values in disp coeff boxes are change -> plot if curves is displayed and tuple with coeffs is updated
         self.spinBox_DispCoeffC0.valueChanged.connect(self.display_current_disp_curves)
         self.spinBox_DispCoeffC0.valueChanged.connect(self.update_disp_coeff_tuple)
-        # self.spinBox_DispCoeffC0.valueChanged.connect(self.run_recon_for_current_settings)
+        self.spinBox_DispCoeffC0.valueChanged.connect(self.request_live_reconstruction)
         self.spinBox_DispCoeffC1.valueChanged.connect(self.display_current_disp_curves)
         self.spinBox_DispCoeffC1.valueChanged.connect(self.update_disp_coeff_tuple)
-        # self.spinBox_DispCoeffC1.valueChanged.connect(self.run_recon_for_current_settings)
+        self.spinBox_DispCoeffC1.valueChanged.connect(self.request_live_reconstruction)
         self.spinBox_DispCoeffC2.valueChanged.connect(self.display_current_disp_curves)
         self.spinBox_DispCoeffC2.valueChanged.connect(self.update_disp_coeff_tuple)
-        # self.spinBox_DispCoeffC2.valueChanged.connect(self.run_recon_for_current_settings)
+        self.spinBox_DispCoeffC2.valueChanged.connect(self.request_live_reconstruction)
         self.spinBox_DispCoeffC3.valueChanged.connect(self.display_current_disp_curves)
         self.spinBox_DispCoeffC3.valueChanged.connect(self.update_disp_coeff_tuple)
-        # self.spinBox_DispCoeffC3.valueChanged.connect(self.run_recon_for_current_settings)
+        self.spinBox_DispCoeffC3.valueChanged.connect(self.request_live_reconstruction)
         
         # change of values for cropping and adjusting black level and scale for display
         self.spinBox_CropDcSamples.valueChanged.connect(self.update_dc_crop_samples)
         self.spinBox_CropHfSamples.valueChanged.connect(self.update_hf_crop_samples)
         self.spinBox_DisplayScale.valueChanged.connect(self.update_display_scale_value)
         self.spinBox_BlackLevel.valueChanged.connect(self.update_black_level_value)
+        for spinBox in (self.spinBox_CropDcSamples, self.spinBox_CropHfSamples, self.spinBox_DisplayScale, self.spinBox_BlackLevel) :
+            spinBox.valueChanged.connect(self.request_live_reconstruction) # after the update of the value (connection order)
+        self.comboBox_windowingOptions.activated.connect(self.request_live_reconstruction)
                         
         # couple B-scan display selection elements & set update dependecy of lines
         self.slideBar_leftBScanWindow.valueChanged['int'].connect(self.spinBox_leftBScanWindow.setValue)
         self.spinBox_leftBScanWindow.valueChanged['int'].connect(self.slideBar_leftBScanWindow.setValue)
         self.spinBox_leftBScanWindow.valueChanged['int'].connect(self.create_enface_display_widget)
+        self.spinBox_leftBScanWindow.valueChanged['int'].connect(self.request_live_reconstruction)
         self.slideBar_rightBScanWindow.valueChanged['int'].connect(self.spinBox_rightBScanWindow.setValue)
         self.spinBox_rightBScanWindow.valueChanged['int'].connect(self.slideBar_rightBScanWindow.setValue)
         self.spinBox_rightBScanWindow.valueChanged['int'].connect(self.create_enface_display_widget)
+        self.spinBox_rightBScanWindow.valueChanged['int'].connect(self.request_live_reconstruction)
+        # (decimated) previews while dragging -> full resolution, once the slider settles
+        self.slideBar_leftBScanWindow.sliderReleased.connect(self.request_live_reconstruction)
+        self.slideBar_rightBScanWindow.sliderReleased.connect(self.request_live_reconstruction)
         QtCore.QMetaObject.connectSlotsByName(Dialog)
 
 
@@ -771,11 +794,15 @@ class UiWindowDialog(object) :
     def _load_oct_data(self) -> None :
         """ loads user-selected file containing OCT data and created class-vars raw data buffer and dimensions """
         print("Loading OCT data... ")
-        # LOAD DATA FROM FILE: generates meta data of raw data from file name (<data_io> module)
-        buffer_oct_raw_data = self.REC.load_oct_data(dtype=self.data_endianness) 
-        print(f"Loaded selected data ( shape={buffer_oct_raw_data.shape} and dtype={buffer_oct_raw_data.dtype} ) into memory")
+        # OPEN DATA FILE: generates meta data of raw data from file name (<data_io> module)
+        # -> memory-mapped, only the B-scans that get displayed/reconstructed are paged in (and byte-swapped)
+        self.REC.dtype_loading = self.data_endianness
+        buffer_oct_raw_data = self.REC.open_oct_volume() 
+        print(f"Opened selected data ( shape={buffer_oct_raw_data.shape} and dtype={buffer_oct_raw_data.dtype_file} ) memory-mapped")
         self.buffer_oct_raw_data = buffer_oct_raw_data
+        self.recon_worker.clear_cache() # reconstructed B-scans of the previous volume
         self.dims_buffer_oct_raw_data = self.REC.oct_dims
+        self._load_background_calibration()
         self._update_oct_volume_dimension_display()
         # self._check_oct_data_dims() # check if established OCT volume dimensions are what was expected 
         self.flag_loaded_oct_data = True
@@ -783,6 +810,19 @@ class UiWindowDialog(object) :
         self.set_bScan_slider_max_values(self.dims_buffer_oct_raw_data[1], self.dims_buffer_oct_raw_data[2]) 
         
         
+    def _load_background_calibration(self) -> None :
+        """ loads the background calibration file of the loaded raw data (if there is one, i.e. from 
+        < octbackgroundmanager.estimate_volume_background() >) -> background is subtracted in all reconstructions """
+        self.background = None
+        full_file_path_background = get_background_file_path(self.REC.file_path_main)
+        if os.path.isfile(full_file_path_background) :
+            background = load_background(full_file_path_background)
+            if background.shape[0] == self.dims_buffer_oct_raw_data[0] :
+                self.background = background
+                print(f"Loaded background calibration {full_file_path_background}")
+            else :
+                print(f"[WARNING:] A-scan length of background calibration {full_file_path_background} does not match the data")
+        
     def create_enface_display_widget(self) -> None :
         """ creates an enface image with overlayed lines indicating the current B-scans and/or updates the display """
         if not self._is_no_oct_data_loaded():
@@ -894,47 +934,65 @@ class UiWindowDialog(object) :
         return self.enface
 
     def run_recon_for_current_settings(self) :
-        """ runs recosntruction from backend on cirrently selected pair of B-scans in volume """
+        """ runs recosntruction from backend on cirrently selected pair of B-scans in volume 
+        >>> the reconstruction is submitted to the worker thread, the B-scans are displayed in < display_reconstructed_bScans() > """
         if not self._is_no_oct_data_loaded():
             return
         print("Reconstructing...")
+        self._submit_reconstruction()
+    
+    def request_live_reconstruction(self) -> None :
+        """ re-reconstructs the displayed B-scans after a change of settings (w/o error window, if no data is loaded) """
+        if self.flag_loaded_oct_data :
+            self._submit_reconstruction()
+    
+    def _submit_reconstruction(self) -> None :
+        """ submits the current settings to the worker thread (replaces a pending reconstruction, the running one is cancelled)
+        >>> while a B-scan slider is dragged, uncached B-scans are only reconstructed as (laterally decimated) previews """
+        request = BScanReconstructionRequest(volume=self.buffer_oct_raw_data, 
+                                             left_idx=self.spinBox_leftBScanWindow.value()-1, 
+                                             right_idx=self.spinBox_rightBScanWindow.value()-1, 
+                                             disp_coeffs=tuple(self.disp_coeffs_tuple), 
+                                             wind_key=self.curr_wind_key[0], 
+                                             sigma=self.curr_wind_key[1], 
+                                             samples_hf_crop=self.samples_crop_hf, 
+                                             samples_dc_crop=self.samples_crop_dc, 
+                                             scale_fac=self.value_scaled_display, 
+                                             blck_lvl=self.value_black_level, 
+                                             background=self.background)
+        cached = self.recon_worker.get_cached_images(request) # previously displayed B-scans -> no round trip to the worker
+        if cached is not None :
+            self.recon_job_id = cached[0]
+            self.display_reconstructed_bScans(*cached)
+            return
+        if self.slideBar_leftBScanWindow.isSliderDown() or self.slideBar_rightBScanWindow.isSliderDown() :
+            # fast preview from every n-th A-scan (n adapted to the measured latency), stretched to the display size
+            request = replace(request, decimation=self.recon_worker.get_preview_decimation(request))
+        self.recon_job_id = self.recon_worker.submit(request)
+    
+    def display_reconstructed_bScans(self, job_id: int, img_left_vert: QtGui.QImage, img_right_hori: QtGui.QImage) -> None :
+        """ (slot in GUI thread) displays the B-scans of a finished reconstruction, unless a newer one has been submitted """
+        if job_id != self.recon_job_id :
+            return
         # create/update vertical/left scan (dims_buffer_oct_raw_data[1])
-        curr_vert_raw = self.buffer_oct_raw_data[:,:,self.spinBox_leftBScanWindow.value()-1]
-        curr_vert_recon = self.REC._run_reconstruction(curr_vert_raw, 
-                                                       disp_coeffs=self.disp_coeffs_tuple, 
-                                                       wind_key=self.curr_wind_key, 
-                                                       samples_hf_crop=self.samples_crop_hf, 
-                                                       samples_dc_crop=self.samples_crop_dc, 
-                                                       scale_fac=self.value_scaled_display, 
-                                                       blck_lvl=self.value_black_level,
-                                                       is_bg_sub=False,
-                                                       show_scaled_data=True)
-        curr_vert_recon = cv2.cvtColor( curr_vert_recon, cv2.COLOR_BAYER_GR2GRAY )
-        img_left_vert = QtGui.QImage(curr_vert_recon.data.tobytes(), 
-                                     curr_vert_recon.shape[1], curr_vert_recon.shape[0], 
-                                     QtGui.QImage.Format_Grayscale8)
         self.Left_BScanWindow.setPixmap( QtGui.QPixmap(img_left_vert) )
         self.Left_BScanWindow.setScaledContents(True) 
         # create/update horizontal/right scan (dims_buffer_oct_raw_data[2])
-        curr_hori_raw = self.buffer_oct_raw_data[:,self.spinBox_rightBScanWindow.value()-1]
-        curr_hori_recon = self.REC._run_reconstruction(curr_hori_raw, 
-                                                       disp_coeffs=self.disp_coeffs_tuple, 
-                                                       wind_key=self.curr_wind_key, 
-                                                       samples_hf_crop=self.samples_crop_hf, 
-                                                       samples_dc_crop=self.samples_crop_dc, 
-                                                       scale_fac=self.value_scaled_display, 
-                                                       blck_lvl=self.value_black_level,
-                                                       is_bg_sub=False,
-                                                       show_scaled_data=True)
-        curr_hori_recon = cv2.cvtColor( curr_hori_recon, cv2.COLOR_BAYER_GR2GRAY )
-        img_right_hori = QtGui.QImage(curr_hori_recon.data.tobytes(), 
-                                      curr_hori_recon.shape[1], curr_hori_recon.shape[0], 
-                                      QtGui.QImage.Format_Grayscale8)
         self.Right_BScanWindow.setPixmap( QtGui.QPixmap(img_right_hori) )
         self.Right_BScanWindow.setScaledContents(True) # 2 display reconstructed B-scan pain
         # update lines indicating the B-scan positions in the enface image 
         self.create_enface_display_widget()
     
+    def display_reconstruction_error(self, job_id: int, msg: str) -> None :
+        """ (slot in GUI thread) prints the error of a failed reconstruction """
+        print(f"[WARNING:] Reconstruction failed with the current settings ({msg})")
+    
+    def stop_reconstruction_worker(self) -> None :
+        """ stops the worker thread (when the application quits) """
+        self.recon_worker.stop()
+        self.recon_thread.quit()
+        self.recon_thread.wait()
+    
     def set_data_endianness(self) -> None :
         """ sets the endianness of the raw OCT data and reloads OCT data if it is changed"""
         # TODO: fix import and reloading of data!!!